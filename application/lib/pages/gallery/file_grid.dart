@@ -4,6 +4,7 @@ import 'package:provider/provider.dart';
 import '../viewer/photo_browser.dart';
 import '../../services/file_record.dart';
 import '../../services/api_service.dart';
+import '../../services/thumb_bundle.dart';
 import '../../utils/backend_provider.dart';
 import '../../utils/settings_provider.dart';
 import '../compare/image_compare.dart';
@@ -36,6 +37,11 @@ class _FileGridState extends State<FileGrid> {
   List<String> _sortedKeys = [];
   final Set<String> _collapsedGroups = {};
 
+  // 按显示顺序排列的文件，缩略图按页批量获取
+  List<FileRecord> _displayFiles = [];
+  Map<FileRecord, int> _displayIndex = {};
+  final Set<String> _requestedPages = {};
+
   // 选择模式状态
   bool _isSelecting = false;
   final Set<FileRecord> _selectedFiles = {};
@@ -184,10 +190,28 @@ class _FileGridState extends State<FileGrid> {
     setState(() {
       _groupedFiles = tempGroup;
       _sortedKeys = tempKeys;
+      _displayFiles = [for (final key in tempKeys) ...tempGroup[key]!];
+      _displayIndex = {for (final (i, f) in _displayFiles.indexed) f: i};
+      _requestedPages.clear();
       _isLoading = false;
     });
   }
 
+  /// 单元首次构建时批量获取其所在页的缩略图
+  void _prefetchPage(FileRecord f, bool small) {
+    final index = _displayIndex[f];
+    if (index == null) return;
+    final page = index ~/ ThumbBundle.pageSize;
+    if (!_requestedPages.add('$page-$small')) return;
+
+    final files = _displayFiles
+        .skip(page * ThumbBundle.pageSize)
+        .take(ThumbBundle.pageSize)
+        .where((e) => e.fileType == 'image' || e.fileType == 'video')
+        .toList();
+    ThumbBundle.prefetch(context, files, small: small);
+  }
+
   Future<void> reload({bool silent = false}) async {
     _load(silent: silent);
     _exitSelectMode();
@@ -384,6 +408,7 @@ class _FileGridState extends State<FileGrid> {
   }
 
   Widget _buildItemWidget(FileRecord f, SettingsProvider settings) {
+    _prefetchPage(f, settings.isSmallThumbnail);
     return GestureDetector(
       onTap: () => _handleItemTap(f),
       onLongPress: () {
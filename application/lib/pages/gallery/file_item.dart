@@ -3,6 +3,7 @@ import 'package:flutter/material.dart';
 import 'package:provider/provider.dart';
 import '../../services/file_record.dart';
 import '../../services/file_url.dart';
+import '../../services/thumb_bundle.dart';
 import '../../utils/custom_cache.dart';
 import '../../utils/settings_provider.dart';
 
@@ -30,13 +31,38 @@ class FileItem extends StatelessWidget {
 
   /// 根据状态获取缩略图URL
   String _getThumbnailUrl(BuildContext context) {
-    final targetFile = file.fileType == 'video' || file.mimeType == 'image/gif'
-        ? '${file.file}.jpg'
-        : file.file;
-
     return isSmallThumbnail
-        ? thumbUrl(context, targetFile)
-        : mediumUrl(context, targetFile);
+        ? thumbUrl(context, file)
+        : mediumUrl(context, file);
+  }
+
+  /// 加载中占位：有占位预览图时拉伸显示，否则显示进度圈
+  Widget _buildPlaceholder(BoxFit fitMode) {
+    final bytes = file.placeholderBytes;
+    if (bytes == null) return const Center(child: CircularProgressIndicator());
+    return Image.memory(bytes, fit: fitMode, filterQuality: FilterQuality.low, gaplessPlayback: true);
+  }
+
+  /// 缩略图：所在页正在批量获取时先等待，再从本地缓存加载
+  Widget _buildThumbnail(String url, BoxFit fitMode) {
+    final image = CachedNetworkImage(
+      imageUrl: url,
+      httpHeaders: thumbHeaders,
+      fit: fitMode,
+      placeholder: (_, _) => _buildPlaceholder(fitMode),
+      fadeInDuration: const Duration(milliseconds: 150),
+      errorWidget: (_, _, _) => const Icon(Icons.broken_image),
+      cacheManager: customCacheManager(),
+      key: ValueKey('${url}_$isSmallThumbnail'),
+    );
+    if (!ThumbBundle.isPending(url)) return image;
+
+    return FutureBuilder<void>(
+      future: ThumbBundle.ready(url),
+      builder: (_, snapshot) => snapshot.connectionState == ConnectionState.done
+          ? image
+          : _buildPlaceholder(fitMode),
+    );
   }
 
   /// 文件信息叠加层
@@ -115,14 +141,7 @@ class FileItem extends StatelessWidget {
       content = Stack(
         children: [
           Positioned.fill(
-            child: CachedNetworkImage(
-              imageUrl: url,
-              fit: fitMode,
-              placeholder: (_, _) => const Center(child: CircularProgressIndicator()),
-              errorWidget: (_, _, _) => const Icon(Icons.broken_image),
-              cacheManager: customCacheManager(),
-              key: ValueKey('${url}_$isSmallThumbnail'),
-            ),
+            child: _buildThumbnail(url, fitMode),
           ),
           if (_buildInfoOverlay(settings) != null) _buildInfoOverlay(settings)!,
           if (settings.showInfoIcon && (isGif || isVideo))
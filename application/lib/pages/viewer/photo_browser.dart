@@ -53,11 +53,11 @@ class _PhotoBrowserState extends State<PhotoBrowser> {
     }
     // 执行缓存操作
     for (final index in cacheOrder) {
-      final url = mediumUrl(context, widget.files[index].file);
+      final url = mediumUrl(context, widget.files[index]);
       // 检查是否已缓存
       final fileInfo = await customCacheManager().getFileFromCache(url);
       if (fileInfo == null) {
-        customCacheManager().getFileStream(url);
+        customCacheManager().getFileStream(url, headers: thumbHeaders);
       }
     }
   }
@@ -246,10 +246,11 @@ class _PhotoBrowserState extends State<PhotoBrowser> {
                       ? fileContentUrl(context, f.file)
                       : (_showOriginal
                         ? fileContentUrl(context, f.file)
-                        : mediumUrl(context, f.file));
+                        : mediumUrl(context, f));
                   return PhotoViewGalleryPageOptions(
                     imageProvider: CachedNetworkImageProvider(
                       url,
+                      headers: thumbHeaders,
                       cacheManager: customCacheManager(),
                     ),
                     minScale: PhotoViewComputedScale.contained * 0.5,
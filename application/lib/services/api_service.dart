@@ -10,13 +10,45 @@ class ApiService {
   /// 加载超时
   static const _timeout = Duration(seconds: 5);
 
+  /// 列表响应缓存 {地址: (ETag, 响应体)}，按最近使用淘汰
+  static final Map<String, (String, String)> _listCache = {};
+  static const _listCacheMax = 50;
+
+  /// 带条件的GET：内容未变时服务端返回304，直接使用上次的响应体
+  static Future<String> _getValidated(Uri uri, String errorMessage) async {
+    final key = uri.toString();
+    final cached = _listCache.remove(key);
+    final res = await getWithTimeout(
+      uri,
+      timeout: _timeout,
+      headers: cached == null ? null : {'If-None-Match': cached.$1},
+    );
+    if (res.statusCode == 304 && cached != null) {
+      _listCache[key] = cached;
+      return cached.$2;
+    }
+    if (res.statusCode != 200) throw Exception(errorMessage);
+
+    final etag = res.headers['etag'];
+    if (etag != null) {
+      _listCache[key] = (etag, res.body);
+      if (_listCache.length > _listCacheMax) _listCache.remove(_listCache.keys.first);
+    }
+    return res.body;
+  }
+
   static Future<Map<String, dynamic>> listRootFolders(String baseUrl) async {
     final uri = Uri.parse('$baseUrl/list_root_folders');
-    final res = await getWithTimeout(uri, timeout: _timeout);
-    if (res.statusCode == 200) return jsonDecode(res.body);
-    throw Exception('文件夹加载失败');
+    return jsonDecode(await _getValidated(uri, '文件夹加载失败'));
   }
 
+  /// 列表每页数量
+  static const _pageSize = 2000;
+
+  /// 列表只取客户端用到的字段
+  static const _listFields = 'file_path,file,root_folder,file_name,file_type,mime_type,file_size,'
+      'md5_hash,width,height,deleted_at,phash,placeholder,mtime,inode,quick_hash';
+
   static Future<List<FileRecord>> listFiles({
     required String baseUrl,
     String? folder,
@@ -24,19 +56,25 @@ class ApiService {
     String? order,
     bool isDeleted = false,
   }) async {
-    final queryParams = <String, dynamic>{};
+    final queryParams = <String, dynamic>{'limit': '$_pageSize', 'fields': _listFields};
     if (folder != null && folder.isNotEmpty) queryParams['folder'] = folder;
     if (sort != null && sort.isNotEmpty) queryParams['sort'] = sort;
     if (order != null && order.isNotEmpty) queryParams['order'] = order;
     if (isDeleted) queryParams['is_deleted'] = 'true';
 
-    final uri = Uri.parse('$baseUrl/list_files').replace(queryParameters: queryParams);
-    final res = await getWithTimeout(uri, timeout: _timeout);
-    if (res.statusCode == 200) {
-      final List<dynamic> data = jsonDecode(res.body)['files'];
-      return data.map((e) => FileRecord.fromJson(e)).toList();
-    }
-    throw Exception('文件列表加载失败');
+    // 按游标逐页读取
+    final files = <FileRecord>[];
+    String? cursor;
+    do {
+      if (cursor != null) queryParams['cursor'] = cursor;
+      final uri = Uri.parse('$baseUrl/list_files').replace(queryParameters: queryParams);
+      final Map<String, dynamic> body = jsonDecode(await _getValidated(uri, '文件列表加载失败'));
+      final List<dynamic> data = body['files'];
+      final String? thumbSettings = body['thumb_settings'];
+      files.addAll(data.map((e) => FileRecord.fromJson(e, thumbSettings: thumbSettings)));
+      cursor = body['next_cursor'];
+    } while (cursor != null);
+    return files;
   }
 
   static Future<void> deleteFile(
@@ -100,11 +138,12 @@ class ApiService {
     if (res.statusCode == 200) {
       final data = jsonDecode(res.body);
       final List<dynamic> groupsData = data['groups'] ?? [];
+      final String? thumbSettings = data['thumb_settings'];
 
       List<List<FileRecord>> parsedGroups = [];
       for (var group in groupsData) {
         if (group is List) {
-          parsedGroups.add(group.map((e) => FileRecord.fromJson(e)).toList());
+          parsedGroups.add(group.map((e) => FileRecord.fromJson(e, thumbSettings: thumbSettings)).toList());
         }
       }
       return parsedGroups;
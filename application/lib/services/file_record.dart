@@ -1,3 +1,6 @@
+import 'dart:convert';
+import 'dart:typed_data';
+
 class FileRecord {
   final String filePath;
   final String file;
@@ -11,6 +14,30 @@ class FileRecord {
   final int? height;
   final int deletedAt;
   final String? phash;
+  final String? placeholder;
+  final double? mtime;
+  final int? inode;
+  final String? quickHash;
+
+  /// 服务端缩略图设置的版本，随列表返回
+  final String? thumbSettings;
+
+  /// 占位预览图（长边16像素的WebP），服务端无法生成时为空字符串
+  late final Uint8List? placeholderBytes =
+      placeholder == null || placeholder!.isEmpty ? null : base64Decode(placeholder!);
+
+  /// 缩略图版本号：修改时间（毫秒）、大小、inode、抽样哈希前8位与缩略图设置，与服务端算法一致
+  String? get thumbVersion {
+    if (mtime == null || inode == null || thumbSettings == null) return null;
+    final sample = quickHash ?? '';
+    return [
+      (mtime! * 1000).truncate().toRadixString(16),
+      fileSize.toRadixString(16),
+      inode!.toRadixString(16),
+      sample.length > 8 ? sample.substring(0, 8) : sample,
+      thumbSettings!,
+    ].join('-');
+  }
 
   FileRecord({
     required this.filePath,
@@ -25,9 +52,14 @@ class FileRecord {
     this.height,
     required this.deletedAt,
     this.phash,
+    this.placeholder,
+    this.mtime,
+    this.inode,
+    this.quickHash,
+    this.thumbSettings,
   });
 
-  factory FileRecord.fromJson(Map<String, dynamic> json) => FileRecord(
+  factory FileRecord.fromJson(Map<String, dynamic> json, {String? thumbSettings}) => FileRecord(
     filePath: json['file_path'],
     file: json['file'],
     rootFolder: json['root_folder'],
@@ -40,5 +72,10 @@ class FileRecord {
     height: json['height'],
     deletedAt: json['deleted_at'],
     phash: json['phash'] as String?,
+    placeholder: json['placeholder'] as String?,
+    mtime: (json['mtime'] as num?)?.toDouble(),
+    inode: json['inode'] as int?,
+    quickHash: json['quick_hash'] as String?,
+    thumbSettings: thumbSettings,
   );
 }
\ No newline at end of file
@@ -1,6 +1,7 @@
 import 'package:flutter/cupertino.dart';
 import 'package:provider/provider.dart';
 import '../utils/backend_provider.dart';
+import 'file_record.dart';
 
 /// 文件请求
 String fileContentUrl(BuildContext context, String path) {
@@ -8,14 +9,19 @@ String fileContentUrl(BuildContext context, String path) {
   return '$base/file_content?file_path=${Uri.encodeComponent(path)}';
 }
 
-/// 缩略图
-String thumbUrl(BuildContext context, String path) {
-  final base = Provider.of<BackendProvider>(context, listen: false).backendUrl!;
-  return '$base/file_content?file_path=/.cache/thumb/${Uri.encodeComponent(path)}';
-}
+/// 缩略图请求头：声明支持WebP，服务端据此返回更小的格式
+const thumbHeaders = {'Accept': 'image/webp,image/*;q=0.8'};
+
+/// 缩略图（未生成时服务端即时生成）
+/// 地址带版本号，文件与缩略图设置未变时服务端允许长期缓存，任一变化后地址随之改变
+String thumbUrl(BuildContext context, FileRecord file) => _thumbUrl(context, file, 'thumb');
 
 /// 大缩略图
-String mediumUrl(BuildContext context, String path) {
+String mediumUrl(BuildContext context, FileRecord file) => _thumbUrl(context, file, 'medium');
+
+String _thumbUrl(BuildContext context, FileRecord file, String size) {
   final base = Provider.of<BackendProvider>(context, listen: false).backendUrl!;
-  return '$base/file_content?file_path=/.cache/medium/${Uri.encodeComponent(path)}';
+  final version = file.thumbVersion;
+  return '$base/thumbnail?size=$size&file_path=${Uri.encodeComponent(file.file)}'
+      '${version == null ? '' : '&v=$version'}';
 }
\ No newline at end of file
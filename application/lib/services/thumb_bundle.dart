@@ -0,0 +1,91 @@
+import 'dart:convert';
+import 'dart:typed_data';
+
+import 'package:flutter/widgets.dart';
+import 'package:http/http.dart' as http;
+import 'package:provider/provider.dart';
+
+import '../utils/backend_provider.dart';
+import '../utils/custom_cache.dart';
+import 'file_record.dart';
+import 'file_url.dart';
+
+/// 批量缩略图：一次请求取回一页缩略图写入本地缓存，网格单元随后直接命中缓存
+class ThumbBundle {
+  /// 每批数量
+  static const pageSize = 100;
+
+  static const _timeout = Duration(seconds: 30);
+
+  /// 正在批量获取的缩略图 {地址: 所在批次}
+  static final Map<String, Future<void>> _pending = {};
+
+  static bool isPending(String url) => _pending.containsKey(url);
+
+  /// 等待该地址所在批次完成，不在任何批次中时立即返回
+  static Future<void> ready(String url) => _pending[url] ?? Future.value();
+
+  /// 批量获取一页缩略图
+  static Future<void> prefetch(BuildContext context, List<FileRecord> files, {required bool small}) {
+    final base = Provider.of<BackendProvider>(context, listen: false).backendUrl!;
+    final urls = {
+      for (final file in files) file.file: small ? thumbUrl(context, file) : mediumUrl(context, file)
+    };
+    urls.removeWhere((_, url) => _pending.containsKey(url));
+    if (urls.isEmpty) return Future.value();
+
+    final batch = _fetch(base, urls, small);
+    for (final url in urls.values) {
+      _pending[url] = batch;
+    }
+    return batch.whenComplete(() {
+      for (final url in urls.values) {
+        _pending.remove(url);
+      }
+    });
+  }
+
+  static Future<void> _fetch(String base, Map<String, String> urls, bool small) async {
+    final cache = customCacheManager();
+    try {
+      // 本地已缓存的不再请求
+      final cached = await Future.wait(urls.values.map(cache.getFileFromCache));
+      final paths = [
+        for (final (i, path) in urls.keys.indexed)
+          if (cached[i] == null) path
+      ];
+      if (paths.isEmpty) return;
+
+      final uri = Uri.parse('$base/thumbnails').replace(queryParameters: {'size': small ? 'thumb' : 'medium'});
+      final res = await http
+          .post(
+            uri,
+            headers: {...thumbHeaders, 'Content-Type': 'application/json'},
+            body: jsonEncode({'file_paths': paths}),
+          )
+          .timeout(_timeout);
+      if (res.statusCode != 200) return;
+
+      // 4字节大端清单长度 + JSON清单 + 按清单顺序拼接的图片数据
+      final Uint8List bytes = res.bodyBytes;
+      final manifestLength = ByteData.sublistView(bytes).getUint32(0);
+      final List<dynamic> manifest = jsonDecode(utf8.decode(bytes.sublist(4, 4 + manifestLength)));
+      var offset = 4 + manifestLength;
+      for (final item in manifest) {
+        final int length = item['length'];
+        if (item['status'] == 200 && length > 0) {
+          final String contentType = item['content_type'] ?? 'image/jpeg';
+          await cache.putFile(
+            urls[item['file_path']]!,
+            bytes.sublist(offset, offset + length),
+            fileExtension: contentType.split('/').last,
+          );
+        }
+        offset += length;
+      }
+    } catch (e) {
+      // 批量获取失败时各单元回退为单独请求
+      debugPrint('批量获取缩略图失败: $e');
+    }
+  }
+}
@@ -5,9 +5,10 @@ import 'package:http/http.dart' as http;
 Future<http.Response> getWithTimeout(
     Uri uri, {
       Duration timeout = const Duration(seconds: 5),
+      Map<String, String>? headers,
     }) async {
   try {
-    return await http.get(uri).timeout(timeout);
+    return await http.get(uri, headers: headers).timeout(timeout);
   } on TimeoutException {
     throw Exception('连接超时，请检查地址是否正确或服务是否启动');
   } on SocketException {
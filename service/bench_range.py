@@ -0,0 +1,86 @@
+"""
+file_content 断点续传基准：完整下载吞吐量与随机拖动延迟
+
+用法（服务已启动）：
+    python bench_range.py --url http://127.0.0.1:8000 --file 视频/movie.mkv --seeks 50
+"""
+import time
+import random
+import argparse
+import statistics
+import http.client
+import urllib.parse
+
+READ_SIZE = 1024 * 1024
+
+
+def _request(url: str, file_path: str, headers: dict) -> tuple[http.client.HTTPConnection, http.client.HTTPResponse]:
+    parts = urllib.parse.urlsplit(url)
+    conn = http.client.HTTPConnection(parts.hostname, parts.port or 80, timeout=30)
+    conn.request("GET", f"/file_content?file_path={urllib.parse.quote(file_path)}", headers=headers)
+    return conn, conn.getresponse()
+
+
+def bench_full(url: str, file_path: str) -> tuple[int, float]:
+    """完整下载，返回 (字节数, 耗时)"""
+    start = time.perf_counter()
+    conn, res = _request(url, file_path, {})
+    total = 0
+    while chunk := res.read(READ_SIZE):
+        total += len(chunk)
+    conn.close()
+    return total, time.perf_counter() - start
+
+
+def bench_seek(url: str, file_path: str, file_size: int, seeks: int, read_size: int) -> tuple[list, list]:
+    """
+    模拟播放器拖动：每次从随机位置发起开放区间请求，读取read_size后断开
+    :return: (首字节延迟列表, 读满read_size的耗时列表)
+    """
+    first_byte, readahead = [], []
+    for _ in range(seeks):
+        offset = random.randrange(0, max(file_size - read_size, 1))
+        start = time.perf_counter()
+        conn, res = _request(url, file_path, {"Range": f"bytes={offset}-"})
+        expected = f"bytes {offset}-{file_size - 1}/{file_size}"
+        if res.status != 206 or res.getheader("Content-Range") != expected:
+            raise RuntimeError(f"期望206 {expected}，实际 {res.status} {res.getheader('Content-Range')}")
+        res.read(1)
+        first_byte.append(time.perf_counter() - start)
+        res.read(read_size - 1)
+        readahead.append(time.perf_counter() - start)
+        conn.close()
+    return first_byte, readahead
+
+
+def _ms(values: list) -> str:
+    values = sorted(values)
+    p95 = values[min(len(values) - 1, int(len(values) * 0.95))]
+    return f"中位 {statistics.median(values) * 1000:.1f}ms，p95 {p95 * 1000:.1f}ms"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="file_content 断点续传基准")
+    parser.add_argument("--url", default="http://127.0.0.1:8000", help="服务地址")
+    parser.add_argument("--file", required=True, help="相对根目录的文件路径")
+    parser.add_argument("--seeks", type=int, default=50, help="随机拖动次数")
+    parser.add_argument("--read", type=int, default=4 * READ_SIZE, help="每次拖动后读取的字节数")
+    parser.add_argument("--skip-full", action="store_true", help="跳过完整下载")
+    args = parser.parse_args()
+
+    conn, res = _request(args.url, args.file, {"Range": "bytes=0-0"})
+    file_size = int(res.getheader("Content-Range").rsplit("/", 1)[1])
+    conn.close()
+    print(f"文件大小 {file_size / 2 ** 20:.0f}MB")
+
+    if not args.skip_full:
+        total, elapsed = bench_full(args.url, args.file)
+        print(f"完整下载 {total / 2 ** 20:.0f}MB，{elapsed:.2f}s，{total / 2 ** 20 / elapsed:.0f}MB/s")
+
+    first_byte, readahead = bench_seek(args.url, args.file, file_size, args.seeks, args.read)
+    print(f"拖动 {args.seeks} 次，首字节 {_ms(first_byte)}")
+    print(f"拖动后读取 {args.read / 2 ** 20:.0f}MB {_ms(readahead)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,14 @@
 import os
 from pathlib import Path
-from database.connection import init_db, get_db, db_context
-from database.config_ops import get_root_dir, set_root_dir, get_port, set_port
+from database.connection import init_db, db_context, DB_WRITER
+from database.config_ops import get_root_dir, set_root_dir, get_port, set_port, get_hash_mode, set_hash_mode, \
+    get_workers, set_workers, get_thumb_layout, set_thumb_layout, get_thumb_formats, set_thumb_formats
 
 DEFAULT_ROOT_DIR = r"C:\Windows\Web\Wallpaper"
 DEFAULT_PORT = 8081
+DEFAULT_HASH_MODE = "tiered"
+DEFAULT_THUMB_LAYOUT = "path"
+DEFAULT_THUMB_FORMATS = ["webp"]
 RECYCLE_FOLDER = ".recycle"
 
 
@@ -26,6 +30,11 @@ class Config:
         with db_context() as db:
             self.root_dir = self._load_root_dir(db)
             self.port = self._load_port(db)
+            self.hash_mode = get_hash_mode(db) or DEFAULT_HASH_MODE
+            self.workers = get_workers(db)
+            self.thumb_layout = get_thumb_layout(db) or DEFAULT_THUMB_LAYOUT
+            formats = get_thumb_formats(db)
+            self.thumb_formats = DEFAULT_THUMB_FORMATS if formats is None else formats
         self.recycle_folder = RECYCLE_FOLDER
         self.is_recycle_folder = False
 
@@ -55,15 +64,29 @@ class Config:
         return DEFAULT_PORT
 
     def save_root_dir(self, root_dir: str):
-        with db_context() as db:
-            set_root_dir(db, root_dir)
+        DB_WRITER.run(set_root_dir, root_dir)
         self.root_dir = root_dir
 
     def save_port(self, port: int):
-        with db_context() as db:
-            set_port(db, port)
+        DB_WRITER.run(set_port, port)
         self.port = port
 
+    def save_hash_mode(self, mode: str):
+        DB_WRITER.run(set_hash_mode, mode)
+        self.hash_mode = mode
+
+    def save_workers(self, workers: dict[str, int]):
+        DB_WRITER.run(set_workers, workers)
+        self.workers = workers
+
+    def save_thumb_layout(self, layout: str):
+        DB_WRITER.run(set_thumb_layout, layout)
+        self.thumb_layout = layout
+
+    def save_thumb_formats(self, formats: list[str]):
+        DB_WRITER.run(set_thumb_formats, formats)
+        self.thumb_formats = formats
+
     def check_root_dir(self) -> bool:
         if not Path(self.root_dir).is_dir():
             return False
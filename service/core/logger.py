@@ -12,6 +12,7 @@ LEVEL_COLOR = {
 TAG_COLOR = {
     '(SCAN)': '#00FFFF',
     '(THUMB)': '#98FB98',
+    '(HASH)': '#DDA0DD',
     '(CLEAN)': '#FFA500',
     '(SUCCESS)': '#32CD32',
     '(SKIP)': '#808080',
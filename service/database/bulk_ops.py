@@ -0,0 +1,156 @@
+import time
+from sqlalchemy import bindparam, case, func
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.orm import Session
+from core.logger import warning, error
+from database.models import FileRecord, HashCache, DirRecord, ThumbJob
+from database.writer import DbWriter
+
+
+def _upsert(session: Session, model, rows: list[dict], key: str):
+    """按唯一键批量插入或更新（INSERT ... ON CONFLICT DO UPDATE）"""
+    if not rows:
+        return
+    stmt = insert(model.__table__)
+    columns = [c for c in rows[0] if c != key]
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[key],
+        set_={c: stmt.excluded[c] for c in columns}
+    )
+    session.execute(stmt, rows)
+
+
+def upsert_dirs(session: Session, rows: list[dict]):
+    """批量写入目录索引"""
+    _upsert(session, DirRecord, rows, 'dir_path')
+
+
+def enqueue_thumb_jobs(session: Session, rows: list[dict], priority: int = 0, retry: bool = True):
+    """
+    批量加入缩略图任务
+    - 已在队列中的任务取较高优先级，并重置失败次数立即重试
+    - 正在执行的任务保持状态并记为重新入队：执行期间文件可能已变化，本次执行结束后重新排队
+    - force只会被置位，不会被后来的普通任务清除
+    :param rows: [{'file_path': 完整路径, 'root_folder': 根文件夹, 'force': 可选，是否强制重新生成}]
+    :param priority: 优先级
+    :param retry: False时已在队列中的任务（包括已失败的）保持不变
+    """
+    if not rows:
+        return
+    table = ThumbJob.__table__
+    now = time.time()
+    stmt = insert(table)
+    if not retry:
+        stmt = stmt.on_conflict_do_nothing(index_elements=['file_path'])
+    else:
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['file_path'],
+            set_={
+                'priority': func.max(table.c.priority, stmt.excluded.priority),
+                'status': case((table.c.status == 'running', table.c.status), else_='pending'),
+                'attempts': 0,
+                'next_run': 0,
+                'last_error': None,
+                'force': func.max(func.coalesce(table.c.force, 0), stmt.excluded.force),
+                'requeued': case((table.c.status == 'running', 1), else_=0),
+            }
+        )
+    session.execute(stmt, [
+        dict(row, force=int(row.get('force', False)), priority=priority, status='pending', attempts=0, next_run=0,
+             created_at=now, requeued=0)
+        for row in rows
+    ])
+
+
+class BulkWriter:
+    """
+    扫描写库缓冲
+    - 文件记录、哈希缓存与缩略图任务按唯一键累积后批量upsert，按id的更新按字段组合批量执行
+    - 缓冲达到batch_size时交给写线程在一个事务中写入，不经过ORM对象，内存占用与库大小无关
+    """
+
+    def __init__(self, writer: DbWriter, batch_size: int = 500):
+        self.writer = writer
+        self.batch_size = batch_size
+        self.files = []
+        self.hashes = []
+        self.dropped = []
+        self.thumbs = []
+        self.updates = {}
+        self.pending = 0
+        self.failed = 0  # 写入失败而丢弃的项数
+
+    def upsert_file(self, values: dict):
+        """按file_path插入或覆盖文件记录"""
+        self.files.append(values)
+        self._added()
+
+    def update_file(self, file_id: int, values: dict):
+        """按id更新文件记录的部分字段"""
+        self.updates.setdefault(tuple(sorted(values)), []).append(
+            {'b_id': file_id, **{f'b_{c}': v for c, v in values.items()}}
+        )
+        self._added()
+
+    def upsert_hash(self, values: dict):
+        """写入哈希缓存"""
+        self.hashes.append(values)
+        self._added()
+
+    def drop_hash(self, file_path: str):
+        """删除哈希缓存"""
+        self.dropped.append(file_path)
+        self._added()
+
+    def enqueue_thumb(self, file_path: str, root_folder: str, force: bool = False):
+        """
+        加入缩略图任务，与文件记录在同一事务中提交
+        :param force: 原始文件内容已变化，已有缩略图即使修改时间一致也重新生成
+        """
+        self.thumbs.append({'file_path': file_path, 'root_folder': root_folder, 'force': force})
+        self._added()
+
+    def _added(self):
+        self.pending += 1
+        if self.pending >= self.batch_size:
+            self.flush()
+
+    def flush(self) -> bool:
+        """
+        写入缓冲并等待提交
+        - 提交前先取出缓冲，失败的批次不会随之后的写入重复提交
+        - 失败时重试一次（如多进程运行时等待写锁超时），仍失败则记录并丢弃该批次，计入failed
+        :return: 本批次是否已写入
+        """
+        if not self.pending:
+            return True
+        batch = (self.files, self.hashes, self.dropped, self.thumbs, self.updates)
+        pending = self.pending
+        self.files, self.hashes, self.dropped, self.thumbs, self.updates = [], [], [], [], {}
+        self.pending = 0
+        for attempt in range(2):
+            try:
+                self.writer.run_background(self._write, *batch)
+                return True
+            except Exception as e:
+                if attempt:
+                    error(f'(DB) 批量写入失败，丢弃 {pending} 项: {e}')
+                else:
+                    warning(f'(DB) 批量写入失败，重试: {e}')
+        self.failed += pending
+        return False
+
+    @staticmethod
+    def _write(session: Session, files: list, hashes: list, dropped: list, thumbs: list, updates: dict):
+        table = FileRecord.__table__
+        # 先执行按id的更新：重命名会释放原路径，之后的upsert才可能复用该路径
+        for columns, rows in updates.items():
+            stmt = table.update().where(table.c.id == bindparam('b_id')).values(
+                {c: bindparam(f'b_{c}') for c in columns}
+            )
+            session.execute(stmt, rows)
+        if dropped:
+            session.query(HashCache).filter(HashCache.file_path.in_(dropped)).delete(synchronize_session=False)
+        _upsert(session, FileRecord, files, 'file_path')
+        _upsert(session, HashCache, hashes, 'file_path')
+        enqueue_thumb_jobs(session, thumbs)
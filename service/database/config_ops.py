@@ -1,12 +1,27 @@
+import json
 from sqlalchemy.orm import Session
 from database.models import Config
 
 # 配置键常量
 CONFIG_KEYS = {
     "root_dir": "root_dir",
-    "port": "port"
+    "port": "port",
+    "hash_mode": "hash_mode",
+    "workers": "workers",
+    "thumb_layout": "thumb_layout",
+    "thumb_formats": "thumb_formats",
+    "scan_checkpoint": "scan_checkpoint"
 }
 
+# 指纹模式：full 每个文件计算完整MD5；tiered 抽样哈希，重复候选再补算完整MD5
+HASH_MODES = ("full", "tiered")
+
+# 缩略图存放方式：path 按原始文件相对路径；content 按完整MD5，重复文件共用一份，移动与回收不需重新生成
+THUMB_LAYOUTS = ("path", "content")
+
+# 缩略图附加输出格式，客户端通过Accept声明支持时优先返回
+THUMB_FORMATS = ("webp", "avif")
+
 
 def _get_config(session: Session, key: str, default: str | None = None) -> str | None:
     """通用配置读取"""
@@ -15,10 +30,15 @@ def _get_config(session: Session, key: str, default: str | None = None) -> str |
 
 
 def _set_config(session: Session, key: str, value: str) -> None:
-    """通用配置写入"""
+    """通用配置写入，由调用方（db_context或DB_WRITER）提交"""
     # 存在则更新，不存在则插入
     session.merge(Config(key=key, value=value))
-    session.commit()
+    session.flush()
+
+
+def _del_config(session: Session, key: str) -> None:
+    """通用配置删除，由调用方（db_context或DB_WRITER）提交"""
+    session.query(Config).filter(Config.key == key).delete()
 
 
 def get_root_dir(session: Session) -> str | None:
@@ -44,3 +64,79 @@ def set_port(session: Session, port: int) -> None:
     if not isinstance(port, int) or port < 1 or port > 65535:
         raise ValueError("端口必须是1-65535之间的整数")
     _set_config(session, CONFIG_KEYS["port"], str(port))
+
+
+def get_hash_mode(session: Session) -> str | None:
+    """获取指纹模式配置"""
+    mode = _get_config(session, CONFIG_KEYS["hash_mode"])
+    return mode if mode in HASH_MODES else None
+
+
+def set_hash_mode(session: Session, mode: str) -> None:
+    """设置指纹模式配置"""
+    if mode not in HASH_MODES:
+        raise ValueError(f"指纹模式必须是 {HASH_MODES} 之一")
+    _set_config(session, CONFIG_KEYS["hash_mode"], mode)
+
+
+def get_thumb_layout(session: Session) -> str | None:
+    """获取缩略图存放方式配置"""
+    layout = _get_config(session, CONFIG_KEYS["thumb_layout"])
+    return layout if layout in THUMB_LAYOUTS else None
+
+
+def set_thumb_layout(session: Session, layout: str) -> None:
+    """设置缩略图存放方式配置"""
+    if layout not in THUMB_LAYOUTS:
+        raise ValueError(f"缩略图存放方式必须是 {THUMB_LAYOUTS} 之一")
+    _set_config(session, CONFIG_KEYS["thumb_layout"], layout)
+
+
+def get_thumb_formats(session: Session) -> list[str] | None:
+    """获取缩略图附加输出格式配置"""
+    try:
+        formats = json.loads(_get_config(session, CONFIG_KEYS["thumb_formats"], "null"))
+    except ValueError:
+        return None
+    if not isinstance(formats, list):
+        return None
+    return [f for f in formats if f in THUMB_FORMATS]
+
+
+def set_thumb_formats(session: Session, formats: list[str]) -> None:
+    """设置缩略图附加输出格式配置，如 ["webp"]，空列表表示只生成原始格式"""
+    if any(f not in THUMB_FORMATS for f in formats):
+        raise ValueError(f"缩略图格式必须是 {THUMB_FORMATS} 之一")
+    _set_config(session, CONFIG_KEYS["thumb_formats"], json.dumps(formats))
+
+
+def get_workers(session: Session) -> dict[str, int]:
+    """获取扫描各阶段线程数配置"""
+    try:
+        workers = json.loads(_get_config(session, CONFIG_KEYS["workers"], "{}"))
+    except ValueError:
+        return {}
+    return {k: v for k, v in workers.items() if isinstance(v, int) and v > 0}
+
+
+def set_workers(session: Session, workers: dict[str, int]) -> None:
+    """设置扫描各阶段线程数配置，如 {"probe": 8, "hash": 2}"""
+    if any(not isinstance(v, int) or v < 1 for v in workers.values()):
+        raise ValueError("线程数必须是正整数")
+    _set_config(session, CONFIG_KEYS["workers"], json.dumps(workers))
+
+
+def get_scan_checkpoint(session: Session) -> dict | None:
+    """获取未完成扫描的检查点"""
+    try:
+        return json.loads(_get_config(session, CONFIG_KEYS["scan_checkpoint"], "null"))
+    except ValueError:
+        return None
+
+
+def set_scan_checkpoint(session: Session, checkpoint: dict | None) -> None:
+    """记录扫描检查点，None表示扫描已完成"""
+    if checkpoint is None:
+        _del_config(session, CONFIG_KEYS["scan_checkpoint"])
+    else:
+        _set_config(session, CONFIG_KEYS["scan_checkpoint"], json.dumps(checkpoint))
@@ -1,18 +1,70 @@
 import contextlib
 
-from sqlalchemy import create_engine
+import anyio
+from sqlalchemy import create_engine, event, inspect, text
 from sqlalchemy.orm import sessionmaker, Session
 from database.models import Base
+from database.writer import DbWriter
+from database.task_lock import TaskLocks
 
 
 DATABASE_URL = "sqlite:///files.db"
 
+# 只读连接池大小，溢出上限与请求线程池（40）一致
+READ_POOL_SIZE = 8
+READ_POOL_OVERFLOW = 32
+
 engine = create_engine(
     DATABASE_URL,
     echo=False,  # debug
     connect_args={"check_same_thread": False}  # 多线程兼容
 )
 
+# 请求处理只读数据库，写入统一交给DB_WRITER
+read_engine = create_engine(
+    DATABASE_URL,
+    echo=False,
+    pool_size=READ_POOL_SIZE,
+    max_overflow=READ_POOL_OVERFLOW,
+    connect_args={"check_same_thread": False}
+)
+
+# 每个连接建立时设置
+# - WAL：读不阻塞写，扫描写入时列表与缩略图请求照常读取
+# - synchronous=NORMAL：WAL下断电最多丢失最后提交的事务，不会损坏数据库
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'cache_size': -65536,  # 页缓存64MB
+    'mmap_size': 268435456,  # 内存映射256MB
+    'temp_store': 'MEMORY',
+    'busy_timeout': 5000,
+}
+
+# 只读连接：日志模式已由写连接设置，query_only拒绝任何写入
+READ_PRAGMAS = {
+    **{k: v for k, v in SQLITE_PRAGMAS.items() if k not in ('journal_mode', 'synchronous')},
+    'query_only': 1,
+}
+
+
+def _apply_pragmas(dbapi_connection, pragmas: dict):
+    cursor = dbapi_connection.cursor()
+    for name, value in pragmas.items():
+        cursor.execute(f'PRAGMA {name}={value}')
+    cursor.close()
+
+
+@event.listens_for(engine, 'connect')
+def _set_pragmas(dbapi_connection, _):
+    _apply_pragmas(dbapi_connection, SQLITE_PRAGMAS)
+
+
+@event.listens_for(read_engine, 'connect')
+def _set_read_pragmas(dbapi_connection, _):
+    _apply_pragmas(dbapi_connection, READ_PRAGMAS)
+
+
 SessionLocal = sessionmaker(
     bind=engine,
     autoflush=False,
@@ -20,20 +72,78 @@ SessionLocal = sessionmaker(
     expire_on_commit=False
 )
 
+ReadSessionLocal = sessionmaker(
+    bind=read_engine,
+    autoflush=False,
+    autocommit=False,
+    expire_on_commit=False
+)
+
+# 单写线程：扫描、缩略图队列与请求处理的写入都经由它串行提交
+DB_WRITER = DbWriter(SessionLocal)
+
+# 多个服务进程共用数据库时，后台任务与pHash计算由持有对应锁的进程执行
+TASK_LOCKS = TaskLocks(DB_WRITER)
+
+
+# 文件记录变化时递增所在文件夹的版本号（列表的ETag）
+# 取全库最大值+1，文件夹删除后重建也不会与旧版本号重复
+_BUMP_GENERATION = 'UPDATE folder SET generation = (SELECT COALESCE(MAX(generation), 0) FROM folder) + 1'
+GENERATION_TRIGGERS = {
+    'files_generation_insert': f'AFTER INSERT ON files BEGIN {_BUMP_GENERATION} WHERE folder = NEW.root_folder; END',
+    'files_generation_update': f'AFTER UPDATE ON files BEGIN {_BUMP_GENERATION} '
+                               f'WHERE folder IN (OLD.root_folder, NEW.root_folder); END',
+    'files_generation_delete': f'AFTER DELETE ON files BEGIN {_BUMP_GENERATION} WHERE folder = OLD.root_folder; END',
+    'folder_generation_insert': f'AFTER INSERT ON folder BEGIN {_BUMP_GENERATION} WHERE folder = NEW.folder; END',
+}
+
 
 def init_db():
     Base.metadata.create_all(bind=engine)
+    _migrate_columns()
+    _migrate_indexes()
+    _create_triggers()
+    with engine.connect() as conn:
+        # 新建索引后更新查询规划器的统计信息
+        conn.execute(text('PRAGMA optimize'))
 
-def get_db() -> Session:
-    db = SessionLocal()
-    try:
-        yield db
-        db.commit()
-    except Exception as e:
-        db.rollback()
-        raise e
-    finally:
-        db.close()
+
+def _migrate_columns():
+    """为旧数据库补充模型中新增的列"""
+    inspector = inspect(engine)
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            existing = {c['name'] for c in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                col_type = column.type.compile(dialect=engine.dialect)
+                conn.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {col_type}'))
+
+
+def _migrate_indexes():
+    """为旧数据库补充模型中新增的索引"""
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            for index in table.indexes:
+                index.create(conn, checkfirst=True)
+
+
+def _create_triggers():
+    with engine.begin() as conn:
+        for name, body in GENERATION_TRIGGERS.items():
+            conn.execute(text(f'CREATE TRIGGER IF NOT EXISTS {name} {body}'))
+
+async def run_read(fn, *args, **kwargs):
+    """
+    请求处理的只读查询：fn(session, *args) 在工作线程中以只读会话执行，返回其结果
+    - 一次调用只切换一次线程，线程只在查询期间占用
+    - 写入通过DB_WRITER提交
+    """
+    def run():
+        with ReadSessionLocal() as session:
+            return fn(session, *args, **kwargs)
+    return await anyio.to_thread.run_sync(run)
 
 @contextlib.contextmanager
 def db_context() -> Session:
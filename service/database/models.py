@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Float
+from sqlalchemy import Column, Integer, String, Float, Index
 from sqlalchemy.ext.declarative import declarative_base
 
 # 基础模型类
@@ -21,6 +21,17 @@ class FolderRecord(Base):
     last_mtime = Column(Float, nullable=False, comment="最后修改时间戳")
     count = Column(Integer, nullable=True, comment="文件数")
     mark = Column(String, nullable=True, comment="标记")
+    generation = Column(Integer, default=0, nullable=False, comment="内容版本号，文件记录变化时由触发器递增")
+
+
+class DirRecord(Base):
+    """目录索引"""
+    __tablename__ = 'dirs'
+
+    dir_path = Column(String, primary_key=True, comment="目录相对路径")
+    root_folder = Column(String, nullable=False, index=True, comment="根文件夹")
+    last_mtime = Column(Float, nullable=False, comment="最后修改时间戳")
+    count = Column(Integer, nullable=True, comment="直接包含的文件数")
 
 
 class FileRecord(Base):
@@ -35,8 +46,66 @@ class FileRecord(Base):
     file_type = Column(String, nullable=False, comment="文件类型：image/video/text/other")
     mime_type = Column(String, nullable=False, comment='文件mime')
     file_size = Column(Integer, nullable=False, comment="文件大小（字节）")
-    md5_hash = Column(String, nullable=False, comment="文件MD5哈希值")
+    md5_hash = Column(String, nullable=False, comment="文件MD5哈希值，空字符串表示尚未计算")
+    quick_hash = Column(String, nullable=True, comment="抽样哈希值")
     width = Column(Integer, nullable=True, comment="图片宽度（仅图片类型）")
     height = Column(Integer, nullable=True, comment="图片高度（仅图片类型）")
     deleted_at = Column(Integer, default=0, nullable=False, comment="删除时间戳")
-    phash = Column(String, nullable=True, comment="图片pHash值")
\ No newline at end of file
+    phash = Column(String, nullable=True, comment="图片pHash值")
+    mtime = Column(Float, nullable=True, comment="文件修改时间戳")
+    inode = Column(Integer, nullable=True, comment="文件inode")
+    placeholder = Column(String, nullable=True, comment="占位预览图，长边16像素WebP的base64；空字符串表示无法生成，不再重试")
+
+    # 列表按 (文件夹, 删除状态) 筛选后按各排序列翻页，索引末尾隐含的rowid即id，同值记录无需再排序
+    __table_args__ = (
+        Index('ix_files_folder_path', 'root_folder', 'deleted_at', 'file_path'),
+        Index('ix_files_folder_name', 'root_folder', 'deleted_at', 'file_name'),
+        Index('ix_files_folder_type', 'root_folder', 'deleted_at', 'mime_type'),
+        Index('ix_files_folder_size', 'root_folder', 'deleted_at', 'file_size'),
+        Index('ix_files_deleted_at', 'deleted_at'),
+        Index('ix_files_folder_phash', 'root_folder', 'file_type', 'phash'),
+        Index('ix_files_md5_hash', 'md5_hash'),
+        Index('ix_files_size_quick_hash', 'file_size', 'quick_hash'),
+    )
+
+
+class HashCache(Base):
+    """文件哈希缓存，按 (路径, 大小, 修改时间) 复用"""
+    __tablename__ = 'hash_cache'
+
+    file_path = Column(String, primary_key=True, comment="文件完整路径")
+    file_size = Column(Integer, nullable=False, comment="文件大小（字节）")
+    mtime = Column(Float, nullable=False, comment="文件修改时间戳")
+    quick_hash = Column(String, nullable=True, comment="抽样哈希值")
+    md5_hash = Column(String, nullable=True, comment="完整MD5")
+
+
+class ThumbJob(Base):
+    """缩略图任务队列"""
+    __tablename__ = 'thumb_jobs'
+
+    file_path = Column(String, primary_key=True, comment="原始文件完整路径")
+    root_folder = Column(String, nullable=False, index=True, comment="根文件夹")
+    priority = Column(Integer, default=0, nullable=False, comment="优先级，越大越先处理")
+    status = Column(String, default='pending', nullable=False, comment="状态：pending/running/failed")
+    attempts = Column(Integer, default=0, nullable=False, comment="已失败次数")
+    next_run = Column(Float, default=0, nullable=False, comment="最早可执行时间戳")
+    created_at = Column(Float, nullable=False, comment="入队时间戳")
+    last_error = Column(String, nullable=True, comment="最近一次失败原因")
+    force = Column(Integer, default=0, comment="1：原始文件内容已变化，忽略已有缩略图重新生成")
+    requeued = Column(Integer, default=0, comment="1：执行期间再次入队，本次执行结束后重新排队")
+
+    # 取任务：按状态筛选后按 (优先级倒序, 入队时间) 取第一条
+    __table_args__ = (
+        Index('ix_thumb_jobs_claim', 'status', priority.desc(), 'created_at'),
+    )
+
+
+class TaskLock(Base):
+    """跨进程的任务锁，以租约形式持有，持有者定期续期"""
+    __tablename__ = 'task_locks'
+
+    name = Column(String, primary_key=True, comment="锁名")
+    owner = Column(String, nullable=False, comment="持有者：主机名:进程号")
+    expires_at = Column(Float, nullable=False, comment="租约到期时间戳")
+    state = Column(String, nullable=True, comment="持有者发布的任务状态（JSON）")
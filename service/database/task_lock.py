@@ -0,0 +1,213 @@
+import os
+import json
+import time
+import socket
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable
+from sqlalchemy.orm import Session
+from core.logger import info, warning, error
+from database.models import TaskLock
+from database.writer import DbWriter
+
+LOCK_TTL = 15   # 租约时长（秒），持有进程异常退出后最多经过这么久由其他进程接管
+HEARTBEAT = 5   # 续期与尝试接管的间隔（秒）
+
+
+def acquire_lock(session: Session, name: str, owner: str, ttl: float) -> bool:
+    """锁未被持有或租约已过期时取得锁，已由owner持有时续期"""
+    now = time.time()
+    lock = session.get(TaskLock, name)
+    if lock is not None and lock.owner != owner and lock.expires_at > now:
+        return False
+    session.merge(TaskLock(name=name, owner=owner, expires_at=now + ttl, state=None))
+    return True
+
+
+def renew_locks(session: Session, names: list[str], owner: str, ttl: float, states: dict[str, str]) -> list[str]:
+    """续期owner持有的锁并更新其发布的状态，返回仍由owner持有的锁"""
+    expires_at = time.time() + ttl
+    held = []
+    for lock in session.query(TaskLock).filter(TaskLock.name.in_(names), TaskLock.owner == owner):
+        lock.expires_at = expires_at
+        if lock.name in states:
+            lock.state = states[lock.name]
+        held.append(lock.name)
+    return held
+
+
+def release_lock(session: Session, name: str, owner: str):
+    """释放owner持有的锁"""
+    session.query(TaskLock).filter(TaskLock.name == name, TaskLock.owner == owner).delete()
+
+
+def get_lock(session: Session, name: str) -> TaskLock | None:
+    """租约未过期的锁，无人持有时返回None"""
+    return session.query(TaskLock).filter(TaskLock.name == name, TaskLock.expires_at > time.time()).first()
+
+
+class TaskLocks:
+    """
+    跨进程的任务锁：多个服务进程共用同一数据库时，同一任务只在一个进程中执行
+    - 锁以租约形式保存在task_locks表，经由写线程以BEGIN IMMEDIATE事务取得，多个进程同时争抢时只有一个成功
+    - 本进程持有的锁由心跳线程定期续期；进程退出时释放，异常退出或失去响应时租约过期，其他进程可接管
+    - watch的锁在未持有时由心跳线程持续尝试取得，取得与失去时分别回调
+    - 回调在单独的线程中按顺序执行，耗时的回调不会耽误续期；取得锁后的回调失败时释放锁，一个租约时长内不再争取，由其他进程接管
+    """
+
+    def __init__(self, writer: DbWriter, ttl: float = LOCK_TTL, interval: float = HEARTBEAT):
+        """
+        :param writer: 写线程
+        :param ttl: 租约时长（秒）
+        :param interval: 续期间隔（秒），应明显小于ttl
+        """
+        self.writer = writer
+        self.ttl = ttl
+        self.interval = interval
+        self._held = set()
+        self._watched: dict[str, tuple[Callable, Callable, Callable | None]] = {}
+        self._retry_after: dict[str, float] = {}   # 回调失败而释放的锁，在此时间之前不再争取
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._callbacks = ThreadPoolExecutor(max_workers=1, thread_name_prefix='task-locks-callback')
+
+    @property
+    def owner(self) -> str:
+        """持有者标识：主机名:进程号"""
+        return f'{socket.gethostname()}:{os.getpid()}'
+
+    def held(self, name: str) -> bool:
+        """本进程是否持有锁"""
+        with self._lock:
+            return name in self._held
+
+    def acquire(self, name: str) -> bool:
+        """尝试取得锁，不等待"""
+        if not self.writer.run(acquire_lock, name, self.owner, self.ttl):
+            return False
+        self._add(name)
+        return True
+
+    async def acquire_async(self, name: str) -> bool:
+        """同acquire，在事件循环中等待"""
+        if not await self.writer.run_async(acquire_lock, name, self.owner, self.ttl):
+            return False
+        self._add(name)
+        return True
+
+    def release(self, name: str):
+        with self._lock:
+            self._held.discard(name)
+        self.writer.run(release_lock, name, self.owner)
+
+    async def release_async(self, name: str):
+        with self._lock:
+            self._held.discard(name)
+        await self.writer.run_async(release_lock, name, self.owner)
+
+    def watch(self, name: str, on_acquired: Callable, on_lost: Callable, state: Callable | None = None):
+        """
+        持续争取锁：立即尝试一次，之后由心跳线程重试
+        :param on_acquired: 取得锁后调用
+        :param on_lost: 租约被其他进程接管后调用
+        :param state: 续期时调用，返回的状态发布在锁上供其他进程查询
+        """
+        self._watched[name] = (on_acquired, on_lost, state)
+        if not self._try_watched(name):
+            info(f'(LOCK) 任务锁 [{name}] 由其他进程持有，本进程待命')
+        self._ensure_started()
+
+    def unwatch(self, name: str):
+        """
+        不再争取锁，并等待已排队的回调执行完毕；已持有的锁继续续期，直到release或stop
+        - 之后不会再有该锁的回调，调用方可以安全地停止对应任务
+        """
+        self._watched.pop(name, None)
+        self._callbacks.submit(lambda: None).result()
+
+    def stop(self):
+        """停止心跳并释放本进程持有的全部锁"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self._watched.clear()
+        self._callbacks.submit(lambda: None).result()
+        with self._lock:
+            held, self._held = self._held, set()
+        for name in held:
+            self.writer.run(release_lock, name, self.owner)
+
+    def _add(self, name: str):
+        with self._lock:
+            self._held.add(name)
+        self._ensure_started()
+
+    def _ensure_started(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._heartbeat, name='task-locks', daemon=True)
+        self._thread.start()
+
+    def _try_watched(self, name: str) -> bool:
+        callbacks = self._watched.get(name)
+        if callbacks is None:
+            return False
+        try:
+            acquired = self.acquire(name)
+        except Exception as e:
+            error(f'(LOCK) 取得任务锁 [{name}] 失败: {e}')
+            return False
+        if acquired:
+            info(f'(LOCK) 取得任务锁 [{name}]，由本进程执行')
+            self._callbacks.submit(self._callback, name, callbacks[0], True)
+        return acquired
+
+    def _callback(self, name: str, fn: Callable, release_on_error: bool = False):
+        """在回调线程中执行；release_on_error时回调失败即释放锁，不在持有锁的同时不执行任务"""
+        try:
+            fn()
+        except Exception as e:
+            error(f'(LOCK) 任务锁 [{name}] 回调失败: {e}')
+            if release_on_error and self.held(name):
+                self._retry_after[name] = time.time() + self.ttl
+                try:
+                    self.release(name)
+                    warning(f'(LOCK) 已释放任务锁 [{name}]，由其他进程接管')
+                except Exception as e:
+                    error(f'(LOCK) 释放任务锁 [{name}] 失败: {e}')
+
+    def _heartbeat(self):
+        while not self._stop.wait(self.interval):
+            with self._lock:
+                held = sorted(self._held)
+            if held:
+                states = {}
+                for name in held:
+                    state = self._watched.get(name, (None, None, None))[2]
+                    if state is not None:
+                        try:
+                            states[name] = json.dumps(state())
+                        except Exception as e:
+                            error(f'(LOCK) 读取任务锁 [{name}] 的发布状态失败: {e}')
+                try:
+                    kept = set(self.writer.run(renew_locks, held, self.owner, self.ttl, states))
+                except Exception as e:
+                    error(f'(LOCK) 续期任务锁失败: {e}')
+                    continue
+                for name in held:
+                    with self._lock:
+                        # 续期期间已主动释放的锁不算失去
+                        if name in kept or name not in self._held:
+                            continue
+                        self._held.discard(name)
+                    warning(f'(LOCK) 任务锁 [{name}] 已被其他进程接管')
+                    callbacks = self._watched.get(name)
+                    if callbacks is not None:
+                        self._callbacks.submit(self._callback, name, callbacks[1])
+
+            for name in list(self._watched):
+                if not self.held(name) and self._retry_after.get(name, 0) <= time.time():
+                    self._try_watched(name)
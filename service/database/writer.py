@@ -0,0 +1,133 @@
+import asyncio
+import threading
+from collections import deque
+from concurrent.futures import Future
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+from core.logger import error
+
+
+def _noop(_: Session):
+    pass
+
+
+class DbWriter:
+    """
+    单写线程：所有写库操作排队后由同一线程执行
+    - 写操作以 fn(session, *args) 的形式提交，不再由多个连接争抢SQLite写锁
+    - 队列中积压的操作合并为一个事务提交，每个操作在各自的保存点内执行，失败时只回滚自身
+    - 请求处理的写入与后台写入（扫描、缩略图队列）分开排队、交替执行：后台批次有前台写入到达时提前提交，
+      请求最多等待一个后台写操作；后台写入也不会因请求持续到达而停滞
+    - 事务以BEGIN IMMEDIATE开始，先取得写锁再读取，避免读事务升级为写事务时的锁冲突
+    """
+
+    def __init__(self, session_factory, batch_max: int = 64):
+        """
+        :param session_factory: 写连接的会话工厂
+        :param batch_max: 单个事务最多合并的写操作数
+        """
+        self.session_factory = session_factory
+        self.batch_max = batch_max
+        self._jobs = (deque(), deque())  # 前台，后台
+        self._cond = threading.Condition()
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._session = None
+
+    def submit(self, fn, *args, **kwargs) -> Future:
+        """提交写操作，不等待执行"""
+        return self._put((Future(), fn, args, kwargs), background=False)
+
+    def run(self, fn, *args, **kwargs):
+        """提交写操作并等待提交完成，返回fn的返回值，fn抛出的异常原样抛出"""
+        if threading.current_thread() is self._thread:
+            # 写操作内部再次写入：直接在当前事务中执行
+            return fn(self._session, *args, **kwargs)
+        return self.submit(fn, *args, **kwargs).result()
+
+    async def run_async(self, fn, *args, **kwargs):
+        """同run，在事件循环中等待，不占用线程"""
+        return await asyncio.wrap_future(self.submit(fn, *args, **kwargs))
+
+    def run_background(self, fn, *args, **kwargs):
+        """同run，用于后台任务：前台写入全部完成后才执行"""
+        if threading.current_thread() is self._thread:
+            return fn(self._session, *args, **kwargs)
+        return self._put((Future(), fn, args, kwargs), background=True).result()
+
+    def drain(self):
+        """等待此前提交的写操作全部提交"""
+        self.run_background(_noop)
+
+    def _put(self, job: tuple, background: bool) -> Future:
+        with self._cond:
+            self._jobs[background].append(job)
+            self._cond.notify()
+        self._ensure_started()
+        return job[0]
+
+    def _ensure_started(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._start_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._loop, name='db-writer', daemon=True)
+                self._thread.start()
+
+    def _loop(self):
+        background = True
+        while True:
+            with self._cond:
+                while not any(self._jobs):
+                    self._cond.wait()
+                # 前台与后台批次交替执行
+                background = bool(self._jobs[1]) and (not self._jobs[0] or not background)
+                jobs = self._jobs[background]
+                batch = [jobs.popleft() for _ in range(min(len(jobs), self.batch_max))]
+            rest = self._execute(batch, background)
+            if rest:
+                with self._cond:
+                    self._jobs[True].extendleft(reversed(rest))
+
+    def _execute(self, batch: list, background: bool = False) -> list:
+        """
+        在一个事务中依次执行一批写操作，提交后再通知各自的等待方
+        :param background: 后台批次，有前台写入到达时提前提交
+        :return: 因提前提交而未执行的写操作
+        """
+        results, rest = [], []
+        session: Session = self.session_factory()
+        self._session = session
+        try:
+            session.execute(text('BEGIN IMMEDIATE'))
+            for i, (future, fn, args, kwargs) in enumerate(batch):
+                if background and results and self._jobs[0]:
+                    rest = batch[i:]
+                    break
+                if not future.set_running_or_notify_cancel():
+                    continue
+                try:
+                    with session.begin_nested():
+                        results.append((future, fn(session, *args, **kwargs), None))
+                except Exception as e:
+                    results.append((future, None, e))
+            session.commit()
+        except Exception as e:
+            session.rollback()
+            error(f'(DB) 写入事务提交失败，{len(batch)} 个写操作未生效: {e}')
+            running = {id(future) for future, _, _ in results}
+            results = [(future, None, e) for future, _, _ in results]
+            for future, _, _, _ in batch:
+                if id(future) not in running and future.set_running_or_notify_cancel():
+                    results.append((future, None, e))
+            rest = []
+        finally:
+            self._session = None
+            session.close()
+
+        for future, result, exc in results:
+            if exc is None:
+                future.set_result(result)
+            else:
+                future.set_exception(exc)
+        return rest
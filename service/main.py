@@ -1,5 +1,26 @@
-from gui.window import ServerGUI
+import argparse
+import multiprocessing
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='图片管理服务端')
+    parser.add_argument('--headless', action='store_true', help='不启动界面，直接以数据库中的配置运行服务')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='服务进程数，大于1时以无界面模式运行；扫描与缩略图队列只在其中一个进程执行')
+    parser.add_argument('--host', default='0.0.0.0', help='监听地址（无界面模式）')
+    return parser.parse_args()
+
 
 if __name__ == '__main__':
-    app = ServerGUI()
-    app.mainloop()
\ No newline at end of file
+    multiprocessing.freeze_support()
+    args = parse_args()
+    if args.headless or args.workers > 1:
+        import uvicorn
+        # 在启动服务进程之前完成数据库初始化与迁移，各进程只读取配置
+        from core.config import config
+        uvicorn.run('server.app:app', host=args.host, port=config.port, workers=args.workers, log_config=None)
+    else:
+        # 界面只在主进程中导入，服务进程不加载tkinter
+        from gui.window import ServerGUI
+        app = ServerGUI()
+        app.mainloop()
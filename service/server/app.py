@@ -1,16 +1,19 @@
 import os
 import asyncio
+import threading
+import anyio
 from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from core.config import config
+from core.logger import error
 from server.handlers import (
-    list_root_folders, list_files, delete_file,
-    file_info, file_content, folder_mark, restore_file,
-    calculate_folder_phash, phash_status, find_similar_images
+    list_root_folders, list_files, count_files, export_files, delete_file,
+    file_info, file_content, thumbnail, thumbnails, thumb_priority, thumb_status, folder_mark, restore_file,
+    calculate_folder_phash, phash_status, find_similar_images, THUMB_QUEUE, BACKGROUND_LOCK
 )
-from utils.scanner import scan_directory
-from database.connection import SessionLocal
+from utils.scanner import scan_directory, DEFAULT_WORKERS
+from database.connection import ReadSessionLocal, DB_WRITER, TASK_LOCKS
 
 
 @asynccontextmanager
@@ -19,12 +22,53 @@ async def lifespan(app: FastAPI):
         print(f"[FATAL] ROOT_DIR 检查失败: {config.root_dir}")
         os._exit(1)
 
-    # 启动目录扫描
-    asyncio.create_task(scan_directory(config.root_dir, SessionLocal))
+    loop = asyncio.get_running_loop()
+    scan = None
+    # 每次扫描使用各自的停止标记，停止后重新开始的扫描不会让上一次扫描继续运行
+    scan_stop = threading.Event()
+
+    def start_background():
+        """
+        取得后台任务锁：启动缩略图队列（继续处理未完成的任务）与目录扫描
+        - 在任务锁的回调线程中执行，上一次扫描仍在收尾时新的扫描等待其退出
+        - 抛出异常时任务锁被释放，由其他进程接管
+        """
+        nonlocal scan, scan_stop
+        workers = {**DEFAULT_WORKERS, **config.workers}
+        THUMB_QUEUE.start(config.root_dir, workers['thumb'], config.thumb_layout, config.thumb_formats)
+        scan_stop = threading.Event()
+        scan = asyncio.run_coroutine_threadsafe(scan_directory(
+            config.root_dir, ReadSessionLocal, DB_WRITER, config.hash_mode, config.workers, THUMB_QUEUE, scan_stop
+        ), loop)
+        scan.add_done_callback(_log_scan_result)
+
+    def stop_background():
+        """后台任务锁被其他进程接管：停止扫描与缩略图队列，交由对方继续"""
+        scan_stop.set()
+        THUMB_QUEUE.stop(wait=True)
+
+    # 多个服务进程中只有一个执行扫描与缩略图队列，该进程退出后由其他进程接管
+    TASK_LOCKS.watch(BACKGROUND_LOCK, start_background, stop_background, state=THUMB_QUEUE.stats)
     yield
+    # 不再争取后台任务锁，此后不会再启动扫描与缩略图队列
+    await anyio.to_thread.run_sync(TASK_LOCKS.unwatch, BACKGROUND_LOCK)
+    # 停止扫描，已完成的部分保留在检查点；未完成的缩略图任务留在队列中
+    scan_stop.set()
+    THUMB_QUEUE.stop()
+    if scan is not None:
+        # 等待扫描写完当前批次再释放后台任务锁，避免与接管的进程同时扫描
+        await asyncio.wait([asyncio.wrap_future(scan)])
+    TASK_LOCKS.stop()
+    DB_WRITER.drain()
     print('服务器已关闭')
 
 
+def _log_scan_result(future):
+    """扫描在事件循环中执行，结束时记录异常，否则异常只留在future中无人查看"""
+    if not future.cancelled() and future.exception() is not None:
+        error(f'(SCAN) 扫描失败: {future.exception()!r}')
+
+
 app = FastAPI(lifespan=lifespan)
 
 # 配置CORS
@@ -39,10 +83,17 @@ app.add_middleware(
 # 注册路由
 app.get("/list_root_folders")(list_root_folders)
 app.get("/list_files")(list_files)
+app.get("/count_files")(count_files)
+app.get("/export_files")(export_files)
 app.delete("/delete_file")(delete_file)
 app.post("/restore_file")(restore_file)
 app.get("/file_info")(file_info)
 app.get("/file_content")(file_content)
+app.head("/file_content")(file_content)
+app.get("/thumbnail")(thumbnail)
+app.post("/thumbnails")(thumbnails)
+app.post("/thumb_priority")(thumb_priority)
+app.get("/thumb_status")(thumb_status)
 app.get("/folder_mark")(folder_mark)
 app.post("/calculate_phash")(calculate_folder_phash)
 app.get("/phash_status")(phash_status)
@@ -1,125 +1,385 @@
 import os
+import json
+import stat as stat_module
+import base64
 import time
 import shutil
+import struct
+import hashlib
+import mimetypes
+import functools
+import email.utils
 import urllib.parse
 from pathlib import Path
 from typing import Optional
+import anyio
 from PIL import Image
 import imagehash
-from fastapi import HTTPException, Query, Depends, BackgroundTasks
+from fastapi import HTTPException, Query, Header, Body, BackgroundTasks
+from fastapi.responses import FileResponse, Response, StreamingResponse
+from sqlalchemy import and_, or_, func, select, update
 from sqlalchemy.orm import Session
-from database.connection import get_db, SessionLocal
+from database.connection import run_read, ReadSessionLocal, read_engine, DB_WRITER, TASK_LOCKS
 from database.models import FolderRecord, FileRecord
+from database.task_lock import get_lock
 from core.config import config
-from core.logger import info, error
+from core.logger import info, warning, error
+from utils.thumb import THUMB_SIZES, OUTPUT_FORMATS, get_thumb_path, is_thumb_fresh, make_thumb, make_thumbs, \
+    negotiate_format
+from utils.singleflight import SingleFlight
+from utils.fingerprint import ensure_md5, is_confirmed_md5
+from utils.thumb_queue import ThumbQueue, prioritize_folder, prioritize_files, forced_paths, clear_force
+from server.range_response import RangeFileResponse
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+THUMB_BATCH_MAX = 500
+EXPORT_CHUNK = 5000
+PHASH_BATCH = 200
+THUMB_FLIGHTS = SingleFlight()
+THUMB_QUEUE = ThumbQueue(DB_WRITER)
+# 目录扫描与缩略图队列只在持有此锁的进程中运行
+BACKGROUND_LOCK = "background"
+
+# 地址带有当前版本号的缩略图内容不会再变，允许客户端长期缓存；其余响应每次使用前校验
+IMMUTABLE_CACHE = "public, max-age=31536000, immutable"
+REVALIDATE_CACHE = "no-cache"
+
+
+def _etag(*parts) -> str:
+    """由版本信息与请求参数生成弱ETag"""
+    raw = json.dumps(parts, ensure_ascii=False, default=str).encode()
+    return f'W/"{hashlib.sha1(raw).hexdigest()[:20]}"'
+
+
+def _stat_etag(stat: os.stat_result) -> str:
+    """文件的强ETag：修改时间（纳秒）与大小"""
+    return f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+
+
+def _validators(etag: str, last_modified: float | None = None, cache_control: str = REVALIDATE_CACHE) -> dict:
+    headers = {"ETag": etag, "Cache-Control": cache_control}
+    if last_modified is not None:
+        headers["Last-Modified"] = email.utils.formatdate(last_modified, usegmt=True)
+    return headers
+
+
+def _is_not_modified(headers: dict, if_none_match: Optional[str], if_modified_since: Optional[str] = None) -> bool:
+    """
+    客户端缓存是否仍有效
+    - 有If-None-Match时只比较ETag（弱比较），否则比较If-Modified-Since
+    """
+    if if_none_match is not None:
+        tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+        return "*" in tags or headers["ETag"].removeprefix("W/") in tags
+    if if_modified_since and "Last-Modified" in headers:
+        try:
+            since = email.utils.parsedate_to_datetime(if_modified_since)
+            return email.utils.parsedate_to_datetime(headers["Last-Modified"]) <= since
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+def _not_modified(headers: dict) -> Response:
+    return Response(status_code=304, headers=headers)
+
+
+def _rows(session: Session, query) -> list:
+    return session.execute(query).all()
+
+
+def _scalars(session: Session, query) -> list:
+    return session.scalars(query).all()
+
+
+def _scalar(session: Session, query):
+    return session.scalar(query)
 
-PHASH_TASKS = {}
 
-def list_root_folders(db: Session = Depends(get_db)):
-    query = db.query(FolderRecord)
-    return {"folders": query.all()}
+async def list_root_folders(
+        response: Response,
+        if_none_match: Optional[str] = Header(None),
+):
+    folders = await run_read(_scalars, select(FolderRecord))
+    headers = _validators(_etag(*(
+        (f.folder, f.generation, f.count, f.mark, f.last_mtime) for f in folders
+    )))
+    if _is_not_modified(headers, if_none_match):
+        return _not_modified(headers)
+    response.headers.update(headers)
+    return {"folders": folders}
+
+
+# 可排序字段 {参数: 列}，翻页时以 (排序列, id) 为游标
+SORT_COLUMNS = {
+    "name": FileRecord.file_name,
+    "type": FileRecord.mime_type,
+    "size": FileRecord.file_size,
+    "deleted_at": FileRecord.deleted_at,
+    "path": FileRecord.file_path,
+}
+FILE_COLUMNS = FileRecord.__table__.c
+LIST_LIMIT_MAX = 5000
+
+
+def _file_filters(folder: Optional[str], is_deleted: bool) -> list:
+    """列表筛选条件：回收站可跨文件夹，正常列表限定文件夹"""
+    if is_deleted:
+        filters = [FileRecord.deleted_at > 0]
+        if folder:
+            filters.append(FileRecord.root_folder == folder)
+        return filters
+    return [FileRecord.root_folder == folder, FileRecord.deleted_at == 0]
+
+
+def _resolve_sort(sort: Optional[str], order: str, is_deleted: bool) -> tuple[str, str]:
+    """补全默认排序：回收站默认按删除时间倒序，其余按路径"""
+    if not sort:
+        if is_deleted:
+            # 参数默认值是 "asc"，回收站未指定排序时按删除时间倒序更符合常理
+            return "deleted_at", "desc"
+        return "path", order
+    if sort not in SORT_COLUMNS:
+        sort = "path"
+    return sort, order
 
 
-def list_files(
+def _encode_cursor(sort: str, order: str, value, file_id: int) -> str:
+    """游标：排序方式与末行 (排序值, id)，URL安全base64"""
+    raw = json.dumps([sort, order, value, file_id], ensure_ascii=False).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def _decode_cursor(cursor: str, sort: str, order: str) -> tuple:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        cursor_sort, cursor_order, value, file_id = json.loads(raw)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="游标无效")
+    if (cursor_sort, cursor_order) != (sort, order):
+        raise HTTPException(status_code=400, detail="游标与排序方式不一致")
+    return value, file_id
+
+
+def _select_fields(fields: Optional[str]) -> list[str]:
+    """返回字段，缺省为全部列"""
+    if not fields:
+        return [c.name for c in FILE_COLUMNS]
+    names = list(dict.fromkeys(f.strip() for f in fields.split(",") if f.strip()))
+    unknown = [n for n in names if n not in FILE_COLUMNS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"未知字段: {', '.join(unknown)}")
+    return names
+
+
+def _listing_etag(db: Session, folder: Optional[str], is_deleted: bool, *params) -> str | None:
+    """
+    列表的ETag：所涉文件夹的版本号与请求参数
+    - 文件夹尚无记录（首次扫描中）时返回None，不做缓存校验
+    """
+    query = db.query(FolderRecord.folder, FolderRecord.generation)
+    if folder:
+        query = query.filter(FolderRecord.folder == folder)
+    generations = [tuple(row) for row in query.order_by(FolderRecord.folder)]
+    if folder and not generations:
+        return None
+    return _etag(generations, is_deleted, *params)
+
+
+def _query_listing(session: Session, query, if_none_match: Optional[str],
+                   folder: Optional[str], is_deleted: bool, *params) -> tuple[str | None, list | None]:
+    """
+    在同一次线程切换中取得列表的ETag与记录
+    - 客户端缓存仍有效时不再查询记录，返回 (ETag, None)
+    """
+    etag = _listing_etag(session, folder, is_deleted, *params)
+    if etag is not None and _is_not_modified(_validators(etag), if_none_match):
+        return etag, None
+    return etag, session.execute(query).all()
+
+
+async def list_files(
+        response: Response,
         folder: Optional[str] = Query(None, description="一级文件夹"),
         sort: Optional[str] = Query(None, description="排序字段"),
         order: str = Query("asc", description="排序顺序"),
         is_deleted: bool = Query(False, description="获取删除文件"),
-        db: Session = Depends(get_db)
+        limit: Optional[int] = Query(None, ge=1, le=LIST_LIMIT_MAX, description="每页数量，缺省返回全部"),
+        cursor: Optional[str] = Query(None, description="上一页返回的next_cursor"),
+        fields: Optional[str] = Query(None, description="返回字段，逗号分隔，缺省为全部"),
+        if_none_match: Optional[str] = Header(None),
 ):
-    query = db.query(FileRecord)
-
-    if is_deleted:
-        query = query.filter(FileRecord.deleted_at > 0)
-        if folder:
-            query = query.filter(FileRecord.root_folder == folder)
-
-        if not sort:
-            sort = "deleted_at"
-            if order != "asc":
-                order = "desc"
-            else:
-                # 若前端没传 order，由于参数默认值是 "asc"，我们在这里强制改写为 "desc" 更符合常理
-                # 如果你想严格遵守传入的 asc，可以去掉这行赋值
-                order = "desc"
+    sort, order = _resolve_sort(sort, order, is_deleted)
+    is_asc = (order == "asc")
+    sort_column = SORT_COLUMNS[sort]
+    names = _select_fields(fields)
+
+    # 正在浏览的文件夹优先生成缩略图
+    if folder and not is_deleted and not cursor:
+        _prioritize(prioritize_folder, folder)
+
+    # 只查询需要的列，另取排序列与id用于生成游标
+    columns = names + [n for n in (sort_column.key, "id") if n not in names]
+    query = select(*(FILE_COLUMNS[n] for n in columns)).where(*_file_filters(folder, is_deleted))
+
+    if cursor:
+        value, file_id = _decode_cursor(cursor, sort, order)
+        if is_asc:
+            query = query.where(or_(sort_column > value, and_(sort_column == value, FileRecord.id > file_id)))
+        else:
+            query = query.where(or_(sort_column < value, and_(sort_column == value, FileRecord.id < file_id)))
+
+    # 排序处理，id保证同值记录顺序稳定
+    if is_asc:
+        query = query.order_by(sort_column.asc(), FileRecord.id.asc())
     else:
-        query = query.filter(FileRecord.root_folder == folder, FileRecord.deleted_at == 0)
+        query = query.order_by(sort_column.desc(), FileRecord.id.desc())
 
-        if not sort:
-            sort = "path"
+    if limit:
+        query = query.limit(limit + 1)
+
+    # 文件夹内容与缩略图设置未变时不再查询
+    thumb_settings = _thumb_settings()
+    etag, rows = await run_read(
+        _query_listing, query, if_none_match, folder, is_deleted, sort, order, limit, cursor, names, thumb_settings
+    )
+    if etag is not None:
+        headers = _validators(etag)
+        if rows is None:
+            return _not_modified(headers)
+        response.headers.update(headers)
+
+    next_cursor = None
+    if limit and len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]._mapping
+        next_cursor = _encode_cursor(sort, order, last[sort_column.key], last["id"])
+
+    count = len(names)
+    # 客户端以thumb_settings与文件记录算出缩略图地址的版本号
+    return {
+        "files": [dict(zip(names, row[:count])) for row in rows],
+        "next_cursor": next_cursor,
+        "thumb_settings": thumb_settings,
+    }
 
-    # 排序处理
-    is_asc = (order == "asc")
-    if sort == "name":
-        query = query.order_by(FileRecord.file_name.asc() if is_asc else FileRecord.file_name.desc())
-    elif sort == "type":
-        query = query.order_by(FileRecord.mime_type.asc() if is_asc else FileRecord.mime_type.desc())
-    elif sort == "size":
-        query = query.order_by(FileRecord.file_size.asc() if is_asc else FileRecord.file_size.desc())
-    elif sort == "deleted_at":
-        query = query.order_by(FileRecord.deleted_at.asc() if is_asc else FileRecord.deleted_at.desc())
-    else:
-        query = query.order_by(FileRecord.file_path.asc() if is_asc else FileRecord.file_path.desc())
 
-    files = query.all()
-    return {"files": [f.__dict__ for f in files]}
+async def count_files(
+        folder: Optional[str] = Query(None, description="一级文件夹"),
+        is_deleted: bool = Query(False, description="统计删除文件"),
+):
+    count, total_size = (await run_read(
+        _rows, select(func.count(FileRecord.id), func.sum(FileRecord.file_size)).where(*_file_filters(folder, is_deleted))
+    ))[0]
+    return {"count": count, "total_size": total_size or 0}
+
+
+def _dumps(record: dict) -> bytes:
+    """序列化单条记录，安装了orjson时使用orjson"""
+    if orjson is not None:
+        return orjson.dumps(record)
+    return json.dumps(record, ensure_ascii=False, separators=(",", ":")).encode()
+
+
+def _export_rows(names: list[str], filters: list):
+    """按id分段读取，每段一个短事务：内存占用与记录数无关，也不会长时间占用数据库阻塞扫描写入"""
+    columns = [FILE_COLUMNS[n] for n in names] + ([] if "id" in names else [FILE_COLUMNS.id])
+    count = len(names)
+    last_id = 0
+    while True:
+        with read_engine.connect() as conn:
+            rows = conn.execute(
+                select(*columns).where(*filters, FileRecord.id > last_id).order_by(FileRecord.id).limit(EXPORT_CHUNK)
+            ).all()
+        if not rows:
+            return
+        last_id = rows[-1].id
+        yield b"".join(_dumps(dict(zip(names, row[:count]))) + b"\n" for row in rows)
 
 
-def delete_file(
+async def export_files(
+        folder: Optional[str] = Query(None, description="一级文件夹，缺省导出全部"),
+        is_deleted: bool = Query(False, description="导出删除文件"),
+        fields: Optional[str] = Query(None, description="导出字段，逗号分隔，缺省为全部"),
+):
+    names = _select_fields(fields)
+    filters = [FileRecord.deleted_at > 0 if is_deleted else FileRecord.deleted_at == 0]
+    if folder:
+        filters.append(FileRecord.root_folder == folder)
+    # 每行一条JSON记录，边读边发送
+    return StreamingResponse(_export_rows(names, filters), media_type="application/x-ndjson")
+
+
+async def delete_file(
         file_path: str,
-        db: Session = Depends(get_db)
 ):
     if not config.is_recycle_folder:
         print(f"'.recycle' 目录不存在，无法安全删除文件")
 
     file_path = urllib.parse.unquote(file_path)
-    src = Path(file_path)
-
-    if not src.exists():
-        db.query(FileRecord).filter(FileRecord.file_path == file_path).update({"deleted_at": int(time.time())})
-        db.commit()
+    # 文件系统操作（跨设备移动会复制文件）在线程中执行
+    dst = await anyio.to_thread.run_sync(_move_to_recycle, Path(file_path))
+    if dst is None:
+        await DB_WRITER.run_async(_mark_deleted, file_path, False)
         return {"message": "文件已不存在，仅在数据库中标记为已删除"}
 
-    # 构造回收站路径
+    await DB_WRITER.run_async(_mark_deleted, file_path, True)
+    return {"message": "已移入回收站", "recycle_path": str(dst)}
+
+
+def _recycle_path(src: Path) -> Path:
+    """文件在回收站中的路径：.recycle/<一级文件夹>/<相对路径>"""
     root_folder = src.relative_to(config.root_dir).parts[0]
     rel_path = src.relative_to(Path(config.root_dir) / root_folder)
+    return Path(config.root_dir) / config.recycle_folder / root_folder / rel_path
 
-    recycle_dir = Path(config.root_dir) / config.recycle_folder / root_folder / rel_path.parent
-    recycle_dir.mkdir(parents=True, exist_ok=True)
-    dst = recycle_dir / src.name
 
+def _move_to_recycle(src: Path) -> Path | None:
+    """将文件移入回收站，返回回收站中的路径；文件已不存在时返回None"""
+    if not src.exists():
+        return None
+    dst = _recycle_path(src)
+    dst.parent.mkdir(parents=True, exist_ok=True)
     try:
         shutil.move(str(src), str(dst))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"移动失败: {e}")
+    return dst
+
 
+def _mark_deleted(session: Session, file_path: str, recycled: bool):
+    """
+    记录删除时间
+    :param recycled: 文件已移入回收站，同时减少文件夹计数
+    """
     # 查询FileRecord记录，获取root_folder
-    file_record = db.query(FileRecord).filter(FileRecord.file_path == file_path).first()
-    if file_record:
-        # 更新删除时间戳
-        file_record.deleted_at = int(time.time())
-        db_root_folder = file_record.root_folder
-
-        # 更新count
-        if db_root_folder:
-            folder_record = db.query(FolderRecord).filter(FolderRecord.folder == db_root_folder).first()
-            if folder_record:
-                folder_record.count = (folder_record.count or 0) - 1
-                if folder_record.count < 0:
-                    folder_record.count = 0
-
-    db.commit()
-    return {"message": "已移入回收站", "recycle_path": str(dst)}
+    file_record = session.query(FileRecord).filter(FileRecord.file_path == file_path).first()
+    if not file_record:
+        return
+    # 更新删除时间戳
+    file_record.deleted_at = int(time.time())
+    db_root_folder = file_record.root_folder
+
+    # 更新count
+    if recycled and db_root_folder:
+        folder_record = session.query(FolderRecord).filter(FolderRecord.folder == db_root_folder).first()
+        if folder_record:
+            folder_record.count = (folder_record.count or 0) - 1
+            if folder_record.count < 0:
+                folder_record.count = 0
 
 
 # 移出回收站
-def restore_file(
+async def restore_file(
         file_path: str = Query(...),
-        db: Session = Depends(get_db)
 ):
     file_path = urllib.parse.unquote(file_path)
 
-    file_record = db.query(FileRecord).filter(FileRecord.file_path == file_path).first()
+    file_record = await run_read(_scalar, select(FileRecord).where(FileRecord.file_path == file_path).limit(1))
     if not file_record:
         raise HTTPException(status_code=404, detail="数据库无此文件记录")
 
@@ -127,42 +387,47 @@ def restore_file(
         return {"message": "文件未被删除，无需恢复"}
 
     src = Path(file_path)
-    root_folder = src.relative_to(config.root_dir).parts[0]
-    rel_path = src.relative_to(Path(config.root_dir) / root_folder)
+    await anyio.to_thread.run_sync(_restore_from_recycle, src)
 
-    recycle_dir = Path(config.root_dir) / config.recycle_folder / root_folder / rel_path.parent
-    recycle_file = recycle_dir / src.name
+    await DB_WRITER.run_async(_mark_restored, file_path)
+    return {"message": "已移出回收站并恢复数据", "restore_path": str(src)}
 
-    if recycle_file.exists():
-        src.parent.mkdir(parents=True, exist_ok=True)
-        try:
-            shutil.move(str(recycle_file), str(src))
-        except Exception as e:
-            raise HTTPException(status_code=500, detail=f"恢复物理文件失败: {e}")
 
+def _restore_from_recycle(src: Path):
+    """将回收站中的文件移回原路径，回收站中没有该文件时不做处理"""
+    recycle_file = _recycle_path(src)
+    if not recycle_file.exists():
+        return
+    src.parent.mkdir(parents=True, exist_ok=True)
+    try:
+        shutil.move(str(recycle_file), str(src))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"恢复物理文件失败: {e}")
+
+
+def _mark_restored(session: Session, file_path: str):
+    """清除删除时间并增加文件夹计数"""
+    file_record = session.query(FileRecord).filter(FileRecord.file_path == file_path).first()
+    if not file_record or file_record.deleted_at == 0:
+        return
     file_record.deleted_at = 0
 
-    folder_record = db.query(FolderRecord).filter(FolderRecord.folder == file_record.root_folder).first()
+    folder_record = session.query(FolderRecord).filter(FolderRecord.folder == file_record.root_folder).first()
     if folder_record:
         folder_record.count = (folder_record.count or 0) + 1
 
-    db.commit()
-    return {"message": "已移出回收站并恢复数据", "restore_path": str(src)}
 
-
-def file_info(
+async def file_info(
         file_path: str,
-        db: Session = Depends(get_db)
 ):
-    record = db.query(FileRecord).filter(FileRecord.file_path == file_path).first()
+    record = await run_read(_scalar, select(FileRecord).where(FileRecord.file_path == file_path).limit(1))
     if not record:
         raise HTTPException(status_code=404, detail="数据库无此文件")
     return record.__dict__
 
 
-def file_content(file_path: str = Query(...)):
-    from fastapi.responses import FileResponse
-
+def _resolve_path(file_path: str) -> Path:
+    """将相对根目录的路径解析为绝对路径，禁止越出根目录；会访问文件系统（解析符号链接），在线程中调用"""
     file_path = urllib.parse.unquote(f'{config.root_dir}/{file_path}')
     abs_path = Path(file_path).resolve()
     root = Path(config.root_dir).resolve()
@@ -170,80 +435,411 @@ def file_content(file_path: str = Query(...)):
     if root not in abs_path.parents and root != abs_path:
         raise HTTPException(status_code=403, detail="路径非法")
 
-    if not abs_path.exists() or not abs_path.is_file():
+    return abs_path
+
+
+def _stat_file(file_path: str) -> tuple[Path, os.stat_result]:
+    """解析路径并读取文件状态，不存在或不是文件时返回404"""
+    abs_path = _resolve_path(file_path)
+    try:
+        stat = abs_path.stat()
+    except OSError:
         raise HTTPException(status_code=404, detail="文件不存在")
+    if not stat_module.S_ISREG(stat.st_mode):
+        raise HTTPException(status_code=404, detail="文件不存在")
+    return abs_path, stat
+
+
+def _record_path(file_path: str) -> str:
+    """相对路径对应的文件记录路径"""
+    return str(Path(config.root_dir) / urllib.parse.unquote(file_path))
+
+
+def _thumb_records(session: Session, record_paths: list[str]) -> tuple[dict[str, str] | None, set[str]]:
+    """
+    批量查询缩略图所需的记录信息
+    - 内容寻址模式：记录中已计算的完整MD5 {记录路径: MD5}；缩略图随内容换键，不会沿用旧图
+    - 否则为None，另查原始文件内容已变化、缩略图待重新生成的记录路径
+    :return: (完整MD5, 待重新生成的记录路径)
+    """
+    if config.thumb_layout != 'content':
+        return None, forced_paths(session, record_paths)
+    rows = session.execute(
+        select(FileRecord.file_path, FileRecord.md5_hash).where(FileRecord.file_path.in_(set(record_paths)))
+    )
+    return {path: md5_hash for path, md5_hash in rows if is_confirmed_md5(md5_hash)}, set()
+
+
+async def file_content(
+        file_path: str = Query(...),
+        if_none_match: Optional[str] = Header(None),
+        if_modified_since: Optional[str] = Header(None)
+):
+    # 路径解析与stat在线程中执行，根目录位于网络存储时慢速的文件系统调用不阻塞事件循环
+    abs_path, stat = await anyio.to_thread.run_sync(_stat_file, file_path)
+    headers = _validators(_stat_etag(stat), stat.st_mtime)
+    if _is_not_modified(headers, if_none_match, if_modified_since):
+        return _not_modified(headers)
+    # 视频拖动依赖Range请求，单段Range返回206
+    return RangeFileResponse(abs_path, stat, headers=headers, filename=abs_path.name)
+
+
+def _thumb_settings() -> str:
+    """缩略图设置的版本：存放方式与输出格式改变后，同一文件的缩略图内容可能随之改变"""
+    raw = json.dumps([config.thumb_layout, sorted(config.thumb_formats)]).encode()
+    return hashlib.sha1(raw).hexdigest()[:6]
+
+
+def _thumb_version(stat: os.stat_result, quick_hash: str | None) -> str:
+    """
+    缩略图地址中的版本号，由决定缩略图内容的全部输入组成，客户端由文件记录与列表返回的thumb_settings算出同一值
+    - 原始文件修改时间（毫秒）、大小与inode（十六进制），及抽样哈希前8位：原位替换的文件即使保留了修改时间，
+      inode或内容也会不同
+    - 缩略图设置的版本
+    """
+    return "-".join((
+        format(int(stat.st_mtime * 1000), "x"), format(stat.st_size, "x"), format(stat.st_ino, "x"),
+        (quick_hash or "")[:8], _thumb_settings()
+    ))
+
+
+async def thumbnail(
+        file_path: str = Query(..., description="原始文件相对路径"),
+        size: str = Query("thumb", description="缩略图尺寸：thumb/medium"),
+        v: Optional[str] = Query(None, description="版本号，与原始文件及缩略图设置的当前版本完全一致时响应可长期缓存"),
+        accept: Optional[str] = Header(None),
+        if_none_match: Optional[str] = Header(None),
+        if_modified_since: Optional[str] = Header(None),
+):
+    if size not in THUMB_SIZES:
+        raise HTTPException(status_code=400, detail="缩略图尺寸无效")
+
+    # 按Accept选择客户端支持的输出格式，不支持时返回原始格式
+    fmt = negotiate_format(accept, config.thumb_formats)
+    # 路径解析、记录查询与文件状态检查在同一次线程切换中完成，根目录位于网络存储时不阻塞事件循环
+    try:
+        abs_path, key, thumb_path, source_stat, version, forced, fresh = await run_read(
+            _thumb_source, file_path, size, fmt
+        )
+    except ValueError:
+        raise HTTPException(status_code=415, detail="该文件类型没有缩略图")
+
+    if source_stat is None:
+        # 已移入回收站的文件沿用已有缩略图
+        cached, cached_fmt, thumb_stat = await anyio.to_thread.run_sync(_recycled_thumb, abs_path, size, key, fmt)
+        if cached is None:
+            raise HTTPException(status_code=404, detail="文件不存在")
+        headers = _validators(_stat_etag(thumb_stat), thumb_stat.st_mtime)
+        if _is_not_modified(headers, if_none_match, if_modified_since):
+            return _not_modified({**headers, "Vary": "Accept"})
+        return _thumb_response(cached, cached_fmt, headers)
+
+    # 缩略图由原始文件版本、缩略图设置、尺寸与输出格式决定，客户端已有同一版本时无需生成与传输
+    # 只有地址中的版本号与当前版本完全一致时才允许长期缓存
+    headers = _validators(
+        f'"{version}-{size}-{fmt or "orig"}"', source_stat.st_mtime,
+        IMMUTABLE_CACHE if v == version else REVALIDATE_CACHE
+    )
+    if _is_not_modified(headers, if_none_match, if_modified_since):
+        return _not_modified({**headers, "Vary": "Accept"})
+
+    if forced:
+        # 原始文件内容已变化而修改时间未变，已有缩略图不可用，当场重新生成全部尺寸与格式
+        try:
+            await anyio.to_thread.run_sync(
+                THUMB_FLIGHTS.do, f"force:{abs_path}", _regenerate_thumbs, abs_path, _record_path(file_path)
+            )
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"缩略图生成失败: {e}")
+    # 缓存未命中时在线程中当场生成，同一缩略图的并发请求只生成一次
+    elif not fresh:
+        try:
+            await anyio.to_thread.run_sync(functools.partial(
+                THUMB_FLIGHTS.do, str(thumb_path),
+                make_thumb, str(abs_path), config.root_dir, THUMB_SIZES[size], size, content_key=key, fmt=fmt
+            ))
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"缩略图生成失败: {e}")
+
+    return _thumb_response(thumb_path, fmt, headers)
+
+
+def _thumb_source(session: Session, file_path: str, size: str,
+                  fmt: str | None) -> tuple[Path, str | None, Path, os.stat_result | None, str | None, bool, bool]:
+    """
+    缩略图请求所需的记录与文件状态
+    - 先完成查询并归还连接，之后的文件系统调用较慢时不占用连接池
+    :return: (原始文件路径, 内容寻址的键, 缩略图路径, 原始文件状态（不是文件时为None）, 缩略图版本号,
+              是否待强制重新生成, 缩略图是否最新)
+    """
+    abs_path = _resolve_path(file_path)
+    record_path = _record_path(file_path)
+    md5_hashes, forced = _thumb_records(session, [record_path])
+    quick_hash = session.scalar(select(FileRecord.quick_hash).where(FileRecord.file_path == record_path))
+    session.close()
+
+    # 不生成缩略图的文件类型先行拒绝，不为其计算MD5
+    thumb_path = get_thumb_path(str(abs_path), config.root_dir, size, fmt=fmt)
+    key = None
+    if md5_hashes is not None:
+        # 记录中尚未计算完整MD5时当场计算并写回，原始文件已不在时退回按路径存放的缩略图
+        key = md5_hashes.get(record_path) or ensure_md5(record_path, None, DB_WRITER)
+        thumb_path = get_thumb_path(str(abs_path), config.root_dir, size, key, fmt)
+    try:
+        source_stat = abs_path.stat()
+    except OSError:
+        source_stat = None
+    if source_stat is None or not stat_module.S_ISREG(source_stat.st_mode):
+        return abs_path, key, thumb_path, None, None, False, False
+    version = _thumb_version(source_stat, quick_hash)
+    return abs_path, key, thumb_path, source_stat, version, bool(forced), is_thumb_fresh(thumb_path, source_stat, key)
+
+
+def _recycled_thumb(abs_path: Path, size: str, key: str | None,
+                    fmt: str | None) -> tuple[Path | None, str | None, os.stat_result | None]:
+    """原始文件已不在原位置时的已有缩略图，返回 (缩略图路径, 格式, 缩略图状态)，没有时均为None"""
+    cached, cached_fmt = _cached_thumb(abs_path, size, key, fmt)
+    if cached is None:
+        return None, None, None
+    try:
+        return cached, cached_fmt, cached.stat()
+    except OSError:
+        return None, None, None
+
+
+def _regenerate_thumbs(abs_path: Path, record_path: str):
+    """强制重新生成全部尺寸与格式的缩略图，之后队列中的任务不再强制重新生成"""
+    make_thumbs(str(abs_path), config.root_dir, force=True, formats=(None, *config.thumb_formats))
+    DB_WRITER.run(clear_force, record_path)
+
+
+def _thumb_response(thumb_path: Path, fmt: str | None, headers: dict) -> FileResponse:
+    """同一地址按Accept返回不同格式，需声明Vary"""
+    media_type = OUTPUT_FORMATS[fmt][1] if fmt else None
+    return FileResponse(thumb_path, media_type=media_type, headers={**headers, "Vary": "Accept"})
+
+
+def _cached_thumb(abs_path: Path, size: str, key: str | None, fmt: str | None) -> tuple[Path | None, str | None]:
+    """
+    已缓存且最新的缩略图，优先fmt格式，其次原始格式
+    - 原始文件已移入回收站时沿用已有缩略图
+    """
+    try:
+        source_stat = abs_path.stat()
+    except OSError:
+        source_stat = None
+    for candidate in dict.fromkeys((fmt, None)):
+        thumb_path = get_thumb_path(str(abs_path), config.root_dir, size, key, candidate)
+        if is_thumb_fresh(thumb_path, source_stat, key) if source_stat else thumb_path.is_file():
+            return thumb_path, candidate
+    return None, None
+
+
+async def thumbnails(
+        file_paths: list[str] = Body(..., embed=True, description="原始文件相对路径列表"),
+        size: str = Query("thumb", description="缩略图尺寸：thumb/medium"),
+        accept: Optional[str] = Header(None),
+):
+    """
+    一次返回一页已缓存的缩略图
+    - 响应体：4字节大端清单长度 + JSON清单 + 按清单顺序拼接的图片数据
+    - 清单每项 {file_path, status, content_type, length}，status非200的项length为0
+    - 未缓存的项不在此生成，只提升其队列优先级，由客户端单独请求
+    """
+    if size not in THUMB_SIZES:
+        raise HTTPException(status_code=400, detail="缩略图尺寸无效")
+    if len(file_paths) > THUMB_BATCH_MAX:
+        raise HTTPException(status_code=400, detail=f"单次最多请求 {THUMB_BATCH_MAX} 个缩略图")
+
+    fmt = negotiate_format(accept, config.thumb_formats)
+    # 一次查询所有记录，读取缩略图在线程中进行
+    md5_hashes, forced = await run_read(_thumb_records, [_record_path(file_path) for file_path in file_paths])
+    manifest, chunks, missing = await anyio.to_thread.run_sync(
+        _read_thumbs, file_paths, size, fmt, md5_hashes, forced
+    )
+
+    # 缺失的缩略图优先生成
+    if missing:
+        _prioritize(prioritize_files, missing)
+
+    header = json.dumps(manifest, ensure_ascii=False).encode()
+    body = b"".join([struct.pack(">I", len(header)), header, *chunks])
+    return Response(body, media_type="application/octet-stream", headers={"Vary": "Accept"})
+
+
+def _read_thumbs(file_paths: list[str], size: str, fmt: str | None,
+                 md5_hashes: dict[str, str] | None, forced: set[str] = frozenset()) -> tuple[list, list, list]:
+    """
+    读取已缓存的缩略图
+    :param md5_hashes: 记录中的完整MD5，None表示非内容寻址模式；尚未计算的视为缺失，不在批量请求中计算
+    :param forced: 待重新生成的记录路径，已有缩略图视为缺失
+    :return: (清单, 图片数据, 缺失缩略图的原始文件路径)
+    """
+    manifest, chunks, missing = [], [], []
+    for file_path in file_paths:
+        item = {"file_path": file_path, "status": 200, "content_type": None, "length": 0}
+        manifest.append(item)
+        try:
+            abs_path = _resolve_path(file_path)
+            record_path = _record_path(file_path)
+            key = md5_hashes.get(record_path) if md5_hashes is not None else None
+            thumb_path, thumb_fmt = None, None
+            if md5_hashes is not None and key is None:
+                get_thumb_path(str(abs_path), config.root_dir, size)  # 不生成缩略图的文件类型返回415
+            elif record_path not in forced:
+                thumb_path, thumb_fmt = _cached_thumb(abs_path, size, key, fmt)
+            data = thumb_path.read_bytes() if thumb_path is not None else None
+        except HTTPException as e:
+            item["status"] = e.status_code
+            continue
+        except ValueError:
+            item["status"] = 415
+            continue
+        except OSError:
+            data = None
+        if data is None:
+            item["status"] = 404
+            missing.append(str(Path(config.root_dir) / urllib.parse.unquote(file_path)))
+            continue
+        content_type = OUTPUT_FORMATS[thumb_fmt][1] if thumb_fmt else mimetypes.guess_type(thumb_path.name)[0]
+        item.update(content_type=content_type, length=len(data))
+        chunks.append(data)
+    return manifest, chunks, missing
+
+
+def _prioritize(fn, *args):
+    """提升缩略图优先级：交给写线程执行，不等待提交，有任务被提升时唤醒队列"""
+    DB_WRITER.submit(fn, *args).add_done_callback(_notify_prioritized)
+
+
+def _notify_prioritized(future):
+    if future.exception() is not None:
+        error(f"(THUMB) 提升缩略图优先级失败: {future.exception()}")
+    elif future.result():
+        THUMB_QUEUE.notify()
 
-    return FileResponse(abs_path, filename=abs_path.name)
+
+async def thumb_priority(
+        folder: Optional[str] = Query(None, description="一级文件夹"),
+        file_path: list[str] = Query([], description="原始文件完整路径，可重复"),
+):
+    updated = 0
+    if folder:
+        updated += await DB_WRITER.run_async(prioritize_folder, folder)
+    if file_path:
+        updated += await DB_WRITER.run_async(prioritize_files, file_path)
+    if updated:
+        THUMB_QUEUE.notify()
+    return {"message": "已提升优先级", "updated": updated}
+
+
+async def thumb_status():
+    return await run_read(_thumb_status)
 
 
-def folder_mark(
+def _thumb_status(session: Session) -> dict:
+    """缩略图队列可能由其他服务进程执行，运行状态与吞吐量取其发布在锁上的状态"""
+    if TASK_LOCKS.held(BACKGROUND_LOCK):
+        return THUMB_QUEUE.status(session)
+    lock = get_lock(session, BACKGROUND_LOCK)
+    return THUMB_QUEUE.status(session, json.loads(lock.state) if lock and lock.state else None)
+
+
+async def folder_mark(
         folder: str,
         mark: str,
-        db: Session = Depends(get_db)
 ):
-    record = db.query(FolderRecord).filter(FolderRecord.folder == folder).update(
-        {FolderRecord.mark: mark}
-    )
+    record = await DB_WRITER.run_async(_set_folder_mark, folder, mark)
     if not record:
         raise HTTPException(status_code=404, detail="数据库无此文件")
     return {"message": "标记成功", "mark": str(mark)}
 
 
+def _set_folder_mark(session: Session, folder: str, mark: str) -> int:
+    return session.query(FolderRecord).filter(FolderRecord.folder == folder).update(
+        {FolderRecord.mark: mark}
+    )
+
+
+def _phash_lock(folder: str) -> str:
+    return f"phash:{folder}"
+
+
 def _compute_and_save_phash(folder: str):
-    db = SessionLocal()
+    """计算文件夹中图片的pHash，调用方已取得该文件夹的pHash锁，结束时释放"""
+    lock = _phash_lock(folder)
+    db = ReadSessionLocal()
     try:
         info(f"[pHash] 开始扫描并计算目录 [{folder}] 中图片的pHash")
 
-        files = db.query(FileRecord).filter(
+        files = db.query(FileRecord.id, FileRecord.file_path).filter(
             FileRecord.root_folder == folder,
             FileRecord.file_type == 'image',
             FileRecord.phash.is_(None),
             FileRecord.deleted_at == 0
         ).all()
+        db.close()
 
         if not files:
             info(f"[pHash] 目录 [{folder}] 没有需要计算的图片")
             return
 
+        # 每PHASH_BATCH张提交一次，计算期间不占用写锁
         success_count = 0
+        computed = []
         for record in files:
             try:
                 with Image.open(record.file_path) as img:
-                    phash_value = str(imagehash.phash(img))
-                    record.phash = phash_value
+                    computed.append({"id": record.id, "phash": str(imagehash.phash(img))})
                     success_count += 1
             except Exception as e:
                 error(f"[pHash] 文件计算失败 {record.file_path}: {e}")
-
-        db.commit()
+            if len(computed) >= PHASH_BATCH:
+                DB_WRITER.run_background(_save_phash, computed)
+                computed = []
+                if not TASK_LOCKS.held(lock):
+                    warning(f"[pHash] 目录 [{folder}] 的任务已由其他进程接管，停止计算")
+                    return
+
+        DB_WRITER.run_background(_save_phash, computed)
         info(f"[pHash] 目录 [{folder}] 计算完成，共处理 {success_count} 张图片")
-        pass
     except Exception as e:
         error(f"[pHash] 目录 [{folder}] 处理时发生严重异常: {e}")
     finally:
         db.close()
-        PHASH_TASKS[folder] = False
+        TASK_LOCKS.release(lock)
 
 
-def calculate_folder_phash(
-        folder: str = Query(..., description="一级文件夹名"),
-        background_tasks: BackgroundTasks = BackgroundTasks(),
-        db: Session = Depends(get_db)
-):
-    if PHASH_TASKS.get(folder, False):
-        return {"message": "任务正在进行中", "status": "running"}
+def _save_phash(session: Session, rows: list[dict]):
+    """按id批量写入pHash"""
+    if rows:
+        session.execute(update(FileRecord), rows)
 
-    count = db.query(FileRecord).filter(
+
+def _pending_phash_count(folder: str):
+    """文件夹中尚未计算pHash的图片数"""
+    return select(func.count(FileRecord.id)).where(
         FileRecord.root_folder == folder,
         FileRecord.file_type == 'image',
         FileRecord.phash.is_(None),
         FileRecord.deleted_at == 0
-    ).count()
+    )
+
+
+async def calculate_folder_phash(
+        folder: str = Query(..., description="一级文件夹名"),
+        background_tasks: BackgroundTasks = BackgroundTasks(),
+):
+    # 同一文件夹同时只有一个计算任务，多个服务进程之间同样如此
+    if not await TASK_LOCKS.acquire_async(_phash_lock(folder)):
+        return {"message": "任务正在进行中", "status": "running"}
+
+    count = await run_read(_scalar, _pending_phash_count(folder))
 
     if count == 0:
+        await TASK_LOCKS.release_async(_phash_lock(folder))
         return {"message": "该目录下所有图片已计算完毕", "status": "completed"}
 
-    PHASH_TASKS[folder] = True
     background_tasks.add_task(_compute_and_save_phash, folder)
 
     return {
@@ -253,39 +849,49 @@ def calculate_folder_phash(
     }
 
 
-def phash_status(
+async def phash_status(
         folder: str = Query(..., description="一级文件夹"),
-        db: Session = Depends(get_db)
 ):
-    remaining_count = db.query(FileRecord).filter(
-        FileRecord.root_folder == folder,
-        FileRecord.file_type == 'image',
-        FileRecord.phash.is_(None),
-        FileRecord.deleted_at == 0
-    ).count()
+    remaining_count, running = await run_read(_phash_progress, folder)
 
     return {
         "folder": folder,
         "remaining": remaining_count,
-        "is_completed": remaining_count == 0
+        "is_completed": remaining_count == 0,
+        "running": running
     }
 
 
-def find_similar_images(
+def _phash_progress(session: Session, folder: str) -> tuple[int, bool]:
+    """待计算数量，以及是否有进程正在计算（任一服务进程）"""
+    return session.scalar(_pending_phash_count(folder)), get_lock(session, _phash_lock(folder)) is not None
+
+
+async def find_similar_images(
         folder: str = Query(..., description="一级文件夹"),
         distance: int = Query(5, description="汉明距离阈值"),
-        db: Session = Depends(get_db)
 ):
-    files = db.query(FileRecord).filter(
+    files = await run_read(_scalars, select(FileRecord).where(
         FileRecord.root_folder == folder,
         FileRecord.file_type == 'image',
         FileRecord.phash.isnot(None),
         FileRecord.deleted_at == 0
-    ).all()
+    ))
 
     if not files:
         return {"message": "没有可比对的图片", "groups": []}
 
+    # 两两比对耗时与图片数的平方成正比，在线程中进行
+    result_groups = await anyio.to_thread.run_sync(_group_similar, files, distance)
+    return {
+        "message": f"找到 {len(result_groups)} 组相似图片",
+        "groups": result_groups,
+        "thumb_settings": _thumb_settings(),
+    }
+
+
+def _group_similar(files: list[FileRecord], distance: int) -> list[list[dict]]:
+    """按pHash汉明距离分组，返回多于一张的组"""
     visited = set()
     similar_groups = []
 
@@ -323,8 +929,4 @@ def find_similar_images(
             {c.name: getattr(item, c.name) for c in item.__table__.columns}
             for item in group
         ])
-
-    return {
-        "message": f"找到 {len(result_groups)} 组相似图片",
-        "groups": result_groups
-    }
\ No newline at end of file
+    return result_groups
\ No newline at end of file
@@ -0,0 +1,144 @@
+import os
+import mimetypes
+from email.utils import formatdate
+from urllib.parse import quote
+import anyio
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.responses import Response
+from starlette.types import Scope, Receive, Send
+
+# 每次读取发送的块大小：1MB时完整下载吞吐量约为64KB的5倍，拖动后的首字节延迟不变（见bench_range.py）
+CHUNK_SIZE = 1024 * 1024
+
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+
+def parse_range(header: str, file_size: int) -> tuple[int, int] | None:
+    """
+    解析单段Range请求头，返回 [start, end)
+    - 非bytes单位、多段或格式错误时返回None，按完整文件响应
+    - 起始位置超出文件时抛出RangeNotSatisfiable
+    """
+    unit, _, spec = header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in spec:
+        return None
+    first, sep, last = (part.strip() for part in spec.partition("-"))
+    if not sep or not (first or last) or not all(part.isdigit() for part in (first, last) if part):
+        return None
+
+    if not first:
+        # 末尾n字节
+        suffix = int(last)
+        if suffix == 0 or file_size == 0:
+            raise RangeNotSatisfiable()
+        return max(file_size - suffix, 0), file_size
+
+    start = int(first)
+    if start >= file_size:
+        raise RangeNotSatisfiable()
+    end = int(last) + 1 if last else file_size
+    if end <= start:
+        return None
+    return start, min(end, file_size)
+
+
+class RangeFileResponse(Response):
+    """
+    支持断点续传与拖动的文件响应，不依赖框架自身的Range实现
+    - 单段Range返回206；多段Range或If-Range不匹配时返回完整文件
+    - 服务器支持zerocopysend/pathsend扩展时由服务器直接发送文件（sendfile），否则按块读取发送
+    - 客户端断开（播放器拖动后放弃旧请求）时立即停止读取
+    """
+    chunk_size = CHUNK_SIZE
+
+    def __init__(
+            self,
+            path: str | os.PathLike,
+            stat_result: os.stat_result,
+            headers: dict | None = None,
+            media_type: str | None = None,
+            filename: str | None = None,
+    ):
+        self.path = str(path)
+        self.stat_result = stat_result
+        self.status_code = 200
+        self.media_type = media_type or mimetypes.guess_type(filename or self.path)[0] or "application/octet-stream"
+        self.background = None
+        self.init_headers(headers)
+        self.headers["content-length"] = str(stat_result.st_size)
+        self.headers.setdefault("accept-ranges", "bytes")
+        self.headers.setdefault("last-modified", formatdate(stat_result.st_mtime, usegmt=True))
+        if filename is not None:
+            quoted = quote(filename)
+            if quoted != filename:
+                self.headers.setdefault("content-disposition", f"attachment; filename*=utf-8''{quoted}")
+            else:
+                self.headers.setdefault("content-disposition", f'attachment; filename="{filename}"')
+
+    def _if_range_matches(self, if_range: str | None) -> bool:
+        """If-Range只接受强ETag或完全一致的修改时间"""
+        if if_range is None:
+            return True
+        if if_range.startswith("W/"):
+            return False
+        return if_range in (self.headers.get("etag"), self.headers["last-modified"])
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        file_size = self.stat_result.st_size
+        start, end = 0, file_size
+        status = 200
+        headers = MutableHeaders(raw=list(self.raw_headers))
+
+        request_headers = Headers(scope=scope)
+        http_range = request_headers.get("range")
+        if http_range and self._if_range_matches(request_headers.get("if-range")):
+            try:
+                byte_range = parse_range(http_range, file_size)
+            except RangeNotSatisfiable:
+                response = Response(status_code=416, headers={"content-range": f"bytes */{file_size}"})
+                await response(scope, receive, send)
+                return
+            if byte_range is not None:
+                start, end = byte_range
+                status = 206
+                headers["content-range"] = f"bytes {start}-{end - 1}/{file_size}"
+                headers["content-length"] = str(end - start)
+
+        await send({"type": "http.response.start", "status": status, "headers": headers.raw})
+        if scope["method"].upper() == "HEAD" or start == end:
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+            return
+
+        extensions = scope.get("extensions") or {}
+        if status == 200 and "http.response.pathsend" in extensions:
+            await send({"type": "http.response.pathsend", "path": self.path})
+            return
+
+        async with anyio.create_task_group() as task_group:
+            async def watch_disconnect():
+                while (await receive())["type"] != "http.disconnect":
+                    pass
+                task_group.cancel_scope.cancel()
+
+            task_group.start_soon(watch_disconnect)
+            await self._send_file(send, start, end, "http.response.zerocopysend" in extensions)
+            task_group.cancel_scope.cancel()
+
+    async def _send_file(self, send: Send, start: int, end: int, zerocopy: bool):
+        with open(self.path, "rb") as file:
+            if zerocopy:
+                await send({
+                    "type": "http.response.zerocopysend", "file": file,
+                    "offset": start, "count": end - start, "more_body": False
+                })
+                return
+
+            file.seek(start)
+            while start < end:
+                chunk = await anyio.to_thread.run_sync(file.read, min(self.chunk_size, end - start))
+                if not chunk:
+                    raise RuntimeError(f"文件长度小于预期：{self.path}")
+                start += len(chunk)
+                await send({"type": "http.response.body", "body": chunk, "more_body": start < end})
@@ -0,0 +1,139 @@
+import threading
+from concurrent.futures import Future
+
+import pytest
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import sessionmaker
+
+from database.writer import DbWriter
+
+
+@pytest.fixture
+def engine(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'test.db'}", connect_args={"check_same_thread": False})
+    with engine.begin() as conn:
+        conn.execute(text("CREATE TABLE items (name TEXT PRIMARY KEY)"))
+    yield engine
+    engine.dispose()
+
+
+@pytest.fixture
+def writer(engine):
+    return DbWriter(sessionmaker(bind=engine, expire_on_commit=False))
+
+
+def _names(engine) -> list[str]:
+    with engine.connect() as conn:
+        return [row[0] for row in conn.execute(text("SELECT name FROM items ORDER BY name"))]
+
+
+def _insert(session, name):
+    session.execute(text("INSERT INTO items (name) VALUES (:name)"), {"name": name})
+    return id(session)
+
+
+def _fail(session, name):
+    _insert(session, name)
+    raise RuntimeError(name)
+
+
+def _hold(writer) -> threading.Event:
+    """占住写线程，之后提交的写操作在释放后合并为一批执行"""
+    started, release = threading.Event(), threading.Event()
+
+    def hold(_):
+        started.set()
+        release.wait(5)
+
+    writer.submit(hold)
+    assert started.wait(5)
+    return release
+
+
+def _background(writer, fn, *args) -> Future:
+    """提交后台写操作，不等待"""
+    return writer._put((Future(), fn, args, {}), background=True)
+
+
+def test_failing_job_rolls_back_only_itself(writer, engine):
+    release = _hold(writer)
+    futures = [writer.submit(_insert, "a"), writer.submit(_fail, "b"), writer.submit(_insert, "c")]
+    release.set()
+
+    assert futures[0].result(5) == futures[2].result(5)  # 同一事务
+    with pytest.raises(RuntimeError, match="b"):
+        futures[1].result(5)
+    assert _names(engine) == ["a", "c"]
+
+
+def test_foreground_preempts_background_batch(writer, engine):
+    order = []
+
+    def record(session, name):
+        order.append(name)
+        return _insert(session, name)
+
+    def first(session):
+        # 后台批次执行中有前台写入到达
+        foreground.append(writer.submit(record, "fg"))
+        return record(session, "bg1")
+
+    foreground = []
+    release = _hold(writer)
+    futures = [_background(writer, first)]
+    futures += [_background(writer, record, f"bg{i}") for i in range(2, 6)]
+    release.set()
+
+    sessions = [future.result(5) for future in futures]
+    foreground[0].result(5)
+    assert order == ["bg1", "fg", "bg2", "bg3", "bg4", "bg5"]
+    # 前台写入到达后后台批次提前提交，其余操作按原顺序在之后的事务中执行
+    assert sessions[0] != sessions[1]
+    assert len(set(sessions[1:])) == 1
+    assert _names(engine) == ["bg1", "bg2", "bg3", "bg4", "bg5", "fg"]
+
+
+def test_commit_failure_fails_every_future(engine):
+    factory = sessionmaker(bind=engine)
+
+    def failing_session():
+        session = factory()
+
+        def commit():
+            raise RuntimeError("disk full")
+        session.commit = commit
+        return session
+
+    writer = DbWriter(failing_session)
+    release = _hold(writer)
+    futures = [writer.submit(_insert, "a"), writer.submit(_fail, "b"), writer.submit(_insert, "c")]
+    release.set()
+
+    for future in futures:
+        with pytest.raises(RuntimeError, match="disk full"):
+            future.result(5)
+    assert _names(engine) == []
+
+
+def test_run_is_reentrant_on_writer_thread(writer, engine):
+    def outer(session):
+        inner = writer.run(_insert, "inner")
+        background = writer.run_background(_insert, "background")
+        _insert(session, "outer")
+        return inner, background, id(session)
+
+    inner, background, outer_session = writer.run(outer)
+    # 写线程内的写入直接在当前事务中执行，不会排队等待自身
+    assert inner == background == outer_session
+    assert _names(engine) == ["background", "inner", "outer"]
+
+
+def test_reentrant_failure_propagates(writer, engine):
+    def outer(session):
+        _insert(session, "outer")
+        writer.run(_fail, "inner")
+
+    with pytest.raises(RuntimeError, match="inner"):
+        writer.run(outer)
+    assert writer.run(_insert, "after")
+    assert _names(engine) == ["after"]
@@ -0,0 +1,163 @@
+import os
+from email.utils import formatdate
+
+import pytest
+from starlette.applications import Starlette
+from starlette.routing import Route
+from starlette.testclient import TestClient
+
+from server.range_response import RangeFileResponse, RangeNotSatisfiable, parse_range
+
+SIZE = 1000
+ETAG = '"abc-3e8"'
+
+
+@pytest.mark.parametrize("header, expected", [
+    ("bytes=0-99", (0, 100)),
+    ("bytes=100-199", (100, 200)),
+    ("bytes=900-5000", (900, SIZE)),  # 结束位置超出文件时截断
+    ("bytes=500-", (500, SIZE)),
+    ("bytes=-100", (900, SIZE)),
+    ("bytes=-5000", (0, SIZE)),  # 末尾n字节超过文件长度时为整个文件
+    ("BYTES = 0-0", (0, 1)),
+])
+def test_parse_range(header, expected):
+    assert parse_range(header, SIZE) == expected
+
+
+@pytest.mark.parametrize("header", [
+    "bytes=0-99,200-299",  # 多段
+    "items=0-99",
+    "bytes=",
+    "bytes=-",
+    "bytes=abc-def",
+    "bytes=1-a",
+    "bytes=0x10-20",
+    "bytes=99",
+    "bytes=200-100",  # 结束位置在起始位置之前
+])
+def test_parse_range_ignored(header):
+    assert parse_range(header, SIZE) is None
+
+
+@pytest.mark.parametrize("header, size", [
+    ("bytes=1000-", SIZE),
+    ("bytes=1000-1999", SIZE),
+    ("bytes=-0", SIZE),
+    ("bytes=-10", 0),
+    ("bytes=0-", 0),
+])
+def test_parse_range_not_satisfiable(header, size):
+    with pytest.raises(RangeNotSatisfiable):
+        parse_range(header, size)
+
+
+@pytest.fixture
+def data():
+    return bytes(i % 251 for i in range(SIZE))
+
+
+@pytest.fixture
+def client(tmp_path, data):
+    path = tmp_path / "video.mp4"
+    path.write_bytes(data)
+
+    def serve(request):
+        return RangeFileResponse(path, os.stat(path), headers={"ETag": ETAG})
+
+    app = Starlette(routes=[Route("/file", serve, methods=["GET", "HEAD"])])
+    with TestClient(app) as client:
+        yield client
+
+
+def _last_modified(client) -> str:
+    return client.head("/file").headers["last-modified"]
+
+
+def test_full_response(client, data):
+    response = client.get("/file")
+    assert response.status_code == 200
+    assert response.content == data
+    assert response.headers["content-length"] == str(SIZE)
+    assert response.headers["accept-ranges"] == "bytes"
+    assert response.headers["content-type"] == "video/mp4"
+    assert "content-range" not in response.headers
+
+
+@pytest.mark.parametrize("header, start, end", [
+    ("bytes=0-99", 0, 100),
+    ("bytes=500-", 500, SIZE),
+    ("bytes=-10", SIZE - 10, SIZE),
+    ("bytes=990-5000", 990, SIZE),
+])
+def test_partial_content(client, data, header, start, end):
+    response = client.get("/file", headers={"Range": header})
+    assert response.status_code == 206
+    assert response.headers["content-range"] == f"bytes {start}-{end - 1}/{SIZE}"
+    assert response.headers["content-length"] == str(end - start)
+    assert response.content == data[start:end]
+
+
+@pytest.mark.parametrize("header", ["bytes=1000-", "bytes=-0"])
+def test_range_not_satisfiable(client, header):
+    response = client.get("/file", headers={"Range": header})
+    assert response.status_code == 416
+    assert response.headers["content-range"] == f"bytes */{SIZE}"
+    assert response.content == b""
+
+
+@pytest.mark.parametrize("header", ["bytes=0-9,20-29", "bytes=abc", "items=0-9"])
+def test_ignored_range_returns_full_file(client, data, header):
+    response = client.get("/file", headers={"Range": header})
+    assert response.status_code == 200
+    assert response.content == data
+    assert "content-range" not in response.headers
+
+
+def test_if_range_matching_etag(client, data):
+    response = client.get("/file", headers={"Range": "bytes=10-19", "If-Range": ETAG})
+    assert response.status_code == 206
+    assert response.content == data[10:20]
+
+
+def test_if_range_matching_last_modified(client, data):
+    headers = {"Range": "bytes=10-19", "If-Range": _last_modified(client)}
+    response = client.get("/file", headers=headers)
+    assert response.status_code == 206
+    assert response.content == data[10:20]
+
+
+@pytest.mark.parametrize("if_range", [
+    '"other-etag"',
+    formatdate(0, usegmt=True),
+    f"W/{ETAG}",  # 弱校验值不能用于If-Range
+])
+def test_if_range_not_matching_returns_full_file(client, data, if_range):
+    response = client.get("/file", headers={"Range": "bytes=10-19", "If-Range": if_range})
+    assert response.status_code == 200
+    assert response.content == data
+    assert "content-range" not in response.headers
+
+
+def test_head(client):
+    response = client.head("/file")
+    assert response.status_code == 200
+    assert response.headers["content-length"] == str(SIZE)
+    assert response.headers["etag"] == ETAG
+    assert response.content == b""
+
+
+def test_head_range(client):
+    response = client.head("/file", headers={"Range": "bytes=0-99"})
+    assert response.status_code == 206
+    assert response.headers["content-range"] == f"bytes 0-99/{SIZE}"
+    assert response.headers["content-length"] == "100"
+    assert response.content == b""
+
+
+def test_small_chunks(client, data, monkeypatch):
+    """按块发送时各块拼接完整"""
+    monkeypatch.setattr(RangeFileResponse, "chunk_size", 64)
+    response = client.get("/file", headers={"Range": "bytes=7-900"})
+    assert response.status_code == 206
+    assert response.content == data[7:901]
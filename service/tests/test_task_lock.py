@@ -0,0 +1,168 @@
+import threading
+import time
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from database.models import TaskLock
+from database.task_lock import TaskLocks, acquire_lock, get_lock
+from database.writer import DbWriter
+
+
+class _Locks(TaskLocks):
+    """同一进程中模拟不同持有者"""
+
+    def __init__(self, writer: DbWriter, owner: str, **kwargs):
+        super().__init__(writer, **kwargs)
+        self._owner = owner
+
+    @property
+    def owner(self) -> str:
+        return self._owner
+
+
+@pytest.fixture
+def writer(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'test.db'}", connect_args={"check_same_thread": False})
+    TaskLock.__table__.create(engine)
+    yield DbWriter(sessionmaker(bind=engine, expire_on_commit=False))
+    engine.dispose()
+
+
+@pytest.fixture
+def make_locks(writer):
+    created = []
+
+    def make(owner: str, ttl: float = 1.0, interval: float = 0.05) -> _Locks:
+        locks = _Locks(writer, owner, ttl=ttl, interval=interval)
+        created.append(locks)
+        return locks
+
+    yield make
+    for locks in created:
+        locks.stop()
+
+
+def _holder(writer, name: str = "job") -> str | None:
+    lock = writer.run(get_lock, name)
+    return lock.owner if lock else None
+
+
+def _wait(predicate, timeout: float = 3.0) -> bool:
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.02)
+    return False
+
+
+def test_acquire_is_exclusive(make_locks, writer):
+    a, b = make_locks("a"), make_locks("b")
+    assert a.acquire("job")
+    assert not b.acquire("job")
+    assert a.acquire("job")  # 持有者再次取得即续期
+    assert a.held("job") and not b.held("job")
+    assert _holder(writer) == "a"
+
+
+def test_heartbeat_renews_lease(make_locks, writer):
+    a, b = make_locks("a", ttl=0.3), make_locks("b")
+    assert a.acquire("job")
+    time.sleep(0.6)
+    assert not b.acquire("job")
+    assert _holder(writer) == "a"
+
+
+def test_expired_lease_is_taken_over(make_locks, writer):
+    # 心跳间隔长于租约：模拟持有进程失去响应
+    a, b = make_locks("a", ttl=0.2, interval=60), make_locks("b")
+    assert a.acquire("job")
+    assert not b.acquire("job")
+    time.sleep(0.3)
+    assert b.acquire("job")
+    assert _holder(writer) == "b"
+
+
+def test_release_and_stop(make_locks, writer):
+    a, b = make_locks("a"), make_locks("b")
+    assert a.acquire("job")
+    a.release("job")
+    assert _holder(writer) is None
+    assert b.acquire("job")
+    b.stop()
+    assert _holder(writer) is None
+
+
+def test_watch_takeover_callbacks(make_locks, writer):
+    events = {name: threading.Event() for name in ("a_acquired", "a_lost", "b_acquired")}
+    a, b = make_locks("a"), make_locks("b")
+    a.watch("job", events["a_acquired"].set, events["a_lost"].set)
+    assert events["a_acquired"].wait(3)
+
+    b.watch("job", events["b_acquired"].set, lambda: None)
+    assert not events["b_acquired"].wait(0.3)
+
+    # 模拟a失去响应期间租约过期并由b取得：同一事务中完成，a的心跳不会先行续期
+    def take_over(session):
+        session.query(TaskLock).update({TaskLock.expires_at: 0})
+        assert acquire_lock(session, "job", "b", 1.0)
+
+    writer.run(take_over)
+    assert events["b_acquired"].wait(3)
+    assert events["a_lost"].wait(3)
+    assert not a.held("job") and b.held("job")
+    assert _holder(writer) == "b"
+
+
+def test_slow_callback_does_not_block_renewal(make_locks, writer):
+    release = threading.Event()
+    a, b = make_locks("a", ttl=0.3), make_locks("b")
+    # b先持有，a待命：之后由a的心跳线程取得锁并触发回调
+    assert b.acquire("job")
+    a.watch("job", lambda: release.wait(5), lambda: None)
+    b.release("job")
+    try:
+        assert _wait(lambda: a.held("job"))
+        time.sleep(0.8)
+        assert not b.acquire("job")
+        assert _holder(writer) == "a"
+    finally:
+        release.set()
+
+
+def test_failed_callback_releases_and_backs_off(make_locks, writer):
+    calls = []
+
+    def fail():
+        calls.append(time.time())
+        raise RuntimeError("boom")
+
+    a = make_locks("a", ttl=0.5)
+    a.watch("job", fail, lambda: None)
+    assert _wait(lambda: calls and not a.held("job"))
+    assert _holder(writer) is None
+
+    # 一个租约时长内不再争取，其他进程得以接管
+    time.sleep(0.3)
+    assert len(calls) == 1
+    b = make_locks("b")
+    assert b.acquire("job")
+
+
+def test_back_off_expires(make_locks, writer):
+    calls = []
+
+    def fail():
+        calls.append(time.time())
+        if len(calls) == 1:
+            raise RuntimeError("boom")
+
+    a = make_locks("a", ttl=0.3)
+    a.watch("job", fail, lambda: None)
+    # 退避结束后再次取得，回调成功后继续持有
+    assert _wait(lambda: len(calls) == 2)
+    assert calls[1] - calls[0] >= 0.3
+    assert _wait(lambda: a.held("job"))
+    assert _holder(writer) == "a"
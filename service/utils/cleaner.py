@@ -2,7 +2,9 @@ import shutil
 from pathlib import Path
 from sqlalchemy.orm import Session
 from core.logger import info, warning, error, debug
-from database.models import FileRecord, FolderRecord
+from database.models import FileRecord, FolderRecord, DirRecord, ThumbJob
+from database.writer import DbWriter
+from utils.thumb import get_thumb_path, THUMB_SIZES, OUTPUT_FORMATS, CONTENT_DIR
 
 
 def delete_folder_if_exists(folder_path: Path, desc: str = "目录"):
@@ -22,12 +24,60 @@ def delete_folder_if_exists(folder_path: Path, desc: str = "目录"):
         debug(f'(CLEAN) {desc}目录不存在，无需删除 {folder_path}')
 
 
-def clean_missing_resources(session: Session, root_path: Path, existing_dirs: list[str]):
+def delete_thumbs(root_path: Path, file_paths: list[str]):
+    """
+    删除指定原始文件对应的缩略图缓存
+    :param root_path: 扫描的根目录路径
+    :param file_paths: 原始文件完整路径列表
+    :return:
+    """
+    for file_path in file_paths:
+        for subdir, fmt in ((d, f) for d in THUMB_SIZES for f in (None, *OUTPUT_FORMATS)):
+            try:
+                thumb_path = get_thumb_path(file_path, str(root_path), subdir, fmt=fmt)
+            except ValueError:
+                break  # 不生成缩略图的文件类型
+            try:
+                thumb_path.unlink(missing_ok=True)
+            except Exception as e:
+                error(f'(CLEAN) 删除缩略图失败 {thumb_path} → {e}')
+
+
+def gc_content_thumbs(session: Session, root_path: Path):
+    """
+    删除不再被任何文件记录引用的内容寻址缩略图
+    - 内容寻址的缩略图由重复文件共用，不能随单个文件删除，只在扫描结束后统一回收
+    - 回收站中的文件仍保留记录，其缩略图不会被回收
+    - 键为完整MD5，此前按抽样哈希存放的缩略图也在此回收
+    """
+    content_dirs = [root_path / '.cache' / subdir / CONTENT_DIR for subdir in THUMB_SIZES]
+    content_dirs = [d for d in content_dirs if d.is_dir()]
+    if not content_dirs:
+        return
+
+    keys = {row[0] for row in session.query(FileRecord.md5_hash).distinct()}
+    removed = 0
+    for content_dir in content_dirs:
+        for thumb_path in content_dir.glob('*/*'):
+            # 跳过生成中的临时文件
+            if thumb_path.name.startswith('.') or thumb_path.name.split('.')[0] in keys:
+                continue
+            try:
+                thumb_path.unlink()
+                removed += 1
+            except Exception as e:
+                error(f'(CLEAN) 删除缩略图失败 {thumb_path} → {e}')
+    if removed:
+        info(f'(CLEAN) 回收内容寻址缩略图 {removed}')
+
+
+def clean_missing_resources(session: Session, db_writer: DbWriter, root_path: Path, existing_dirs: list[str]):
     """
     清理数据库中存在但实际不存在的数据
     - 删除对应缩略图缓存
-    - 删除关联的FileRecord与FolderRecord记录
-    :param session:
+    - 删除关联的FileRecord、DirRecord、ThumbJob与FolderRecord记录
+    :param session: 只读会话
+    :param db_writer: 写线程
     :param root_path: 扫描的根目录路径
     :param existing_dirs: 当前实际存在的一级文件夹列表
     :return:
@@ -51,12 +101,27 @@ def clean_missing_resources(session: Session, root_path: Path, existing_dirs: li
         delete_folder_if_exists(thumb_dir, f'<{folder}>小缩略图')
         delete_folder_if_exists(medium_dir, f'<{folder}>大缩略图')
 
+    db_writer.run_background(_delete_folder_records, deleted_folders)
+
+
+def _delete_folder_records(session: Session, deleted_folders: list[str]):
+    """删除已不存在的文件夹的所有记录"""
     # 删除关联的FileRecord
     delete_file_count = session.query(FileRecord).filter(
         FileRecord.root_folder.in_(deleted_folders)
     ).delete(synchronize_session=False)
     warning(f'(CLEAN) 清理关联文件记录数 {delete_file_count}')
 
+    # 删除目录索引
+    session.query(DirRecord).filter(
+        DirRecord.root_folder.in_(deleted_folders)
+    ).delete(synchronize_session=False)
+
+    # 删除未完成的缩略图任务
+    session.query(ThumbJob).filter(
+        ThumbJob.root_folder.in_(deleted_folders)
+    ).delete(synchronize_session=False)
+
     # 删除FolderRecord
     delete_folder_count = session.query(FolderRecord).filter(
         FolderRecord.folder.in_(deleted_folders)
@@ -0,0 +1,165 @@
+import os
+from sqlalchemy import and_, bindparam, func, update
+from sqlalchemy.orm import Session
+from core.logger import info, error
+from database.models import FileRecord, HashCache
+from database.writer import DbWriter
+from utils.utils import get_md5, get_quick_hash
+
+PENDING_MD5 = ''
+UNKNOWN_MD5 = 'unknown'  # 读取失败，无法计算
+
+
+def is_confirmed_md5(md5_hash: str | None) -> bool:
+    """完整MD5是否已计算"""
+    return bool(md5_hash) and md5_hash != UNKNOWN_MD5
+
+
+def load_hash_cache(session: Session, file_paths: list[str]) -> dict[str, HashCache]:
+    """批量读取哈希缓存"""
+    cache = {}
+    for i in range(0, len(file_paths), 500):
+        for row in session.query(HashCache).filter(HashCache.file_path.in_(file_paths[i:i + 500])):
+            cache[row.file_path] = row
+    return cache
+
+
+def compute_fingerprint(file_path: str, stat: os.stat_result, hash_mode: str,
+                        cached: HashCache | None = None) -> tuple[str | None, str, bool]:
+    """
+    计算文件指纹，(路径, 大小, 修改时间) 未变时直接复用缓存
+    :param file_path: 文件完整路径
+    :param stat: 文件stat
+    :param hash_mode: full 计算完整MD5；tiered 仅抽样哈希，完整MD5留待重复确认时补算
+    :param cached: 该路径的缓存记录
+    :return: (抽样哈希, 完整MD5, 是否需要写回缓存)
+    """
+    quick_hash, md5_hash = None, None
+    if cached is not None and cached.file_size == stat.st_size and cached.mtime == stat.st_mtime:
+        quick_hash, md5_hash = cached.quick_hash, cached.md5_hash
+
+    dirty = False
+    if not quick_hash:
+        quick_hash = get_quick_hash(file_path, stat.st_size)
+        dirty = True
+    if hash_mode == 'full' and not md5_hash:
+        md5_hash = get_md5(file_path) or UNKNOWN_MD5
+        dirty = True
+
+    return quick_hash, md5_hash or PENDING_MD5, dirty
+
+
+def ensure_md5(file_path: str, md5_hash: str | None, db_writer: DbWriter) -> str | None:
+    """
+    文件的完整MD5：记录中已确认时直接返回，否则当场计算并写回记录与哈希缓存
+    - 计算期间文件有变化时不写回，下次扫描按新内容处理
+    :return: 读取失败时为None
+    """
+    if is_confirmed_md5(md5_hash):
+        return md5_hash
+    try:
+        stat = os.stat(file_path)
+    except OSError:
+        return None
+    md5_hash = get_md5(file_path)
+    if md5_hash is None:
+        return None
+    db_writer.run_background(_save_computed_md5, file_path, stat, md5_hash)
+    return md5_hash
+
+
+def _save_computed_md5(session: Session, file_path: str, stat: os.stat_result, md5_hash: str):
+    """写回按需计算的完整MD5，文件大小与修改时间须与记录一致"""
+    try:
+        current = os.stat(file_path)
+    except OSError:
+        return
+    if (current.st_size, current.st_mtime_ns) != (stat.st_size, stat.st_mtime_ns):
+        return
+    session.query(FileRecord).filter(
+        FileRecord.file_path == file_path, FileRecord.file_size == stat.st_size, FileRecord.mtime == stat.st_mtime,
+        FileRecord.md5_hash.in_((PENDING_MD5, UNKNOWN_MD5))
+    ).update({FileRecord.md5_hash: md5_hash}, synchronize_session=False)
+    session.query(HashCache).filter(
+        HashCache.file_path == file_path, HashCache.file_size == stat.st_size, HashCache.mtime == stat.st_mtime
+    ).update({HashCache.md5_hash: md5_hash}, synchronize_session=False)
+
+
+def hash_cache_values(file_path: str, stat: os.stat_result, quick_hash: str | None, md5_hash: str) -> dict:
+    """哈希缓存行"""
+    return dict(
+        file_path=file_path,
+        file_size=stat.st_size,
+        mtime=stat.st_mtime,
+        quick_hash=quick_hash,
+        md5_hash=md5_hash or None
+    )
+
+
+def drop_hash_cache(session: Session, file_paths: list[str]):
+    """删除已消失文件的哈希缓存"""
+    for i in range(0, len(file_paths), 500):
+        session.query(HashCache).filter(
+            HashCache.file_path.in_(file_paths[i:i + 500])
+        ).delete(synchronize_session=False)
+
+
+def confirm_duplicates(session_factory, db_writer: DbWriter, batch_size: int = 200):
+    """
+    为大小与抽样哈希相同的文件补算完整MD5，确认是否真正重复
+    :param session_factory: 只读会话工厂
+    :param db_writer: 写线程，每batch_size个结果提交一次
+    """
+    session = session_factory()
+    try:
+        candidates = session.query(FileRecord.file_size, FileRecord.quick_hash).filter(
+            FileRecord.quick_hash.isnot(None),
+            FileRecord.deleted_at == 0
+        ).group_by(FileRecord.file_size, FileRecord.quick_hash).having(func.count() > 1).subquery()
+
+        records = session.query(
+            FileRecord.id, FileRecord.file_path, FileRecord.file_size, FileRecord.mtime
+        ).join(candidates, and_(
+            FileRecord.file_size == candidates.c.file_size,
+            FileRecord.quick_hash == candidates.c.quick_hash
+        )).filter(FileRecord.md5_hash == PENDING_MD5, FileRecord.deleted_at == 0).all()
+    finally:
+        session.close()
+
+    if not records:
+        return
+    info(f'(HASH) 开始确认重复候选 {len(records)} 个文件')
+
+    try:
+        confirmed = []
+        for record in records:
+            md5_hash = get_md5(record.file_path)
+            if md5_hash is None:
+                error(f'(HASH) 计算MD5失败 {record.file_path}')
+                continue
+            confirmed.append((record, md5_hash))
+            if len(confirmed) >= batch_size:
+                db_writer.run_background(_save_md5, confirmed)
+                confirmed = []
+
+        db_writer.run_background(_save_md5, confirmed)
+        info(f'(HASH) 重复候选确认完成')
+    except Exception as e:
+        error(f'(HASH) 确认重复候选失败: {e}')
+
+
+def _save_md5(session: Session, confirmed: list):
+    """批量写入完整MD5，文件未变化时同步更新哈希缓存"""
+    if not confirmed:
+        return
+    session.execute(update(FileRecord), [{'id': record.id, 'md5_hash': md5_hash} for record, md5_hash in confirmed])
+    table = HashCache.__table__
+    stmt = table.update().where(
+        table.c.file_path == bindparam('b_path'),
+        table.c.file_size == bindparam('b_size'),
+        table.c.mtime == bindparam('b_mtime')
+    ).values(md5_hash=bindparam('b_md5'))
+    session.execute(stmt, [
+        {'b_path': record.file_path, 'b_size': record.file_size, 'b_mtime': record.mtime, 'b_md5': md5_hash}
+        for record, md5_hash in confirmed
+    ])
@@ -1,14 +1,82 @@
 import os
+import threading
+from pathlib import Path
 from sqlalchemy.orm import Session
-from database.models import FolderRecord
-
-def folder_changed(session: Session, root_dir: str, folder: str) -> bool:
-    """True: 需要重新扫描"""
-    record = session.query(FolderRecord).filter(FolderRecord.folder == folder).first()
-    folder_path = os.path.join(root_dir, folder)
-    if not os.path.isdir(folder_path):
-        return False
-    current_mtime = os.stat(folder_path).st_mtime
-    if record is None:
-        return True
-    return current_mtime > record.last_mtime + 1
\ No newline at end of file
+from database.models import DirRecord
+from database.bulk_ops import upsert_dirs
+
+
+def load_dir_index(session: Session, folder: str) -> dict[str, tuple[float, int]]:
+    """读取一级文件夹下的目录索引 {目录相对路径: (mtime, 文件数)}"""
+    return {
+        row.dir_path: (row.last_mtime, row.count or 0)
+        for row in session.query(DirRecord.dir_path, DirRecord.last_mtime, DirRecord.count)
+        .filter(DirRecord.root_folder == folder)
+    }
+
+
+def walk_changed(root_dir: str, folder: str, index: dict[str, tuple[float, int]],
+                 stop: threading.Event | None = None):
+    """
+    按目录mtime索引遍历一级文件夹，仅列出mtime变动的目录
+    - mtime未变的目录不读取其文件，只沿索引中的子目录继续向下检查
+    - 目录mtime只反映条目增删改名，文件原地修改不会被发现
+    :param root_dir: 根目录
+    :param folder: 一级文件夹名
+    :param index: 目录索引
+    :param stop: 扫描的停止标记，置位后提前返回，结果不完整
+    :return: (变动目录中的文件 {完整路径: stat}, 已访问目录 {相对路径: (mtime, 文件数)}, 变动目录集合)
+    """
+    children = {}
+    for dir_path in index:
+        children.setdefault(dir_path.rpartition('/')[0], []).append(dir_path)
+
+    listing = {}
+    visited = {}
+    changed = set()
+    stack = [folder]
+    while stack:
+        if stop is not None and stop.is_set():
+            break
+        rel_dir = stack.pop()
+        abs_dir = Path(root_dir, *rel_dir.split('/'))
+        try:
+            mtime = os.stat(abs_dir).st_mtime
+        except OSError:
+            continue  # 目录已不存在
+
+        record = index.get(rel_dir)
+        if record is not None and record[0] == mtime:
+            visited[rel_dir] = record
+            stack.extend(children.get(rel_dir, []))
+            continue
+
+        # 新目录或mtime变动：重新列出
+        count = 0
+        with os.scandir(abs_dir) as entries:
+            for entry in entries:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(f'{rel_dir}/{entry.name}')
+                    elif entry.is_file():
+                        listing[str(abs_dir / entry.name)] = entry.stat()
+                        count += 1
+                except OSError:
+                    continue
+        visited[rel_dir] = (mtime, count)
+        changed.add(rel_dir)
+
+    return listing, visited, changed
+
+
+def save_dir_index(session: Session, folder: str, visited: dict[str, tuple[float, int]], removed: set[str]):
+    """写回目录索引"""
+    upsert_dirs(session, [
+        dict(dir_path=dir_path, root_folder=folder, last_mtime=mtime, count=count)
+        for dir_path, (mtime, count) in visited.items()
+    ])
+    removed = list(removed)
+    for i in range(0, len(removed), 500):
+        session.query(DirRecord).filter(
+            DirRecord.dir_path.in_(removed[i:i + 500])
+        ).delete(synchronize_session=False)
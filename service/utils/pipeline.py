@@ -0,0 +1,82 @@
+import queue
+import threading
+from typing import Callable, Iterable
+from core.logger import error
+
+_DONE = object()
+
+
+def _start_stage(func: Callable, in_q: queue.Queue, out_q: queue.Queue,
+                 workers: int, downstream_workers: int, name: str) -> list[threading.Thread]:
+    """
+    启动一个流水线阶段：workers个线程从in_q取任务，处理后放入out_q
+    最后一个退出的线程向下游发送结束标记
+    """
+    remaining = [workers]
+    lock = threading.Lock()
+
+    def worker():
+        while True:
+            job = in_q.get()
+            if job is _DONE:
+                break
+            try:
+                func(job)
+            except Exception as e:
+                job['error'] = e
+                error(f'(SCAN) {name}阶段失败 {job.get("file_path")} : {e}')
+            out_q.put(job)
+
+        with lock:
+            remaining[0] -= 1
+            if remaining[0] == 0:
+                for _ in range(downstream_workers):
+                    out_q.put(_DONE)
+
+    threads = [threading.Thread(target=worker, name=f'scan-{name}-{i}', daemon=True) for i in range(workers)]
+    for t in threads:
+        t.start()
+    return threads
+
+
+def run_pipeline(jobs: Iterable[dict], probe: Callable, hash_: Callable, persist: Callable,
+                 probe_workers: int = 4, hash_workers: int = 2, queue_size: int = 256):
+    """
+    多阶段扫描流水线：读取元数据 → 计算指纹 → 写库
+    - 读取与指纹阶段各自使用独立线程池，阶段之间由有界队列衔接，队列满时上游阻塞
+    - 写库在调用线程中串行执行，数据库会话不跨线程
+    - 某阶段失败的任务带上 error 继续传递，由写库阶段决定是否跳过
+    :param jobs: 任务字典
+    :param probe: 元数据读取
+    :param hash_: 指纹计算
+    :param persist: 写库
+    :param probe_workers: 元数据读取线程数
+    :param hash_workers: 指纹计算线程数
+    :param queue_size: 各阶段队列容量
+    """
+    probe_workers = max(1, probe_workers)
+    hash_workers = max(1, hash_workers)
+    probe_q = queue.Queue(maxsize=queue_size)
+    hash_q = queue.Queue(maxsize=queue_size)
+    persist_q = queue.Queue(maxsize=queue_size)
+
+    def feeder():
+        try:
+            for job in jobs:
+                probe_q.put(job)
+        finally:
+            for _ in range(probe_workers):
+                probe_q.put(_DONE)
+
+    threading.Thread(target=feeder, name='scan-feeder', daemon=True).start()
+    _start_stage(probe, probe_q, hash_q, probe_workers, hash_workers, 'probe')
+    _start_stage(hash_, hash_q, persist_q, hash_workers, 1, 'hash')
+
+    while True:
+        job = persist_q.get()
+        if job is _DONE:
+            break
+        try:
+            persist(job)
+        except Exception as e:
+            error(f'(SCAN) 写库失败 {job.get("file_path")} : {e}')
@@ -0,0 +1,112 @@
+import os
+import json
+import threading
+import subprocess
+from collections import OrderedDict
+from pathlib import Path
+import pyvips
+from core.logger import error
+from utils.utils import get_image_size
+
+if os.name == 'nt':
+    CREATE_NO_WINDOW = subprocess.CREATE_NO_WINDOW
+else:
+    CREATE_NO_WINDOW = 0
+
+VIDEO_EXT = {'.mp4', '.avi', '.mov', '.mkv'}
+
+_CACHE_SIZE = 4096
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+class MediaProbe:
+    """媒体文件元数据，扫描时读取一次，缩略图生成直接复用"""
+
+    def __init__(self, width: int | None = None, height: int | None = None, format: str | None = None,
+                 duration: float | None = None, orientation: int = 1, is_video: bool = False):
+        self.width = width
+        self.height = height
+        self.format = format
+        self.duration = duration
+        self.orientation = orientation
+        self.is_video = is_video
+
+    @property
+    def max_dim(self) -> int | None:
+        if not self.width or not self.height:
+            return None
+        return max(self.width, self.height)
+
+
+def probe_media(file_path: str, stat: os.stat_result | None = None) -> MediaProbe:
+    """
+    读取图片或视频的元数据，按 (路径, 大小, 修改时间) 缓存
+    - 图片只读取文件头，不解码像素；libvips不支持的格式回退到PIL
+    - 视频只调用一次ffprobe，同时取得尺寸、格式与时长
+    """
+    file_path = str(file_path)
+    if stat is None:
+        stat = os.stat(file_path)
+    key = (file_path, stat.st_size, stat.st_mtime)
+    with _cache_lock:
+        probe = _cache.get(key)
+        if probe is not None:
+            _cache.move_to_end(key)
+            return probe
+
+    if Path(file_path).suffix.lower() in VIDEO_EXT:
+        probe = _probe_video(file_path)
+    else:
+        probe = _probe_image(file_path)
+
+    with _cache_lock:
+        _cache[key] = probe
+        if len(_cache) > _CACHE_SIZE:
+            _cache.popitem(last=False)
+    return probe
+
+
+def _probe_image(image_path: str) -> MediaProbe:
+    """读取图片头信息"""
+    try:
+        image = pyvips.Image.new_from_file(image_path, access='sequential')
+        orientation = image.get('orientation') if image.get_typeof('orientation') != 0 else 1
+        loader = image.get('vips-loader') if image.get_typeof('vips-loader') != 0 else None
+        return MediaProbe(image.width, image.height, loader, orientation=orientation)
+    except Exception:
+        width, height = get_image_size(image_path)
+        return MediaProbe(width, height)
+
+
+def _probe_video(video_path: str) -> MediaProbe:
+    """使用ffprobe读取视频尺寸、格式与时长"""
+    try:
+        result = subprocess.run(
+            [
+                "ffprobe", "-v", "error",
+                "-select_streams", "v:0",
+                "-show_entries", "stream=width,height:format=duration,format_name",
+                "-of", "json",
+                video_path
+            ],
+            check=True,
+            capture_output=True,
+            text=True,
+            creationflags=CREATE_NO_WINDOW
+        )
+        data = json.loads(result.stdout)
+        stream = (data.get('streams') or [{}])[0]
+        fmt = data.get('format', {})
+        duration = fmt.get('duration')
+        return MediaProbe(
+            stream.get('width'), stream.get('height'), fmt.get('format_name'),
+            duration=float(duration) if duration else None, is_video=True
+        )
+    except subprocess.CalledProcessError as e:
+        error(f"ffprobe命令执行失败: {e.stderr}，视频路径: {video_path}")
+    except FileNotFoundError:
+        error("未找到ffprobe，请确保ffmpeg已安装并添加到系统PATH中")
+    except Exception as e:
+        error(f"获取视频信息失败: {str(e)}，视频路径: {video_path}")
+    return MediaProbe(is_video=True)
@@ -1,13 +1,27 @@
 import mimetypes
 import os, asyncio
+import posixpath
+import threading
+import time
+import itertools
 from pathlib import Path
 from sqlalchemy.orm import Session
 from core.logger import debug, info, warning, error
 from database.models import FileRecord, FolderRecord
-from utils.needs_update import folder_changed
-from utils.utils import get_md5, get_image_size
-from utils.thumb import make_thumb, get_video_dimensions
-from utils.cleaner import clean_missing_resources
+from database.bulk_ops import BulkWriter
+from database.writer import DbWriter
+from database.config_ops import get_scan_checkpoint, set_scan_checkpoint
+from utils.needs_update import load_dir_index, walk_changed, save_dir_index
+from utils.fingerprint import (
+    load_hash_cache, compute_fingerprint, hash_cache_values, drop_hash_cache, confirm_duplicates, is_confirmed_md5,
+    PENDING_MD5
+)
+from utils.pipeline import run_pipeline
+from utils.probe import MediaProbe, probe_media
+from utils.thumb import move_thumbs
+from utils.thumb_queue import ThumbQueue
+from utils.utils import get_md5
+from utils.cleaner import clean_missing_resources, delete_thumbs, gc_content_thumbs
 import tqdm
 import concurrent.futures
 
@@ -15,63 +29,441 @@ IMAGE_EXT = {'.jpg', '.jpeg', '.jpe', '.png', '.bmp', '.gif', '.tiff'}
 VIDEO_EXT = {'.mp4', '.avi', '.mov', '.mkv'}
 TEXT_EXT = {'.txt', '.md', '.log'}
 
-async def scan_directory(root_path: str, session_factory):
+# 各阶段默认线程数：目录遍历、元数据读取、指纹计算、缩略图生成
+DEFAULT_WORKERS = {
+    'walk': 4,
+    'probe': os.cpu_count() or 4,
+    'hash': 4,
+    'thumb': 8,
+}
+
+# 同一进程中同时只有一次扫描写库：上一次扫描收到停止请求后仍在收尾时，新的扫描等待其退出
+_SCAN_LOCK = threading.Lock()
+
+
+async def scan_directory(root_path: str, session_factory, db_writer: DbWriter, hash_mode: str = 'tiered',
+                         workers: dict | None = None, thumb_queue: ThumbQueue | None = None,
+                         stop: threading.Event | None = None):
+    """
+    :param session_factory: 只读会话工厂，比对所需的读取使用
+    :param db_writer: 写线程，所有写入经由它提交
+    :param stop: 本次扫描的停止标记，置位后扫描在当前批次写入后停止，下次启动从检查点继续
+    """
+    stop = stop or threading.Event()
     loop = asyncio.get_event_loop()
-    await loop.run_in_executor(None, _scan, Path(root_path), session_factory)
+    await loop.run_in_executor(None, _scan, Path(root_path), session_factory, db_writer, hash_mode, workers,
+                               thumb_queue, stop)
+    # 扫描结束后在后台补算重复候选的完整MD5
+    if hash_mode == 'tiered' and not stop.is_set():
+        await loop.run_in_executor(None, confirm_duplicates, session_factory, db_writer)
+
+
+def _scan(root_path: Path, session_factory, db_writer: DbWriter, hash_mode: str = 'tiered',
+          workers: dict | None = None, thumb_queue: ThumbQueue | None = None, stop: threading.Event | None = None):
+    stop = stop or threading.Event()
+    if not _SCAN_LOCK.acquire(blocking=False):
+        info(f'(SCAN) 等待上一次扫描结束')
+        _SCAN_LOCK.acquire()
+    try:
+        if stop.is_set():
+            return
+        _scan_locked(root_path, session_factory, db_writer, hash_mode, workers, thumb_queue, stop)
+    finally:
+        _SCAN_LOCK.release()
 
 
-def _scan(root_path: Path, session_factory):
+def _scan_locked(root_path: Path, session_factory, db_writer: DbWriter, hash_mode: str, workers: dict | None,
+                 thumb_queue: ThumbQueue | None, stop: threading.Event):
+    workers = {**DEFAULT_WORKERS, **(workers or {})}
     session = session_factory()
     try:
+        checkpoint = get_scan_checkpoint(session)
+        if checkpoint:
+            info(f'(SCAN) 上次扫描未完成，从检查点继续')
+
         # 获取所有一级文件夹
         dirs = [
             p.name for p in root_path.iterdir()
             if p.is_dir() and not p.name.startswith('.')
         ]
 
+        # 按目录索引并行遍历，仅列出变动目录
+        indexes = {folder: load_dir_index(session, folder) for folder in dirs}
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers['walk']) as walk_pool:
+            walks = {
+                folder: walk_pool.submit(walk_changed, str(root_path), folder, indexes[folder], stop)
+                for folder in dirs
+            }
+        if stop.is_set():
+            # 遍历不完整，尚未写入任何内容
+            warning(f'(SCAN) 扫描已中断')
+            return
+        scans = {}
         for folder in dirs:
-            folder_path = root_path / folder
-            if not folder_changed(session, str(root_path), folder):
+            index = indexes[folder]
+            listing, visited, changed = walks[folder].result()
+            removed = set(index) - set(visited)
+            if not changed and not removed:
                 info(f'(SKIP) 目录 [{folder}] 无变动')
                 continue
-            info(f'(SCAN) 扫描目录 [{folder}]')
-            count_files = 0
-            all_media_files = []
-
-            # 清除该文件夹旧记录
-            session.query(FileRecord).filter(FileRecord.root_folder == folder).delete()
-
-            # 遍历文件夹内文件
-            for dir_path, _, filenames in os.walk(folder_path):
-                dir_path = Path(dir_path)
-                for file in filenames:
-                    count_files = count_files + 1
-                    _process_file(session, root_path, folder, dir_path, file)
-                    ext = os.path.splitext(file)[1].lower()
-                    # 收集图片和视频文件用于生成缩略图
-                    if ext in IMAGE_EXT or ext in VIDEO_EXT:
-                        all_media_files.append(str(dir_path / file))
-
-            info(f'(SCAN) 目录 [{folder}] 扫描到 {count_files} 个文件')
-            # 批量生成两种尺寸的缩略图
-            batch_thumbs(all_media_files, root_path)
-            # 更新文件夹时间戳
+            info(f'(SCAN) 扫描目录 [{folder}] 变动子目录 {len(changed)}')
+            scans[folder] = (listing, visited, changed, removed)
+
+        # 收集已从原路径消失的记录，用于识别重命名与移动
+        existing = {}
+        for folder, (listing, _, changed, removed) in scans.items():
+            existing[folder] = {
+                file_path: row for file_path, row in _load_rows(session, folder).items()
+                if _in_dirs(posixpath.dirname(row.file), changed, removed)
+            }
+        vanished = [
+            row for folder, rows in existing.items() for file_path, row in rows.items()
+            if file_path not in scans[folder][0] and row.deleted_at == 0
+        ]
+        removed_folders = [
+            row[0] for row in session.query(FolderRecord.folder) if row[0] not in dirs
+        ]
+        for folder in removed_folders:
+            vanished.extend(row for row in _load_rows(session, folder).values() if row.deleted_at == 0)
+        if checkpoint:
+            # 上次中断时尚未认领的消失记录，其所在目录可能已写入索引
+            vanished.extend(_load_pending_vanished(session, checkpoint.get('vanished', []), vanished))
+        pool = VanishedPool(vanished)
+        writer = BulkWriter(db_writer)
+
+        if not scans and not vanished and not removed_folders:
+            db_writer.run_background(set_scan_checkpoint, None)
+            info(f'(SUCCESS) 载入完成')
+            return
+
+        # 记录检查点：各文件夹完成后即提交，中断后已提交的部分不再重复处理
+        db_writer.run_background(set_scan_checkpoint, {'started': int(time.time()), 'vanished': [row.id for row in vanished]})
+
+        incomplete = []
+        for folder, (listing, visited, changed, removed) in scans.items():
+            if stop.is_set():
+                break
+            # 与数据库记录比对，仅处理变动文件；缩略图任务随文件记录写入队列
+            queued, complete = _sync_folder(session, writer, root_path, folder, listing, existing[folder], pool,
+                                            hash_mode, workers, stop)
+
+            count_files = sum(count for _, count in visited.values())
+            info(f'(SCAN) 目录 [{folder}] 共 {count_files} 个文件')
+            if queued and thumb_queue is not None:
+                thumb_queue.notify()
+            if stop.is_set():
+                break  # 该文件夹未处理完，不写入目录索引
+            if not complete:
+                warning(f'(SCAN) 目录 [{folder}] 部分记录写入失败，下次扫描重试')
+                incomplete.append(folder)
+                continue
+            # 更新目录索引与文件夹时间戳，逐个文件夹提交
             mtime = os.stat(os.path.join(root_path, folder)).st_mtime
-            session.merge(FolderRecord(folder=folder, last_mtime=mtime, count=count_files))
+            db_writer.run_background(_save_folder, folder, visited, removed, mtime, count_files)
+
+        if stop.is_set():
+            warning(f'(SCAN) 扫描已中断，下次启动时从检查点继续')
+            return
+        if incomplete:
+            # 写入失败的文件夹可能认领了消失记录，保留检查点，下次扫描重新认领后再删除
+            warning(f'(SCAN) {len(incomplete)} 个目录写入失败，保留检查点')
+            return
+
+        # 删除未被认领的消失记录
+        _purge_vanished(db_writer, root_path, pool.remaining())
 
         # 清理
-        clean_missing_resources(session, root_path, dirs)
+        clean_missing_resources(session, db_writer, root_path, dirs)
 
-        session.commit()
+        gc_content_thumbs(session, root_path)
+        db_writer.run_background(set_scan_checkpoint, None)
         info(f'(SUCCESS) 载入完成')
     finally:
         session.close()
 
 
-def _process_file(session: Session, root_dir: Path, folder: str, dirpath: Path, file: str):
-    file_path = dirpath / file
+def _save_folder(session: Session, folder: str, visited: dict, removed: set[str], mtime: float, count: int):
+    """写入文件夹的目录索引与时间戳"""
+    save_dir_index(session, folder, visited, removed)
+    session.merge(FolderRecord(folder=folder, last_mtime=mtime, count=count))
+
+
+def _in_dirs(dir_path: str, changed: set[str], removed: set[str]) -> bool:
+    """记录所在目录是否属于本次重新列出或已删除的目录"""
+    if dir_path in changed:
+        return True
+    return any(dir_path == d or dir_path.startswith(d + '/') for d in removed)
+
+
+def _row_query(session: Session):
+    """记录比对字段"""
+    return session.query(
+        FileRecord.id, FileRecord.file_path, FileRecord.file, FileRecord.file_size, FileRecord.quick_hash,
+        FileRecord.md5_hash, FileRecord.mtime, FileRecord.inode, FileRecord.deleted_at
+    )
+
+
+def _load_rows(session: Session, folder: str) -> dict:
+    """读取文件夹下记录的比对字段"""
+    return {row.file_path: row for row in _row_query(session).filter(FileRecord.root_folder == folder)}
+
+
+def _load_pending_vanished(session: Session, ids: list[int], known: list) -> list:
+    """读取检查点中仍未认领且文件确已不存在的记录"""
+    known_ids = {row.id for row in known}
+    ids = [i for i in ids if i not in known_ids]
+    rows = []
+    for i in range(0, len(ids), 500):
+        rows.extend(
+            row for row in _row_query(session).filter(FileRecord.id.in_(ids[i:i + 500]), FileRecord.deleted_at == 0)
+            if not os.path.exists(row.file_path)
+        )
+    return rows
+
+
+class VanishedPool:
+    """
+    已从原路径消失的记录，按inode或完整MD5认领
+    - 抽样哈希只覆盖头/中/尾各64KB，仅用于筛选候选；按内容认领须完整MD5一致，
+      误认会把其他文件的id、pHash、删除状态与缩略图迁移到新路径
+    """
+
+    def __init__(self, rows: list):
+        self.rows = rows
+        self.taken = set()
+        self.by_inode = {}
+        self.by_content = {}
+        for row in rows:
+            if row.inode:
+                self.by_inode[(row.inode, row.file_size, row.mtime)] = row
+            # 原记录的完整MD5尚未计算时文件已不在，无法确认内容，不参与按内容认领
+            if row.quick_hash and is_confirmed_md5(row.md5_hash):
+                self.by_content.setdefault((row.file_size, row.quick_hash), []).append(row)
+
+    def match_inode(self, file_path: Path, stat: os.stat_result):
+        """同一inode且大小、修改时间未变：重命名或同盘移动"""
+        if not stat.st_ino:
+            return None
+        row = self.by_inode.get((stat.st_ino, stat.st_size, stat.st_mtime))
+        if row is None or row.id in self.taken:
+            return None
+        if Path(row.file_path).suffix.lower() != file_path.suffix.lower():
+            return None
+        self.taken.add(row.id)
+        return row
+
+    def has_content_candidates(self, file_size: int, quick_hash: str | None) -> bool:
+        """是否有大小与抽样哈希一致、尚未认领的记录，有时需计算新文件的完整MD5加以确认"""
+        return any(row.id not in self.taken for row in self.by_content.get((file_size, quick_hash), []))
+
+    def match_content(self, file_size: int, quick_hash: str | None, md5_hash: str):
+        """大小、抽样哈希与完整MD5一致：跨盘移动或复制后删除"""
+        if not is_confirmed_md5(md5_hash):
+            return None
+        for row in self.by_content.get((file_size, quick_hash), []):
+            if row.id not in self.taken and row.md5_hash == md5_hash:
+                self.taken.add(row.id)
+                return row
+        return None
+
+    def remaining(self) -> list:
+        return [row for row in self.rows if row.id not in self.taken]
+
+
+def _sync_folder(session: Session, writer: BulkWriter, root_dir: Path, folder: str,
+                 listing: dict[str, os.stat_result], existing: dict, pool: VanishedPool,
+                 hash_mode: str = 'tiered', workers: dict | None = None,
+                 stop: threading.Event | None = None) -> tuple[int, bool]:
+    """
+    按 (路径, 大小, 修改时间, inode) 比对磁盘与数据库，增量更新记录
+    - 比对与inode认领在当前线程完成，需要读取的文件交给扫描流水线
+    :param session: 只读会话，读取哈希缓存
+    :param writer: 批量写库缓冲
+    :param root_dir: 扫描的根目录路径
+    :param folder: 一级文件夹名
+    :param listing: 磁盘文件 {完整路径: stat}
+    :param existing: 文件夹下已有记录 {完整路径: row}
+    :param pool: 已消失记录，新文件优先从中认领
+    :param hash_mode: 指纹模式
+    :param workers: 各阶段线程数
+    :param stop: 扫描的停止标记，置位后不再读取新的文件
+    :return: (加入缩略图队列的文件数, 记录是否全部写入)
+    """
+    workers = {**DEFAULT_WORKERS, **(workers or {})}
+    stop = stop or threading.Event()
+    counts = {'added': 0, 'updated': 0, 'moved': 0, 'thumbs': 0}
+    jobs = []
+    failed = writer.failed
+
+    for file_path, stat in listing.items():
+        row = existing.get(file_path)
+        if row is not None and row.file_size == stat.st_size:
+            if row.mtime is None:
+                # 旧版本记录，大小一致时仅补全stat信息与抽样哈希
+                jobs.append(dict(kind='backfill', file_path=file_path, stat=stat, row=row))
+                continue
+            if row.mtime == stat.st_mtime and row.inode == stat.st_ino:
+                if row.deleted_at != 0:
+                    # 文件已回到原位置
+                    writer.update_file(row.id, {'deleted_at': 0})
+                continue
+
+        # 重命名/移动：沿用原记录，无需重新读取
+        source = pool.match_inode(Path(file_path), stat) if row is None else None
+        if source is not None:
+            values = _location_values(root_dir, folder, Path(file_path), stat)
+            if not _relocate(writer, root_dir, source, values):
+                _enqueue_thumb(writer, values, counts)
+            counts['moved'] += 1
+            continue
+
+        jobs.append(dict(kind='new' if row is None else 'update', file_path=file_path, stat=stat, row=row))
+
+    try:
+        _run_jobs(session, writer, root_dir, folder, jobs, pool, counts, hash_mode, workers, stop)
+        writer.flush()
+    except Exception as e:
+        # 写入失败不中断扫描，该文件夹不写入目录索引，下次扫描重新比对
+        error(f'(SCAN) 目录 [{folder}] 写库失败: {e}')
+        return counts['thumbs'], False
+
+    info(f'(SCAN) 目录 [{folder}] 新增 {counts["added"]}，更新 {counts["updated"]}，移动 {counts["moved"]}')
+    return counts['thumbs'], writer.failed == failed
+
+
+def _run_jobs(session: Session, writer: BulkWriter, root_dir: Path, folder: str, jobs: list[dict],
+              pool: VanishedPool, counts: dict, hash_mode: str, workers: dict, stop: threading.Event):
+    """
+    需要读取的文件经扫描流水线读取元数据、计算指纹后写库
+    - 停止后不再送入新任务，已在流水线中的任务跳过读取，直接排空
+    """
+    if jobs:
+        cache = load_hash_cache(session, [job['file_path'] for job in jobs])
+
+        def probe(job):
+            if job['kind'] == 'backfill' or stop.is_set():
+                return
+            if _is_media(job['file_path']):
+                job['probe'] = probe_media(job['file_path'], job['stat'])
+            job['values'] = _process_file(root_dir, folder, Path(job['file_path']), job['stat'], job.get('probe'))
+
+        def hash_(job):
+            if stop.is_set() or (job['kind'] != 'backfill' and job['values'] is None):
+                return
+            mode = 'tiered' if job['kind'] == 'backfill' else hash_mode
+            job['quick_hash'], job['md5_hash'], job['dirty'] = compute_fingerprint(
+                job['file_path'], job['stat'], mode, cache.get(job['file_path'])
+            )
+            if (job['kind'] == 'new' and job['md5_hash'] == PENDING_MD5
+                    and pool.has_content_candidates(job['stat'].st_size, job['quick_hash'])):
+                # 可能是移动来的文件，计算完整MD5与消失的记录比对
+                md5_hash = get_md5(job['file_path'])
+                if md5_hash:
+                    job['md5_hash'], job['dirty'] = md5_hash, True
+
+        def persist(job):
+            _persist_job(writer, root_dir, job, pool, counts)
+
+        jobs = itertools.takewhile(lambda _: not stop.is_set(), jobs)
+        run_pipeline(jobs, probe, hash_, persist,
+                     probe_workers=workers['probe'], hash_workers=workers['hash'])
+
+
+def _persist_job(writer: BulkWriter, root_dir: Path, job: dict, pool: VanishedPool, counts: dict):
+    """流水线写库阶段：写入单个文件的处理结果"""
+    if 'error' in job or 'quick_hash' not in job:
+        return
+    file_path, stat, row = job['file_path'], job['stat'], job['row']
+    if job['dirty']:
+        writer.upsert_hash(hash_cache_values(file_path, stat, job['quick_hash'], job['md5_hash']))
+
+    if job['kind'] == 'backfill':
+        writer.update_file(
+            row.id, {'mtime': stat.st_mtime, 'inode': stat.st_ino, 'quick_hash': job['quick_hash'], 'deleted_at': 0}
+        )
+        return
+
+    values = job['values']
+    values.update(quick_hash=job['quick_hash'], md5_hash=job['md5_hash'])
+    if row is None:
+        source = pool.match_content(values['file_size'], values['quick_hash'], values['md5_hash'])
+        if source is not None:
+            if not _relocate(writer, root_dir, source, values):
+                _enqueue_thumb(writer, values, counts)
+            counts['moved'] += 1
+            return
+        counts['added'] += 1
+    else:
+        counts['updated'] += 1
+    # 新增或内容可能已变化，重置派生数据
+    values.update(deleted_at=0, phash=None, placeholder=None)
+    writer.upsert_file(values)
+    debug(f'添加文件 {file_path}')
+    # 原位替换的文件可能保留了修改时间（cp -p、rsync -t等），已有缩略图不能按修改时间判断为最新
+    _enqueue_thumb(writer, values, counts, force=row is not None)
+
+
+def _is_media(file_path: str) -> bool:
+    return os.path.splitext(file_path)[1].lower() in IMAGE_EXT | VIDEO_EXT
+
+
+def _enqueue_thumb(writer: BulkWriter, values: dict, counts: dict, force: bool = False):
+    """媒体文件加入缩略图队列，force时忽略已有缩略图重新生成"""
+    if _is_media(values['file_path']):
+        writer.enqueue_thumb(values['file_path'], values['root_folder'], force)
+        counts['thumbs'] += 1
+
+
+def _location_values(root_dir: Path, folder: str, file_path: Path, stat: os.stat_result) -> dict:
+    """与文件位置相关的FileRecord字段"""
+    return dict(
+        file_path=str(file_path),
+        file=file_path.relative_to(root_dir).as_posix(),
+        root_folder=folder,
+        file_name=file_path.name,
+        mtime=stat.st_mtime,
+        inode=stat.st_ino
+    )
+
+
+def _relocate(writer: BulkWriter, root_dir: Path, source, values: dict) -> bool:
+    """
+    将消失的记录迁移到新路径，保留id、pHash与删除状态
+    - 新值的完整MD5尚未计算时保留原记录已确认的MD5
+    :return: 缩略图是否已随之迁移
+    """
+    if values.get('md5_hash') == PENDING_MD5:
+        values = {k: v for k, v in values.items() if k != 'md5_hash'}
+    writer.update_file(source.id, values)
+    writer.drop_hash(source.file_path)
+    debug(f'(SCAN) 识别移动 {source.file_path} -> {values["file_path"]}')
+    return move_thumbs(source.file_path, values['file_path'], str(root_dir))
+
+
+def _purge_vanished(db_writer: DbWriter, root_dir: Path, rows: list):
+    """删除已消失且未被认领的记录及其缩略图"""
+    if not rows:
+        return
+    removed = db_writer.run_background(_delete_records, [row.id for row in rows], [row.file_path for row in rows])
+    delete_thumbs(root_dir, [row.file_path for row in rows])
+    info(f'(SCAN) 移除已消失文件记录 {removed}')
+
+
+def _delete_records(session: Session, ids: list[int], file_paths: list[str]) -> int:
+    """删除文件记录及其哈希缓存"""
+    removed = 0
+    for i in range(0, len(ids), 500):
+        removed += session.query(FileRecord).filter(
+            FileRecord.id.in_(ids[i:i + 500])
+        ).delete(synchronize_session=False)
+    drop_hash_cache(session, file_paths)
+    return removed
+
+
+def _process_file(root_dir: Path, folder: str, file_path: Path, stat: os.stat_result,
+                  probe: MediaProbe | None = None) -> dict | None:
+    """读取单个文件的元数据，返回FileRecord字段（指纹由流水线下一阶段补充）"""
     try:
-        stat = file_path.stat()
         file_size = stat.st_size
         file_name = file_path.name
         ext = file_path.suffix.lower()
@@ -80,21 +472,17 @@ def _process_file(session: Session, root_dir: Path, folder: str, dirpath: Path,
         width, height = None, None
         if ext in IMAGE_EXT:
             file_type = 'image'
-            width, height = get_image_size(str(file_path))
         elif ext in VIDEO_EXT:
             file_type = 'video'
-            try:
-                width, height = get_video_dimensions(str(file_path))
-            except Exception as e:
-                width, height = None, None
         elif ext in TEXT_EXT:
             file_type = 'text'
 
         mime_type = get_mime_type(str(file_path))
         rel_path = file_path.relative_to(root_dir).as_posix()
-        md5_hash = get_md5(str(file_path)) or 'unknown'
+        if probe is not None:
+            width, height = probe.width, probe.height
 
-        record = FileRecord(
+        return dict(
             file_path=str(file_path),
             file=rel_path,
             root_folder=folder,
@@ -102,60 +490,17 @@ def _process_file(session: Session, root_dir: Path, folder: str, dirpath: Path,
             file_type=file_type,
             mime_type=mime_type,
             file_size=file_size,
-            md5_hash=md5_hash,
             width=width,
-            height=height
+            height=height,
+            mtime=stat.st_mtime,
+            inode=stat.st_ino
         )
-        session.merge(record)
-        debug(f'添加文件 {file_path}')
     except Exception as e:
         error(f'处理文件失败 {file_path} : {e}')
+        return None
 
 
 def get_mime_type(file_path: str) -> str:
     """获取文件MIME"""
     mime_type, _ = mimetypes.guess_type(file_path)
     return mime_type or 'application/octet-stream'
-
-
-def batch_thumbs(file_list, root_dir, workers: int = 8):
-    """批量生成两种尺寸的缩略图"""
-    root = Path(root_dir)
-    cache_dir = root / '.cache'
-
-    cache_dir.mkdir(parents=True, exist_ok=True)
-
-    # 检查目录是否可写
-    if not os.access(str(cache_dir), os.W_OK):
-        error(f"(THUMB) .cache目录不可写：{cache_dir}，停止生成缩略图")
-        return
-
-    (cache_dir / 'thumb').mkdir(parents=True, exist_ok=True)
-    (cache_dir / 'medium').mkdir(parents=True, exist_ok=True)
-
-    info(f"(THUMB) 开始缩略图任务 {len(file_list)}")
-
-    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as pool:
-        future_to_info = {}
-        for file_path in file_list:
-            f1 = pool.submit(make_thumb, file_path, root_dir, 300, 'thumb')
-            f2 = pool.submit(make_thumb, file_path, root_dir, 2000, 'medium')
-            future_to_info[f1] = (file_path, '小')
-            future_to_info[f2] = (file_path, '中等')
-
-        total_tasks = len(future_to_info)
-        completed = 0
-        report_step = max(1, total_tasks // 10)
-
-        for future in concurrent.futures.as_completed(future_to_info):
-            file_path, size_type = future_to_info[future]
-            completed += 1
-            try:
-                future.result()
-                debug(f"(THUMB) 成功：{size_type}图 [{Path(file_path).name}]")
-            except Exception as e:
-                error(f"(THUMB) 失败：{size_type}图 [{Path(file_path).name}] -> {e}")
-
-            if completed % report_step == 0 or completed == total_tasks:
-                percentage = (completed / total_tasks) * 100
-                info(f"(THUMB) 缩略图生成进度: {completed}/{total_tasks} ({percentage:.1f}%)")
\ No newline at end of file
@@ -1,244 +1,331 @@
+import base64
 import pyvips
 import subprocess
-import tempfile
 from pathlib import Path
 import os
+import threading
 from core.logger import debug, info, warning, error
-
-if os.name == 'nt':
-    CREATE_NO_WINDOW = subprocess.CREATE_NO_WINDOW
-else:
-    CREATE_NO_WINDOW = 0
+from utils.probe import MediaProbe, probe_media, CREATE_NO_WINDOW
 
 IMAGE_EXT = {'.jpg', '.jpeg', '.jpe', '.png', '.bmp', '.tiff'}
 GIF_EXT = {'.gif'}
 VIDEO_EXT = {'.mp4', '.avi', '.mov', '.mkv'}
 
 
-def get_image_dimensions(image_path: str) -> tuple[int, int]:
-    """获取图像的宽度和高度"""
-    try:
-        image_path = str(Path(image_path).resolve())
-        if not os.path.exists(image_path):
-            raise FileNotFoundError(f"图像文件不存在: {image_path}")
-
-        image = pyvips.Image.new_from_file(image_path, access='sequential')
-        return (image.width, image.height)
-    except Exception as e:
-        error(f"获取图像尺寸失败: {str(e)}，路径: {image_path}")
-        raise
+def pick_frame_time(probe: MediaProbe | None) -> float:
+    """选取代表帧时间点：时长的10%，最多30秒，避开片头黑屏"""
+    if probe is None or not probe.duration:
+        return 0
+    return min(probe.duration * 0.1, 30.0)
 
 
-def get_video_dimensions(video_path: str) -> tuple[int, int]:
-    """使用ffmpeg获取视频的宽度和高度"""
+def extract_video_frame(video_path: str, seek: float = 0) -> bytes | None:
+    """
+    使用ffmpeg提取一帧，经stdout以JPEG返回，不落地临时文件
+    - -ss 放在 -i 之前走输入端快速定位，长视频无需从第0帧解码
+    """
     try:
         video_path = str(Path(video_path).resolve())
-        if not os.path.exists(video_path):
-            raise FileNotFoundError(f"视频文件不存在: {video_path}")
-
-        result = subprocess.run(
-            [
-                "ffprobe", "-v", "error",
-                "-select_streams", "v:0",
-                "-show_entries", "stream=width,height",
-                "-of", "csv=p=0",
-                video_path
-            ],
-            check=True,
-            capture_output=True,
-            text=True,
-            creationflags=CREATE_NO_WINDOW
-        )
-        width, height = map(int, result.stdout.strip().split(','))
-        return (width, height)
-    except subprocess.CalledProcessError as e:
-        error(f"ffprobe命令执行失败: {e.stderr}，视频路径: {video_path}")
-        raise
-    except FileNotFoundError:
-        error("未找到ffprobe，请确保ffmpeg已安装并添加到系统PATH中")
-        raise
-    except Exception as e:
-        error(f"获取视频尺寸失败: {str(e)}，视频路径: {video_path}")
-        raise
-
-
-def extract_video_frame(video_path: str, output_frame_path: str) -> bool:
-    """使用ffmpeg从视频中提取第一帧作为图像"""
-    try:
-        video_path = str(Path(video_path).resolve())
-        output_frame_path = str(Path(output_frame_path).resolve())
 
         if not os.path.exists(video_path):
             error(f"视频文件不存在: {video_path}")
-            return False
-
-        # 输出目录验证
-        output_dir = os.path.dirname(output_frame_path)
-        os.makedirs(output_dir, exist_ok=True)
-
-        # 删除旧文件
-        if os.path.exists(output_frame_path):
-            os.remove(output_frame_path)
+            return None
 
         result = subprocess.run(
             [
-                "ffmpeg", "-y",
+                "ffmpeg", "-v", "error",
+                "-ss", f"{seek:.3f}",
                 "-i", video_path,
-                "-vframes", "1",
+                "-frames:v", "1",
                 "-q:v", "2",
-                output_frame_path
+                "-f", "image2pipe",
+                "-vcodec", "mjpeg",
+                "pipe:1"
             ],
             capture_output=True,
-            text=True,
             creationflags=CREATE_NO_WINDOW
         )
 
         if result.returncode != 0:
-            error(f"ffmpeg错误输出: {result.stderr}")
-            return False
+            error(f"ffmpeg错误输出: {result.stderr.decode(errors='replace')}")
+            return None
 
-        if not os.path.exists(output_frame_path) or os.path.getsize(output_frame_path) == 0:
-            error(
-                f"ffmpeg未生成有效文件: {output_frame_path} (大小: {os.path.getsize(output_frame_path) if os.path.exists(output_frame_path) else 0})")
-            return False
+        if not result.stdout:
+            # 定位超出时长时没有输出，退回首帧
+            if seek > 0:
+                return extract_video_frame(video_path, 0)
+            error(f"ffmpeg未输出有效帧: {video_path}")
+            return None
 
-        return True
+        return result.stdout
     except Exception as e:
         error(f"提取视频帧时发生错误: {str(e)}，视频路径: {video_path}")
-        return False
-
-
-def make_thumb(originalPath: str, rootDir: str, size: int, subdir: str) -> str:
-    """生成指定尺寸和子目录的缩略图"""
-    root = Path(rootDir)
+        return None
+
+
+# 内容寻址缩略图所在目录，位于各尺寸子目录下
+CONTENT_DIR = '.content'
+
+# 缩略图尺寸，按从大到小排列：小图由大图在内存中缩放得到
+THUMB_SIZES = {'medium': 2000, 'thumb': 300}
+
+# 可选的缩略图输出格式：{格式: (扩展名, MIME)}，按压缩率从高到低排列
+OUTPUT_FORMATS = {
+    'avif': ('.avif', 'image/avif'),
+    'webp': ('.webp', 'image/webp'),
+}
+
+
+def get_output_format(thumb_path: Path) -> str | None:
+    """缩略图路径对应的输出格式，与原始文件格式相同时为None"""
+    for fmt, (ext, _) in OUTPUT_FORMATS.items():
+        if thumb_path.name.endswith(ext):
+            return fmt
+    return None
+
+
+def negotiate_format(accept: str | None, formats: list[str]) -> str | None:
+    """
+    按请求头Accept选择输出格式
+    - 只选择客户端明确列出且q>0的格式，按OUTPUT_FORMATS顺序优先；否则使用原始格式
+    """
+    accepted = set()
+    for part in (accept or '').split(','):
+        media_type, _, params = part.strip().partition(';')
+        q = 1.0
+        for param in params.split(';'):
+            name, _, value = param.strip().partition('=')
+            if name == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0
+        if q > 0:
+            accepted.add(media_type.strip().lower())
+    for fmt, (_, mime) in OUTPUT_FORMATS.items():
+        if fmt in formats and mime in accepted:
+            return fmt
+    return None
+
+
+def get_thumb_path(originalPath: str, rootDir: str, subdir: str, content_key: str | None = None,
+                   fmt: str | None = None) -> Path:
+    """
+    计算原始文件对应的缩略图缓存路径
+    - 默认按原始文件相对路径存放
+    - 给出content_key（完整MD5）时按内容存放于 .cache/<subdir>/.content/<键前两位>/<键>，内容相同的文件共用
+      键须覆盖全部内容：抽样哈希只读取头/中/尾各64KB，其余部分不同的两个文件会误共用一份缩略图，
+      回收时也会被当作同一份；MD5意外碰撞的概率可以忽略
+    - 给出fmt时为该格式的副本，在默认路径后追加扩展名，如 a.png.webp
+    """
+    root = Path(rootDir).resolve()
     cache_dir = root / '.cache'
-    originalPath = str(Path(originalPath).resolve())  # 统一转为绝对路径
-
-    # 验证原始文件
-    if not os.path.exists(originalPath):
-        raise FileNotFoundError(f"原始文件不存在: {originalPath}")
 
     # 获取相对路径和原始文件扩展名
     try:
         rel_path = Path(originalPath).relative_to(root)
     except ValueError:
         # 处理原始文件不在rootDir的情况
-        rel_path = Path(originalPath).name
+        rel_path = Path(Path(originalPath).name)
     original_ext = rel_path.suffix.lower()
 
-    if original_ext in VIDEO_EXT:
-        output_ext = '.jpg'
-        is_video = True
-        is_gif = False
-    elif original_ext in GIF_EXT:
-        output_ext = '.jpg'
-        is_video = False
-        is_gif = True
+    if original_ext in VIDEO_EXT or original_ext in GIF_EXT:
+        # 视频与GIF取帧保存为jpg
+        media_thumb_name = f'{rel_path.stem}{original_ext}.jpg'
+        thumb_path = cache_dir / subdir / rel_path.parent / media_thumb_name
     elif original_ext in IMAGE_EXT:
-        output_ext = original_ext
-        is_video = False
-        is_gif = False
+        thumb_path = cache_dir / subdir / rel_path.with_suffix(original_ext)
     else:
         raise ValueError(f"不支持的文件类型: {originalPath} (扩展名: {original_ext})")
 
-    # 构建缩略图保存路径
-    if is_video or is_gif:
-        media_thumb_name = f'{rel_path.stem}{original_ext}{output_ext}'
-        thumb_path = cache_dir / subdir / rel_path.parent / media_thumb_name
-    else:
-        thumb_path = cache_dir / subdir / rel_path.with_suffix(output_ext)
+    if content_key:
+        thumb_path = cache_dir / subdir / CONTENT_DIR / content_key[:2] / f'{content_key}{thumb_path.suffix}'
+    if fmt:
+        thumb_path = thumb_path.with_name(thumb_path.name + OUTPUT_FORMATS[fmt][0])
+    return thumb_path.resolve()
 
-    thumb_path = thumb_path.resolve()
-    thumb_path.parent.mkdir(parents=True, exist_ok=True)
 
-    # 获取原始文件的尺寸
+def move_thumbs(srcPath: str, dstPath: str, rootDir: str) -> bool:
+    """随原始文件移动迁移缩略图缓存，返回全部尺寸是否迁移成功"""
     try:
-        if is_video:
-            original_width, original_height = get_video_dimensions(originalPath)
-        else:
-            original_width, original_height = get_image_dimensions(originalPath)
-        original_max_dim = max(original_width, original_height)
+        pairs = [
+            (get_thumb_path(srcPath, rootDir, subdir, fmt=fmt), get_thumb_path(dstPath, rootDir, subdir, fmt=fmt))
+            for subdir in THUMB_SIZES for fmt in (None, *OUTPUT_FORMATS)
+        ]
+    except ValueError:
+        return True  # 不生成缩略图的文件类型
+
+    moved = True
+    for src, dst in pairs:
+        if not src.exists():
+            # 其他格式的副本可能从未生成，不影响迁移结果
+            if get_output_format(src) is None:
+                moved = False
+            continue
+        try:
+            dst.parent.mkdir(parents=True, exist_ok=True)
+            os.replace(src, dst)
+        except OSError as e:
+            warning(f"(THUMB) 迁移缩略图失败 {src} -> {dst}: {e}")
+            moved = False
+    return moved
+
+
+# 占位预览图长边像素
+PLACEHOLDER_SIZE = 16
+
+
+def make_placeholder(thumb_path: str) -> str | None:
+    """由已生成的小缩略图得到占位预览图：长边16像素的WebP，base64编码，约一两百字节"""
+    try:
+        image = pyvips.Image.thumbnail(str(thumb_path), PLACEHOLDER_SIZE)
+        return base64.b64encode(image.write_to_buffer('.webp', Q=40)).decode()
     except Exception as e:
-        warning(f"无法获取原始文件尺寸，将使用默认缩放行为: {str(e)}")
-        original_max_dim = size + 1  # 强制使用缩放行为
+        warning(f"(THUMB) 生成占位图失败 {thumb_path}: {e}")
+        return None
+
+
+def _write_args(output_ext: str) -> dict:
+    """按输出格式设置保存参数"""
+    if output_ext in ('.jpg', '.jpeg'):
+        return {'Q': 85, 'interlace': True}
+    if output_ext == '.png':
+        return {'compression': 6}
+    if output_ext == '.webp':
+        return {'Q': 80}
+    if output_ext == '.avif':
+        return {'Q': 50}
+    return {}
+
+
+def _temp_path(thumb_path: Path) -> Path:
+    """同目录下的临时文件，保留扩展名以便libvips选择输出格式"""
+    return thumb_path.with_name(f'.{thumb_path.stem}.{os.getpid()}.{threading.get_ident()}{thumb_path.suffix}')
+
+
+def is_thumb_fresh(thumb_path: Path, source_stat: os.stat_result, content_key: str | None = None) -> bool:
+    """
+    缩略图的修改时间在生成时被设为原始文件的修改时间，二者一致即为最新
+    - 内容寻址的缩略图随内容确定，存在即为最新
+    """
+    if content_key:
+        return thumb_path.exists()
+    try:
+        return thumb_path.stat().st_mtime_ns == source_stat.st_mtime_ns
+    except OSError:
+        return False
 
-    # 缩放
-    if subdir == 'medium':
-        need_scaling = original_max_dim > 2000
-        target_size = 2000 if need_scaling else original_max_dim
-    else:
-        need_scaling = True
-        target_size = size
 
-    # 处理文件生成缩略图
-    temp_frame_path = None
-    try:
-        if is_video or is_gif:
-            # 创建临时文件目录
-            temp_dir = cache_dir / 'temp'
-            temp_dir.mkdir(parents=True, exist_ok=True)
-
-            # 创建临时文件
-            with tempfile.NamedTemporaryFile(suffix='.jpg', delete=False, dir=str(temp_dir)) as tmp_file:
-                temp_frame_path = tmp_file.name
-
-            # 验证临时文件
-            if not os.path.exists(temp_frame_path):
-                raise FileNotFoundError(f"临时文件创建失败: {temp_frame_path}")
-
-            # 提取帧
-            if not extract_video_frame(originalPath, temp_frame_path):
-                file_type = "视频" if is_video else "GIF"
-                raise Exception(f"无法从{file_type}中提取帧: {originalPath}")
-
-            # 再次验证视频帧文件
-            if not os.path.exists(temp_frame_path) or os.path.getsize(temp_frame_path) == 0:
-                raise FileNotFoundError(f"视频帧文件无效: {temp_frame_path}")
-
-            # 处理视频帧生成缩略图
-            if need_scaling:
-                image = pyvips.Image.thumbnail(temp_frame_path, target_size)
-            else:
-                image = pyvips.Image.new_from_file(temp_frame_path)
+def make_thumb(originalPath: str, rootDir: str, size: int, subdir: str, probe: MediaProbe | None = None,
+               force: bool = False, content_key: str | None = None, fmt: str | None = None) -> str:
+    """生成指定尺寸、子目录与格式的缩略图，probe为扫描阶段已读取的元数据"""
+    return make_thumbs(originalPath, rootDir, probe, {subdir: size}, force, content_key, (fmt,))[subdir]
+
+
+def make_thumbs(originalPath: str, rootDir: str, probe: MediaProbe | None = None,
+                sizes: dict[str, int] | None = None, force: bool = False,
+                content_key: str | None = None, formats: tuple | None = None) -> dict[str, str]:
+    """
+    解码一次原始文件，生成多个尺寸的缩略图
+    - 最大尺寸直接由原图（或视频帧）缩放并载入内存，其余尺寸由它继续缩小
+    - 视频帧经管道读入内存，GIF由libvips直接读取首帧
+    - 已是最新的缩略图直接跳过，全部最新时不解码原始文件
+    - medium 不放大原图，原图不超过目标尺寸时保持原尺寸
+    :param originalPath: 原始文件路径
+    :param rootDir: 根目录
+    :param probe: 扫描阶段已读取的元数据
+    :param sizes: {子目录: 尺寸}，默认 THUMB_SIZES
+    :param force: 忽略已有缓存强制重新生成
+    :param content_key: 内容寻址的键（完整MD5），为空时按原始文件路径存放
+    :param formats: 输出格式，None为与原始文件相同的格式，默认只生成该格式
+    :return: {子目录: 首个输出格式的缩略图路径}
+    """
+    sizes = sizes or THUMB_SIZES
+    formats = formats or (None,)
+    originalPath = str(Path(originalPath).resolve())  # 统一转为绝对路径
 
-            # 先将图像写入目标路径
-            write_args = {'Q': 85, 'interlace': True}  # JPG参数
-            image.write_to_file(str(thumb_path), **write_args)
+    # 验证原始文件
+    if not os.path.exists(originalPath):
+        raise FileNotFoundError(f"原始文件不存在: {originalPath}")
 
-            # 确认写入后再删除临时文件
-            if os.path.exists(temp_frame_path):
-                os.remove(temp_frame_path)
-            temp_frame_path = None  # 标记已删除
+    original_ext = Path(originalPath).suffix.lower()
+    is_video = original_ext in VIDEO_EXT
 
-        else:
-            # 处理图像文件
-            if need_scaling:
-                image = pyvips.Image.thumbnail(originalPath, target_size)
-            else:
-                image = pyvips.Image.new_from_file(originalPath)
+    # 构建缩略图保存路径
+    thumb_paths = {
+        (subdir, fmt): get_thumb_path(originalPath, rootDir, subdir, content_key, fmt)
+        for subdir in sizes for fmt in formats
+    }
+    result = {subdir: str(thumb_paths[subdir, formats[0]]) for subdir in sizes}
+    source_stat = os.stat(originalPath)
+    if not force:
+        thumb_paths = {
+            target: path for target, path in thumb_paths.items()
+            if not is_thumb_fresh(path, source_stat, content_key)
+        }
+        if not thumb_paths:
+            debug(f"(SKIP) 缩略图已是最新 [{Path(originalPath).name}]")
+            return result
+        sizes = {subdir: size for subdir, size in sizes.items() if any(d == subdir for d, _ in thumb_paths)}
+    for thumb_path in thumb_paths.values():
+        thumb_path.parent.mkdir(parents=True, exist_ok=True)
 
-            # 设置保存参数
-            write_args = {}
-            if output_ext in ('.jpg', '.jpeg'):
-                write_args['Q'] = 85
-                write_args['interlace'] = True
-            elif output_ext == '.png':
-                write_args['compression'] = 6
+    # 获取原始文件的尺寸
+    if probe is None:
+        probe = probe_media(originalPath)
+    original_max_dim = probe.max_dim
 
-            image.write_to_file(str(thumb_path), **write_args)
+    # 缩放：medium不放大原图，其余固定缩放；无法获取尺寸时使用默认缩放行为
+    need_scaling = {
+        subdir: subdir != 'medium' or original_max_dim is None or original_max_dim > size
+        for subdir, size in sizes.items()
+    }
+    order = sorted(sizes, key=lambda d: sizes[d], reverse=True)
+
+    # 处理文件生成缩略图
+    temp_paths = {}
+    try:
+        frame = None
+        if is_video:
+            frame = extract_video_frame(originalPath, pick_frame_time(probe))
+            if frame is None:
+                raise Exception(f"无法从视频中提取帧: {originalPath}")
+
+        # 只解码一次：最大尺寸载入内存，其余由它缩小
+        first = order[0]
+        if frame is not None:
+            if need_scaling[first]:
+                base = pyvips.Image.thumbnail_buffer(frame, sizes[first])
+            else:
+                base = pyvips.Image.new_from_buffer(frame, '')
+        elif need_scaling[first]:
+            base = pyvips.Image.thumbnail(originalPath, sizes[first])
+        else:
+            # libvips按文件名缓存载入结果，原始文件被替换后需重新读取
+            base = pyvips.Image.new_from_file(originalPath, revalidate=True).autorot()
+        base = base.copy_memory()
+
+        for subdir in order:
+            image = base
+            if subdir != first and need_scaling[subdir]:
+                image = base.thumbnail_image(sizes[subdir])
+            for fmt in formats:
+                if (subdir, fmt) not in thumb_paths:
+                    continue
+                # 先写入临时文件再替换，并发生成同一缩略图时读者不会读到不完整的文件
+                thumb_path = thumb_paths[subdir, fmt]
+                temp_path = temp_paths[subdir, fmt] = _temp_path(thumb_path)
+                image.write_to_file(str(temp_path), **_write_args(thumb_path.suffix.lower()))
+                # 记录来源版本，供下次判断是否最新
+                os.utime(temp_path, ns=(source_stat.st_atime_ns, source_stat.st_mtime_ns))
+                os.replace(temp_path, thumb_path)
 
     except Exception as e:
-        error(f"处理文件时出错: {str(e)}", exc_info=True)
+        error(f"处理文件时出错: {str(e)}")
         # 出错时尝试删除不完整的缩略图
-        if os.path.exists(str(thumb_path)):
-            os.remove(str(thumb_path))
+        for temp_path in temp_paths.values():
+            if os.path.exists(str(temp_path)):
+                os.remove(str(temp_path))
         raise
-    finally:
-        # 最终清理
-        if temp_frame_path and os.path.exists(temp_frame_path):
-            try:
-                os.remove(temp_frame_path)
-            except Exception as e:
-                error(f"删除临时文件失败: {str(e)}, 文件路径: {temp_frame_path}")
-
-    return str(thumb_path)
\ No newline at end of file
+
+    return result
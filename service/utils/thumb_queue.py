@@ -0,0 +1,301 @@
+import os
+import time
+import threading
+from collections import deque
+from pathlib import Path
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+from core.logger import debug, info, warning, error
+from database.models import ThumbJob, FileRecord
+from database.bulk_ops import enqueue_thumb_jobs
+from database.writer import DbWriter
+from utils.thumb import IMAGE_EXT, GIF_EXT, VIDEO_EXT, make_thumbs, make_placeholder
+from utils.fingerprint import ensure_md5
+
+# 优先级：数值越大越先处理
+PRIORITY_BACKGROUND = 0
+PRIORITY_VISIBLE = 10    # 正在浏览的文件夹
+PRIORITY_REQUESTED = 20  # 前端显式请求的文件
+
+MAX_ATTEMPTS = 5
+RETRY_BASE = 5     # 首次重试间隔（秒），之后每次翻倍
+RETRY_MAX = 600
+IDLE_WAIT = 5      # 队列为空时的轮询间隔（秒）
+THROUGHPUT_WINDOW = 60
+
+
+def retry_delay(attempts: int) -> float:
+    """第attempts次失败后的重试间隔"""
+    return min(RETRY_BASE * 2 ** (attempts - 1), RETRY_MAX)
+
+
+def prioritize_folder(session: Session, folder: str, priority: int = PRIORITY_VISIBLE) -> int:
+    """提升文件夹内待处理任务的优先级"""
+    return session.query(ThumbJob).filter(
+        ThumbJob.root_folder == folder,
+        ThumbJob.status == 'pending',
+        ThumbJob.priority < priority
+    ).update({ThumbJob.priority: priority}, synchronize_session=False)
+
+
+def forced_paths(session: Session, file_paths: list[str]) -> set[str]:
+    """
+    原始文件内容已变化、缩略图尚待重新生成的文件
+    - 已有缩略图的修改时间可能仍与原始文件一致，不能直接返回
+    """
+    forced = set()
+    for i in range(0, len(file_paths), 500):
+        forced.update(session.scalars(select(ThumbJob.file_path).where(
+            ThumbJob.file_path.in_(file_paths[i:i + 500]), ThumbJob.force == 1
+        )))
+    return forced
+
+
+def clear_force(session: Session, file_path: str):
+    """所有尺寸与格式的缩略图已当场重新生成，任务只需补充占位图"""
+    session.query(ThumbJob).filter(ThumbJob.file_path == file_path).update(
+        {ThumbJob.force: 0}, synchronize_session=False
+    )
+
+
+def prioritize_files(session: Session, file_paths: list[str], priority: int = PRIORITY_REQUESTED) -> int:
+    """提升指定文件待处理任务的优先级，失败的任务立即重试"""
+    updated = 0
+    for i in range(0, len(file_paths), 500):
+        updated += session.query(ThumbJob).filter(
+            ThumbJob.file_path.in_(file_paths[i:i + 500]),
+            ThumbJob.status != 'running'
+        ).update({
+            ThumbJob.priority: func.max(ThumbJob.priority, priority),
+            ThumbJob.status: 'pending',
+            ThumbJob.next_run: 0
+        }, synchronize_session=False)
+    return updated
+
+
+class ThumbQueue:
+    """
+    持久化的缩略图任务队列
+    - 任务保存在thumb_jobs表，与文件记录同一事务写入，服务重启后继续处理
+    - 按 (优先级, 入队时间) 取任务；失败按指数退避重试，超过次数标记为failed
+    - 缩略图生成后顺带为缺少占位图的记录生成占位图
+    - 取任务与出队都由写线程执行：多个工作线程同时取任务时合并在一个事务中，不会取到同一任务
+    """
+
+    def __init__(self, writer: DbWriter):
+        self.writer = writer
+        self.root_dir = None
+        self.layout = 'path'
+        self.formats = ()
+        self.workers = 0
+        self._threads = []
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._stats_lock = threading.Lock()
+        self._finished = deque()
+        self.completed = 0
+        self.errors = 0
+
+    def start(self, root_dir: str, workers: int = 8, layout: str = 'path', formats: list[str] | None = None):
+        """
+        启动工作线程，上次退出时执行中的任务重新排队
+        :param layout: 缩略图存放方式，content时按完整MD5存放，尚未计算的在执行任务时计算
+        :param formats: 原始格式之外同时生成的输出格式
+        """
+        cache_dir = Path(root_dir) / '.cache'
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        if not os.access(str(cache_dir), os.W_OK):
+            error(f"(THUMB) .cache目录不可写：{cache_dir}，停止生成缩略图")
+            return
+
+        # 上一轮停止时未等待的线程先退出，避免其正在执行的任务被重新排队后重复执行
+        self.stop(wait=True)
+        resumed, backfilled, pending = self.writer.run_background(self._resume)
+        if pending:
+            info(f'(THUMB) 恢复缩略图任务 {pending}（中断 {resumed}，补充占位图 {backfilled}）')
+
+        self.root_dir = str(root_dir)
+        self.layout = layout
+        self.formats = (None, *(formats or []))
+        self.workers = workers
+        # 每次启动使用新的停止标记：上一轮未等待退出的线程仍在执行任务时，不会因重新启动而继续运行
+        self._stop = stop = threading.Event()
+        self._threads = [
+            threading.Thread(target=self._work, args=(stop,), name=f'thumb-queue-{i}', daemon=True)
+            for i in range(workers)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def stop(self, wait: bool = False):
+        """停止工作线程，未完成的任务留在队列中；不等待时线程在当前任务结束后退出，下次start时等待"""
+        self._stop.set()
+        self._wake.set()
+        if wait:
+            for thread in self._threads:
+                thread.join()
+            self._threads = []
+
+    def notify(self):
+        """有新任务入队时唤醒空闲线程"""
+        self._wake.set()
+
+    def stats(self) -> dict:
+        """本进程工作线程的运行状态与吞吐量"""
+        with self._stats_lock:
+            self._trim(time.time())
+            recent = len(self._finished)
+        return {
+            'running': self.workers > 0 and not self._stop.is_set(),
+            'workers': self.workers,
+            'completed': self.completed,
+            'errors': self.errors,
+            'throughput': round(recent / THROUGHPUT_WINDOW, 2),
+        }
+
+    def status(self, session: Session, stats: dict | None = None) -> dict:
+        """
+        队列深度与吞吐量
+        :param stats: 执行任务的进程发布的stats()，缺省为本进程
+        """
+        counts = dict(session.query(ThumbJob.status, func.count()).group_by(ThumbJob.status).all())
+        prioritized = session.query(ThumbJob).filter(
+            ThumbJob.status == 'pending', ThumbJob.priority > PRIORITY_BACKGROUND
+        ).count()
+        if stats is None:
+            stats = self.stats()
+        return {
+            'running': stats['running'],
+            'workers': stats['workers'],
+            'pending': counts.get('pending', 0),
+            'prioritized': prioritized,
+            'in_progress': counts.get('running', 0),
+            'failed': counts.get('failed', 0),
+            'completed': stats['completed'],
+            'errors': stats['errors'],
+            'throughput': stats['throughput'],
+        }
+
+    def _resume(self, session: Session) -> tuple[int, int, int]:
+        """执行中的任务重新排队并补充占位图任务，返回 (中断数, 补充数, 待处理数)"""
+        resumed = session.query(ThumbJob).filter(ThumbJob.status == 'running').update(
+            {ThumbJob.status: 'pending', ThumbJob.requeued: 0}, synchronize_session=False
+        )
+        backfilled = self._backfill_placeholders(session)
+        pending = session.query(ThumbJob).filter(ThumbJob.status == 'pending').count()
+        return resumed, backfilled, pending
+
+    @staticmethod
+    def _backfill_placeholders(session: Session) -> int:
+        """缺少占位图的媒体文件加入队列，已在队列中的任务保持不变；无法生成占位图的文件已记为空字符串，不再加入"""
+        media_ext = IMAGE_EXT | GIF_EXT | VIDEO_EXT
+        rows = [
+            {'file_path': file_path, 'root_folder': root_folder}
+            for file_path, root_folder in session.query(FileRecord.file_path, FileRecord.root_folder).filter(
+                FileRecord.placeholder.is_(None),
+                FileRecord.file_type.in_(('image', 'video')),
+                FileRecord.deleted_at == 0
+            )
+            if os.path.splitext(file_path)[1].lower() in media_ext
+        ]
+        for i in range(0, len(rows), 500):
+            enqueue_thumb_jobs(session, rows[i:i + 500], retry=False)
+        return len(rows)
+
+    def _trim(self, now: float):
+        while self._finished and self._finished[0] < now - THROUGHPUT_WINDOW:
+            self._finished.popleft()
+
+    def _work(self, stop: threading.Event):
+        while not stop.is_set():
+            self._wake.clear()
+            try:
+                job = self.writer.run_background(self._claim)
+            except Exception as e:
+                error(f'(THUMB) 读取缩略图任务失败: {e}')
+                job = None
+            if job is None:
+                self._wake.wait(IDLE_WAIT)
+                continue
+            self._run(*job)
+
+    def _claim(self, session: Session) -> tuple[str, int, str | None, bool, bool] | None:
+        """取出一个可执行的任务并标记为执行中"""
+        job = session.query(
+            ThumbJob.file_path, ThumbJob.attempts, ThumbJob.force,
+            FileRecord.id, FileRecord.md5_hash, FileRecord.placeholder
+        ).outerjoin(FileRecord, FileRecord.file_path == ThumbJob.file_path).filter(
+            ThumbJob.status == 'pending',
+            ThumbJob.next_run <= time.time()
+        ).order_by(ThumbJob.priority.desc(), ThumbJob.created_at).first()
+        if job is None:
+            return None
+        session.query(ThumbJob).filter(ThumbJob.file_path == job.file_path).update(
+            {ThumbJob.status: 'running'}, synchronize_session=False
+        )
+        needs_placeholder = job.id is not None and job.placeholder is None
+        return job.file_path, job.attempts, job.md5_hash, needs_placeholder, bool(job.force)
+
+    def _run(self, file_path: str, attempts: int, md5_hash: str | None = None, needs_placeholder: bool = False,
+             force: bool = False):
+        """
+        执行任务：成功或文件已不存在时出队，失败时退避重试
+        :param md5_hash: 记录中的完整MD5，按内容存放时作为键，尚未计算时在此计算
+        """
+        values, placeholder = None, None
+        if os.path.exists(file_path):
+            try:
+                key = None
+                if self.layout == 'content':
+                    key = ensure_md5(file_path, md5_hash, self.writer)
+                    if key is None:
+                        raise OSError('无法读取文件计算MD5')
+                thumb_paths = make_thumbs(file_path, self.root_dir, content_key=key, formats=self.formats,
+                                          force=force)
+                if needs_placeholder:
+                    # 无法生成时记为空字符串，启动时不再反复补充
+                    placeholder = make_placeholder(thumb_paths['thumb']) or ''
+                debug(f"(THUMB) 成功：[{Path(file_path).name}]")
+            except Exception as e:
+                attempts += 1
+                if attempts >= MAX_ATTEMPTS:
+                    error(f"(THUMB) 失败：[{Path(file_path).name}] -> {e}，已重试 {attempts} 次，不再重试")
+                    values = {ThumbJob.status: 'failed'}
+                else:
+                    delay = retry_delay(attempts)
+                    warning(f"(THUMB) 失败：[{Path(file_path).name}] -> {e}，{delay} 秒后重试")
+                    values = {ThumbJob.status: 'pending', ThumbJob.next_run: time.time() + delay}
+                values.update({ThumbJob.attempts: attempts, ThumbJob.last_error: str(e)})
+
+        try:
+            self.writer.run_background(self._finish, file_path, values, placeholder)
+        except Exception as e:
+            error(f'(THUMB) 更新缩略图任务失败 {file_path}: {e}')
+
+        now = time.time()
+        with self._stats_lock:
+            if values is None:
+                self.completed += 1
+                self._finished.append(now)
+                self._trim(now)
+            else:
+                self.errors += 1
+
+    @staticmethod
+    def _finish(session: Session, file_path: str, values: dict | None, placeholder: str | None):
+        """
+        成功时出队并写入占位图，失败时更新重试状态
+        - 执行期间再次入队的任务重新排队，保留新请求的强制标记；占位图由旧内容生成，不写入
+        """
+        query = session.query(ThumbJob).filter(ThumbJob.file_path == file_path)
+        if query.filter(ThumbJob.requeued == 1).update(
+                {ThumbJob.status: 'pending', ThumbJob.requeued: 0}, synchronize_session=False):
+            return
+        if values is None:
+            query.delete(synchronize_session=False)
+            if placeholder is not None:
+                session.query(FileRecord).filter(FileRecord.file_path == file_path).update(
+                    {FileRecord.placeholder: placeholder}, synchronize_session=False
+                )
+        else:
+            query.update(values, synchronize_session=False)
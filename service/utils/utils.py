@@ -1,16 +1,37 @@
+import os
 import hashlib
 from PIL import Image
 
+HASH_CHUNK = 1024 * 1024
+SAMPLE_SIZE = 64 * 1024
+
 def get_md5(file_path):
     hash_md5 = hashlib.md5()
     try:
         with open(file_path, "rb") as f:
-            for chunk in iter(lambda: f.read(4096), b""):
+            for chunk in iter(lambda: f.read(HASH_CHUNK), b""):
                 hash_md5.update(chunk)
         return hash_md5.hexdigest()
     except Exception:
         return None
 
+def get_quick_hash(file_path, file_size=None):
+    """抽样哈希：文件大小 + 头/中/尾各64KB，小文件读取全文"""
+    try:
+        if file_size is None:
+            file_size = os.path.getsize(file_path)
+        hash_md5 = hashlib.md5(str(file_size).encode())
+        with open(file_path, "rb") as f:
+            if file_size <= SAMPLE_SIZE * 3:
+                hash_md5.update(f.read())
+            else:
+                for offset in (0, (file_size - SAMPLE_SIZE) // 2, file_size - SAMPLE_SIZE):
+                    f.seek(offset)
+                    hash_md5.update(f.read(SAMPLE_SIZE))
+        return hash_md5.hexdigest()
+    except Exception:
+        return None
+
 def get_image_size(file_path):
     try:
         with Image.open(file_path) as img: